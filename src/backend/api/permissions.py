@@ -54,11 +54,11 @@ class StockPermissions(permissions.BasePermission):
             return user_role.has_permission('can_view_stock')
 
         # Stocktake/Audit actions
-        elif view.action in ['start', 'complete', 'cancel', 'approve']:
+        elif view.action in ['start', 'generate_items', 'schedule_cycle_count', 'complete', 'cancel', 'approve']:
             # Allow managers, warehouse staff, and admins to manage stocktakes
             return user_role.role in ['admin', 'owner', 'warehouse', 'stocktake_manager']
 
-        elif view.action in ['items', 'count_item']:
+        elif view.action in ['items', 'count_item', 'count_batch', 'sync_snapshot', 'sync_changes', 'sync_upload']:
             # Allow any authenticated user with stock view permission to count items
             return user_role.has_permission('can_view_stock')
 
@@ -111,6 +111,15 @@ class PurchaseOrderPermissions(permissions.BasePermission):
         elif view.action in ['receive_items']:
             return user_role.has_permission('can_receive_purchase_order')
 
+        elif view.action == 'emails':
+            return user_role.has_permission('can_view_purchase_order')
+
+        elif view.action == 'reorder_suggestions':
+            return user_role.has_permission('can_view_purchase_order')
+
+        elif view.action == 'draft_from_suggestions':
+            return user_role.has_permission('can_create_purchase_order')
+
         return user_role.role in ['admin', 'owner']
 
 
@@ -135,7 +144,11 @@ class TransferPermissions(permissions.BasePermission):
         elif view.action == 'create':
             return user_role.has_permission('can_transfer_stock')
 
-        elif view.action in ['approve_transfer', 'complete_transfer', 'mark_collected']:
+        elif view.action == 'bulk_transfer' and not request.data.get('complete'):
+            # Pending bulk transfers follow the create permission
+            return user_role.has_permission('can_transfer_stock')
+
+        elif view.action in ['approve_transfer', 'complete_transfer', 'mark_collected', 'bulk_transfer']:
             # Transfer operations require warehouse or logistics permissions
             return user_role.role in ['admin', 'owner', 'warehouse', 'logistics', 'stocktake_manager']
 
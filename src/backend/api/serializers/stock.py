@@ -1,10 +1,11 @@
+from decimal import Decimal
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from stock.models import (
     Stock, Category, StockHistory, CommittedStock, StockReservation,
     StockLocation, Store, StockTransfer, UserRole, PurchaseOrder, PurchaseOrderItem,
     PurchaseOrderHistory, StockAudit, StockAuditItem, Manufacturer, DeliveryPerson,
-    Invoice, Payment
+    Invoice, Payment, EmailOutbox
 )
 
 
@@ -24,7 +25,7 @@ class ManufacturerSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'company_name', 'company_email', 'additional_email',
             'street_address', 'city', 'country', 'region', 'postal_code',
-            'company_telephone', 'abn', 'created_at', 'updated_at'
+            'company_telephone', 'abn', 'lead_time_days', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
 
@@ -98,7 +99,7 @@ class StockSerializer(serializers.ModelSerializer):
             'total_across_locations'
         ]
         read_only_fields = [
-            'last_updated', 'timestamp', 'total_stock', 'committed_stock',
+            'committed_quantity', 'last_updated', 'timestamp', 'total_stock', 'committed_stock',
             'reserved_quantity', 'available_for_sale', 'is_low_stock',
             'total_across_locations'
         ]
@@ -144,6 +145,28 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'full_name']
 
 
+def _allocate(model, validated_data, instance=None):
+    """
+    Create a commitment or reservation, or update ``instance``, through the
+    locking allocation service
+    """
+    from stock.utils.allocation import allocate, reallocate, InsufficientStock
+
+    # A stock passed to save() (e.g. from the URL) wins over the posted stock_id
+    stock = validated_data.pop('stock', None)
+    if stock is not None:
+        validated_data['stock_id'] = stock.pk
+
+    try:
+        if instance is not None:
+            return reallocate(instance, validated_data)
+        return allocate(model(**validated_data))
+    except InsufficientStock as e:
+        raise serializers.ValidationError(str(e))
+    except Stock.DoesNotExist:
+        raise serializers.ValidationError("Stock item not found.")
+
+
 class CommittedStockSerializer(serializers.ModelSerializer):
     """Serializer for CommittedStock model"""
     stock = StockSerializer(read_only=True)
@@ -166,22 +189,20 @@ class CommittedStockSerializer(serializers.ModelSerializer):
         return value
 
     def validate(self, data):
-        """Validate that stock has enough available quantity"""
+        """Validate that the stock item exists (availability is checked under lock on save)"""
         stock_id = data.get('stock_id')
-        quantity = data.get('quantity', 0)
 
-        if stock_id and quantity:
-            try:
-                stock = Stock.objects.get(id=stock_id)
-                if stock.available_for_sale < quantity:
-                    raise serializers.ValidationError(
-                        f"Not enough stock available. Available: {stock.available_for_sale}, Requested: {quantity}"
-                    )
-            except Stock.DoesNotExist:
-                raise serializers.ValidationError("Stock item not found.")
+        if stock_id and not Stock.objects.filter(id=stock_id).exists():
+            raise serializers.ValidationError("Stock item not found.")
 
         return data
 
+    def create(self, validated_data):
+        return _allocate(CommittedStock, validated_data)
+
+    def update(self, instance, validated_data):
+        return _allocate(CommittedStock, validated_data, instance)
+
 
 class StockReservationSerializer(serializers.ModelSerializer):
     """Serializer for StockReservation model"""
@@ -232,6 +253,12 @@ class StockReservationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Expiry date must be in the future.")
         return value
 
+    def create(self, validated_data):
+        return _allocate(StockReservation, validated_data)
+
+    def update(self, instance, validated_data):
+        return _allocate(StockReservation, validated_data, instance)
+
 
 class StockTransferSerializer(serializers.ModelSerializer):
     """Serializer for StockTransfer model"""
@@ -306,6 +333,34 @@ class StockTransferSerializer(serializers.ModelSerializer):
         return data
 
 
+class BulkTransferLineSerializer(serializers.Serializer):
+    """Serializer for one line of a bulk transfer"""
+    stock_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    to_aisle = serializers.CharField(max_length=50, required=False, allow_blank=True)
+
+
+class BulkTransferSerializer(serializers.Serializer):
+    """Serializer for moving many stock items between two stores"""
+    from_location_id = serializers.IntegerField()
+    to_location_id = serializers.IntegerField()
+    transfer_reason = serializers.CharField(max_length=255)
+    notes = serializers.CharField(required=False, allow_blank=True)
+    complete = serializers.BooleanField(default=False)
+    lines = BulkTransferLineSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        if data['from_location_id'] == data['to_location_id']:
+            raise serializers.ValidationError("From and to locations must be different.")
+
+        stores = Store.objects.in_bulk([data['from_location_id'], data['to_location_id']])
+        if len(stores) != 2:
+            raise serializers.ValidationError("Location not found.")
+        data['from_location'] = stores[data['from_location_id']]
+        data['to_location'] = stores[data['to_location_id']]
+        return data
+
+
 class StockIssueSerializer(serializers.Serializer):
     """Serializer for stock issue operations"""
     quantity = serializers.IntegerField(min_value=1)
@@ -425,6 +480,75 @@ class PurchaseOrderSerializer(serializers.ModelSerializer):
         return instance
 
 
+class PurchaseOrderListSerializer(serializers.ModelSerializer):
+    """Lightweight serializer for PurchaseOrder list view (excludes history and invoices)
+
+    Summary fields are computed from the prefetched ``items`` and ``invoices``
+    so the query count stays fixed per page.
+    """
+    items = PurchaseOrderItemSerializer(many=True, read_only=True)
+    created_by = UserSerializer(read_only=True)
+    manufacturer = serializers.StringRelatedField(read_only=True)
+    delivery_person = serializers.StringRelatedField(read_only=True)
+    store = serializers.StringRelatedField(read_only=True)
+    creating_store = serializers.StringRelatedField(read_only=True)
+    manufacturer_id = serializers.IntegerField(read_only=True)
+
+    # Summary fields
+    item_count = serializers.SerializerMethodField()
+    total_quantity = serializers.SerializerMethodField()
+    total_received_quantity = serializers.SerializerMethodField()
+    grand_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    receiving_status = serializers.CharField(source='overall_receiving_status', read_only=True)
+    payment_status = serializers.CharField(source='get_payment_status', read_only=True)
+    invoice_count = serializers.SerializerMethodField()
+    total_invoiced = serializers.SerializerMethodField()
+    total_paid = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PurchaseOrder
+        fields = [
+            'id', 'reference_number', 'manufacturer', 'manufacturer_id',
+            'delivery_person', 'delivery_type', 'creating_store', 'store',
+            'customer_name', 'status', 'created_by', 'created_at', 'updated_at',
+            'submitted_at', 'sent_at', 'items', 'item_count', 'total_quantity',
+            'total_received_quantity', 'grand_total', 'receiving_status',
+            'payment_status', 'invoice_count', 'total_invoiced', 'total_paid'
+        ]
+
+    def get_item_count(self, obj):
+        """Number of line items on the PO"""
+        return len(obj.items.all())
+
+    def get_total_quantity(self, obj):
+        """Total ordered quantity across all line items"""
+        return sum(item.quantity for item in obj.items.all())
+
+    def get_total_received_quantity(self, obj):
+        """Total received quantity across all line items"""
+        return sum(item.total_received_quantity for item in obj.items.all())
+
+    def get_invoice_count(self, obj):
+        """Number of invoices recorded against the PO"""
+        return len(obj.invoices.all())
+
+    def get_total_invoiced(self, obj):
+        """Total invoiced amount across all invoices"""
+        return sum(invoice.invoice_total for invoice in obj.invoices.all())
+
+    def get_total_paid(self, obj):
+        """Total amount paid across all invoices"""
+        return sum(invoice.total_paid for invoice in obj.invoices.all())
+
+
+class DraftPurchaseOrdersSerializer(serializers.Serializer):
+    """Serializer for drafting purchase orders from reorder suggestions"""
+    delivery_person_id = serializers.IntegerField()
+    store_id = serializers.IntegerField(required=False, allow_null=True)
+    creating_store_id = serializers.IntegerField(required=False, allow_null=True)
+    manufacturer_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=True)
+
+
 class StockAuditItemSerializer(serializers.ModelSerializer):
     """Serializer for StockAuditItem model"""
     stock = StockSerializer(read_only=True)
@@ -437,13 +561,63 @@ class StockAuditItemSerializer(serializers.ModelSerializer):
             'id', 'audit', 'stock', 'stock_id', 'system_quantity', 'committed_quantity',
             'reserved_quantity', 'physical_count', 'variance_quantity', 'counted_by',
             'count_date', 'variance_reason', 'variance_notes', 'adjustment_applied',
-            'adjustment_date', 'audit_location', 'audit_aisle', 'created_at', 'updated_at'
+            'adjustment_date', 'audit_location', 'audit_aisle', 'abc_class', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'variance_quantity', 'count_date', 'adjustment_date', 'created_at', 'updated_at'
         ]
 
 
+class AuditItemStockSerializer(serializers.ModelSerializer):
+    """Minimal stock fields shown on audit item lines"""
+
+    class Meta:
+        model = Stock
+        fields = ['id', 'item_name', 'sku']
+
+
+class StockAuditItemListSerializer(serializers.ModelSerializer):
+    """Slim serializer for audit item lists (no nested stock aggregates)"""
+    stock = AuditItemStockSerializer(read_only=True)
+
+    class Meta:
+        model = StockAuditItem
+        fields = [
+            'id', 'stock', 'system_quantity', 'committed_quantity', 'reserved_quantity',
+            'physical_count', 'variance_quantity', 'counted_by', 'count_date',
+            'variance_reason', 'variance_notes', 'adjustment_applied',
+            'audit_location', 'audit_aisle', 'abc_class', 'conflicting_count', 'version'
+        ]
+        read_only_fields = fields
+
+
+class AuditCountEntrySerializer(serializers.Serializer):
+    """Serializer for one line of a batch count submission"""
+    item_id = serializers.IntegerField(required=False)
+    sku = serializers.CharField(max_length=100, required=False)
+    barcode = serializers.CharField(max_length=100, required=False)
+    count = serializers.IntegerField(min_value=0)
+    notes = serializers.CharField(required=False, allow_blank=True)
+    variance_reason = serializers.ChoiceField(choices=StockAuditItem.VARIANCE_REASON_CHOICES, required=False)
+    # Version the device last saw for this line (offline uploads)
+    base_version = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, data):
+        if data.get('item_id') is None and not (data.get('sku') or data.get('barcode')):
+            raise serializers.ValidationError("One of item_id, sku or barcode is required.")
+        return data
+
+
+class AuditCountBatchSerializer(serializers.Serializer):
+    """Serializer for a batch count submission body"""
+    counts = AuditCountEntrySerializer(many=True, default=list)
+
+
+class AuditSyncUploadSerializer(AuditCountBatchSerializer):
+    """Serializer for an offline sync upload body"""
+    on_conflict = serializers.ChoiceField(choices=['flag', 'overwrite'], default='flag')
+
+
 class StockAuditSerializer(serializers.ModelSerializer):
     """Serializer for StockAudit model"""
     created_by = UserSerializer(read_only=True)
@@ -479,6 +653,7 @@ class StockAuditSerializer(serializers.ModelSerializer):
     # Workflow properties
     can_start = serializers.ReadOnlyField()
     can_complete = serializers.ReadOnlyField()
+    item_generation_percentage = serializers.ReadOnlyField()
 
     class Meta:
         model = StockAudit
@@ -490,12 +665,16 @@ class StockAuditSerializer(serializers.ModelSerializer):
             'total_items_counted', 'items_with_variances', 'total_variance_value',
             'created_at', 'updated_at', 'audit_items', 'audit_location_ids',
             'audit_category_ids', 'assigned_auditor_ids', 'progress_percentage',
-            'items_counted', 'total_items', 'can_start', 'can_complete'
+            'items_counted', 'total_items', 'can_start', 'can_complete',
+            'item_generation_status', 'item_generation_total', 'item_generation_percentage',
+            'item_generation_heartbeat', 'scheduled'
         ]
         read_only_fields = [
             'audit_reference', 'status', 'actual_start_date', 'actual_end_date',
             'total_items_planned', 'total_items_counted', 'items_with_variances',
-            'total_variance_value', 'created_at', 'updated_at', 'can_start', 'can_complete'
+            'total_variance_value', 'created_at', 'updated_at', 'can_start', 'can_complete',
+            'item_generation_status', 'item_generation_total', 'item_generation_percentage',
+            'item_generation_heartbeat', 'scheduled'
         ]
 
     def get_progress_percentage(self, obj):
@@ -543,6 +722,7 @@ class StockAuditListSerializer(serializers.ModelSerializer):
     # Workflow properties
     can_start = serializers.ReadOnlyField()
     can_complete = serializers.ReadOnlyField()
+    item_generation_percentage = serializers.ReadOnlyField()
 
     class Meta:
         model = StockAudit
@@ -553,12 +733,15 @@ class StockAuditListSerializer(serializers.ModelSerializer):
             'created_by', 'assigned_auditors', 'approved_by', 'total_items_planned',
             'total_items_counted', 'items_with_variances', 'total_variance_value',
             'created_at', 'updated_at', 'progress_percentage',
-            'can_start', 'can_complete'
+            'can_start', 'can_complete', 'item_generation_status',
+            'item_generation_total', 'item_generation_percentage', 'item_generation_heartbeat', 'scheduled'
         ]
         read_only_fields = [
             'audit_reference', 'status', 'actual_start_date', 'actual_end_date',
             'total_items_planned', 'total_items_counted', 'items_with_variances',
-            'total_variance_value', 'created_at', 'updated_at', 'can_start', 'can_complete'
+            'total_variance_value', 'created_at', 'updated_at', 'can_start', 'can_complete',
+            'item_generation_status', 'item_generation_total', 'item_generation_percentage',
+            'item_generation_heartbeat', 'scheduled'
         ]
 
     def get_progress_percentage(self, obj):
@@ -594,6 +777,14 @@ class PaymentSerializer(serializers.ModelSerializer):
         return data
 
 
+class BankMatchSerializer(serializers.Serializer):
+    """Serializer for an accepted bank reconciliation match"""
+    invoice = serializers.IntegerField()
+    payment_reference = serializers.CharField(max_length=100)
+    payment_date = serializers.DateField()
+    payment_amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+
+
 class InvoiceSerializer(serializers.ModelSerializer):
     """Serializer for Invoice model"""
     created_by = UserSerializer(read_only=True)
@@ -627,3 +818,17 @@ class InvoiceSerializer(serializers.ModelSerializer):
             else:
                 data['invoice_file'] = instance.invoice_file.url
         return data
+
+
+class EmailOutboxSerializer(serializers.ModelSerializer):
+    """Serializer for EmailOutbox delivery status"""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+
+    class Meta:
+        model = EmailOutbox
+        fields = [
+            'id', 'subject', 'recipients', 'status', 'status_display', 'attempts',
+            'max_attempts', 'next_attempt_at', 'last_error', 'sent_at',
+            'purchase_order', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
@@ -16,7 +16,7 @@ from .views.stock import (
     CommittedStockViewSet, StockReservationViewSet, StockTransferViewSet,
     ManufacturerViewSet, DeliveryPersonViewSet, StockLocationViewSet
 )
-from .views.purchase_orders import PurchaseOrderViewSet, InvoiceViewSet, PaymentViewSet
+from .views.purchase_orders import PurchaseOrderViewSet, InvoiceViewSet, PaymentViewSet, EmailOutboxViewSet
 from .views.stocktake import StockAuditViewSet
 from .views.auth import user_profile, update_profile, user_permissions, check_permission
 from .views.health import health_check
@@ -38,6 +38,7 @@ router.register(r'transfers', StockTransferViewSet, basename='stocktransfer')
 router.register(r'purchase-orders', PurchaseOrderViewSet, basename='purchaseorder')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'email-outbox', EmailOutboxViewSet, basename='emailoutbox')
 router.register(r'stock-audits', StockAuditViewSet, basename='stockaudit')
 
 # API patterns
@@ -3,9 +3,13 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch
 
-from stock.models import PurchaseOrder, PurchaseOrderItem, PurchaseOrderHistory, Stock, StockLocation, Store
-from ..serializers.stock import PurchaseOrderSerializer, PurchaseOrderItemSerializer
+from stock.models import (
+    PurchaseOrder, PurchaseOrderItem, PurchaseOrderHistory, Stock, StockLocation, Store,
+    Invoice, Payment
+)
+from ..serializers.stock import PurchaseOrderSerializer, PurchaseOrderListSerializer, PurchaseOrderItemSerializer
 from ..permissions import PurchaseOrderPermissions
 
 
@@ -18,10 +22,38 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'updated_at', 'reference_number']
     ordering = ['-created_at']
 
+    def get_serializer_class(self):
+        """Use lightweight serializer for list view; full nested serializer otherwise"""
+        if self.action == 'list':
+            return PurchaseOrderListSerializer
+        return PurchaseOrderSerializer
+
     def get_queryset(self):
-        return PurchaseOrder.objects.select_related(
+        """Prefetch everything the chosen serializer touches so query count stays fixed per page"""
+        queryset = PurchaseOrder.objects.select_related(
             'created_by', 'manufacturer', 'delivery_person', 'store', 'creating_store'
-        ).prefetch_related('items')
+        )
+
+        if self.action == 'list':
+            # Summary fields only need items and invoice totals
+            return queryset.prefetch_related('items', 'invoices')
+
+        return queryset.prefetch_related(
+            'items',
+            Prefetch(
+                'history',
+                queryset=PurchaseOrderHistory.objects.select_related('created_by')
+            ),
+            Prefetch(
+                'invoices',
+                queryset=Invoice.objects.select_related('created_by').prefetch_related(
+                    Prefetch(
+                        'payments',
+                        queryset=Payment.objects.select_related('created_by')
+                    )
+                )
+            ),
+        )
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -38,17 +70,45 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        purchase_order.status = 'sent'
-        purchase_order.sent_by = request.user
+        from django.db import transaction
         from django.utils import timezone
-        purchase_order.sent_at = timezone.now()
-        purchase_order.save()
+        from stock.utils.email_service import queue_purchase_order_email
+
+        with transaction.atomic():
+            # Email goes through the outbox; delivery happens after commit
+            email, recipient_emails = queue_purchase_order_email(purchase_order, request.user)
+
+            purchase_order.status = 'sent'
+            purchase_order.sent_by = request.user
+            purchase_order.sent_at = timezone.now()
+            purchase_order.save()
+
+            PurchaseOrderHistory.objects.create(
+                purchase_order=purchase_order,
+                action='sent',
+                notes=f'Purchase order sent to {", ".join(recipient_emails)}',
+                created_by=request.user
+            )
 
         return Response({
-            'message': 'Purchase order sent successfully',
+            'message': 'Purchase order marked as sent; the email is pending delivery',
+            'email_id': email.id,
+            'email_status': email.status,
             'purchase_order': self.get_serializer(purchase_order).data
         })
 
+    @action(detail=True, methods=['get'])
+    def emails(self, request, pk=None):
+        """
+        Get delivery status of emails queued for this purchase order
+
+        GET /api/v1/purchase-orders/{id}/emails/
+        """
+        from ..serializers.stock import EmailOutboxSerializer
+
+        purchase_order = self.get_object()
+        return Response(EmailOutboxSerializer(purchase_order.emails.all(), many=True).data)
+
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         """Approve purchase order"""
@@ -290,6 +350,74 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['get'], url_path='reorder-suggestions')
+    def reorder_suggestions(self, request):
+        """
+        Get reorder suggestions grouped by manufacturer
+
+        GET /api/v1/purchase-orders/reorder-suggestions/
+        Query: ?refresh=true to recompute instead of using the nightly result
+        """
+        from stock.utils.reorder import get_reorder_suggestions, refresh_reorder_suggestions
+
+        if request.query_params.get('refresh') == 'true':
+            suggestions = refresh_reorder_suggestions()
+        else:
+            suggestions = get_reorder_suggestions()
+
+        return Response(suggestions)
+
+    @action(detail=False, methods=['post'], url_path='reorder-suggestions/draft')
+    def draft_from_suggestions(self, request):
+        """
+        Create draft purchase orders from the current reorder suggestions
+
+        POST /api/v1/purchase-orders/reorder-suggestions/draft/
+        Body: {
+            "delivery_person_id": 1,
+            "store_id": 2,              # optional delivery location
+            "creating_store_id": 2,     # optional, defaults to store_id
+            "manufacturer_ids": [3, 4]  # optional, defaults to all suppliers
+        }
+        """
+        from stock.models import DeliveryPerson
+        from stock.utils.reorder import get_reorder_suggestions, create_draft_purchase_orders
+        from ..serializers.stock import DraftPurchaseOrdersSerializer
+
+        serializer = DraftPurchaseOrdersSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        try:
+            delivery_person = DeliveryPerson.objects.get(id=data['delivery_person_id'])
+            store_id = data.get('store_id')
+            store = Store.objects.get(id=store_id) if store_id else None
+            creating_store_id = data.get('creating_store_id')
+            creating_store = Store.objects.get(id=creating_store_id) if creating_store_id else None
+        except (DeliveryPerson.DoesNotExist, Store.DoesNotExist):
+            return Response(
+                {'error': 'Delivery person or store not found'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        purchase_orders = create_draft_purchase_orders(
+            get_reorder_suggestions(),
+            user=request.user,
+            delivery_person=delivery_person,
+            store=store,
+            creating_store=creating_store,
+            manufacturer_ids=data.get('manufacturer_ids'),
+        )
+
+        return Response({
+            'message': f'Created {len(purchase_orders)} draft purchase orders',
+            'purchase_orders': [
+                {'id': po.id, 'reference_number': po.reference_number, 'manufacturer_id': po.manufacturer_id}
+                for po in purchase_orders
+            ]
+        }, status=status.HTTP_201_CREATED)
+
 class InvoiceViewSet(viewsets.ModelViewSet):
     """ViewSet for Invoice model"""
     permission_classes = [IsAuthenticated]
@@ -299,10 +427,11 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
 
     def get_queryset(self):
-        from stock.models import Invoice
         return Invoice.objects.select_related(
             'purchase_order', 'created_by'
-        ).prefetch_related('payments')
+        ).prefetch_related(
+            Prefetch('payments', queryset=Payment.objects.select_related('created_by'))
+        )
 
     def get_serializer_class(self):
         from ..serializers.stock import InvoiceSerializer
@@ -384,6 +513,109 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['get'])
+    def aging(self, request):
+        """
+        Accounts payable aging by manufacturer and age band (cached per day)
+
+        GET /api/v1/invoices/aging/?refresh=true
+        """
+        from stock.utils.payables import get_ap_aging
+
+        refresh = request.query_params.get('refresh', 'false').lower() == 'true'
+        return Response(get_ap_aging(refresh=refresh))
+
+    @action(detail=False, methods=['get'], url_path='aging/export')
+    def aging_export(self, request):
+        """
+        Stream the invoice-level aging detail as CSV
+
+        GET /api/v1/invoices/aging/export/
+        """
+        from django.http import StreamingHttpResponse
+        from django.utils import timezone
+        from stock.utils.payables import stream_ap_aging_csv
+
+        today = timezone.localdate()
+        response = StreamingHttpResponse(stream_ap_aging_csv(today), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="AP_Aging_{today.isoformat()}.csv"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='reconcile/preview')
+    def reconcile_preview(self, request):
+        """
+        Match a bank statement CSV against open invoices without saving
+
+        POST /api/v1/invoices/reconcile/preview/ (multipart, field "file")
+        """
+        from stock.utils.payables import parse_bank_csv, match_bank_lines
+
+        uploaded_file = request.FILES.get('file')
+        if not uploaded_file:
+            return Response(
+                {'error': 'A bank statement CSV file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            lines = match_bank_lines(parse_bank_csv(uploaded_file))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = {}
+        for line in lines:
+            summary[line['status']] = summary.get(line['status'], 0) + 1
+
+        return Response({
+            'total_lines': len(lines),
+            'summary': summary,
+            'lines': lines,
+        })
+
+    @action(detail=False, methods=['post'], url_path='reconcile/commit')
+    def reconcile_commit(self, request):
+        """
+        Record accepted reconciliation matches as payments in one transaction
+
+        POST /api/v1/invoices/reconcile/commit/
+        Body: {"matches": [{"invoice": 1, "payment_reference": "...", "payment_date": "2025-01-31",
+                            "payment_amount": "100.00"}, ...], "payment_method": "bank_transfer"}
+        """
+        from stock.utils.payables import record_bank_matches
+        from ..serializers.stock import BankMatchSerializer, PaymentSerializer
+
+        serializer = BankMatchSerializer(data=request.data.get('matches', []), many=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            return Response(
+                {'error': 'No matches provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        payment_method = request.data.get('payment_method', 'bank_transfer')
+        if payment_method not in dict(Payment.PAYMENT_METHOD_CHOICES):
+            return Response(
+                {'error': f'Invalid payment method: {payment_method}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            payments, errors = record_bank_matches(serializer.validated_data, request.user, payment_method)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not payments:
+            return Response(
+                {'error': 'No payments recorded', 'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'message': f'{len(payments)} payments recorded',
+            'payments': PaymentSerializer(payments, many=True, context={'request': request}).data,
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED)
+
 
 class PaymentViewSet(viewsets.ModelViewSet):
     """ViewSet for Payment model"""
@@ -403,3 +635,67 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Record many payments in a single transaction
+
+        POST /api/v1/payments/bulk/
+        Body: {"payments": [{"invoice": 1, "payment_reference": "...", ...}, ...]}
+        """
+        from stock.models import Payment
+
+        serializer = self.get_serializer(data=request.data.get('payments', []), many=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            return Response(
+                {'error': 'No payments provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        payments = Payment.bulk_record([
+            Payment(created_by=request.user, **data) for data in serializer.validated_data
+        ])
+
+        return Response({
+            'message': f'{len(payments)} payments recorded',
+            'payments': self.get_serializer(payments, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class EmailOutboxViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for checking outbox email delivery status"""
+    permission_classes = [IsAuthenticated, PurchaseOrderPermissions]
+    filterset_fields = ['status', 'purchase_order']
+    search_fields = ['subject']
+    ordering_fields = ['created_at', 'next_attempt_at', 'sent_at']
+    ordering = ['-created_at']
+
+    def get_queryset(self):
+        from stock.models import EmailOutbox
+        return EmailOutbox.objects.select_related('purchase_order', 'created_by')
+
+    def get_serializer_class(self):
+        from ..serializers.stock import EmailOutboxSerializer
+        return EmailOutboxSerializer
+
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Re-queue a failed email for immediate delivery"""
+        from stock.utils.email_service import schedule_outbox_drain
+
+        email = self.get_object()
+        if not email.retry():
+            return Response(
+                {'error': 'Only failed emails can be retried'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        schedule_outbox_drain()
+        email.refresh_from_db()
+
+        return Response({
+            'message': 'Email queued for retry; it is pending until delivered',
+            'email': self.get_serializer(email).data
+        })
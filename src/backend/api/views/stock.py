@@ -5,7 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
 from django.db.models import Q, Sum, F
-from django.db import models
+from django.db import models, transaction
 
 from stock.models import (
     Stock, Category, StockHistory, CommittedStock, StockReservation,
@@ -14,7 +14,7 @@ from stock.models import (
 from ..serializers.stock import (
     StockSerializer, CategorySerializer, StockHistorySerializer,
     CommittedStockSerializer, StockReservationSerializer, StockLocationSerializer,
-    StockTransferSerializer, StoreSerializer, StockIssueSerializer,
+    StockTransferSerializer, BulkTransferSerializer, StoreSerializer, StockIssueSerializer,
     StockReceiveSerializer, ManufacturerSerializer, DeliveryPersonSerializer
 )
 from ..permissions import (
@@ -374,20 +374,17 @@ class CommittedStockViewSet(viewsets.ModelViewSet):
         """
         commitment = self.get_object()
 
-        if commitment.is_fulfilled:
-            return Response({'error': 'Commitment is already fulfilled'},
-                          status=status.HTTP_400_BAD_REQUEST)
-
-        commitment.is_fulfilled = True
-        commitment.fulfilled_at = timezone.now()
-        commitment.save()
+        with transaction.atomic():
+            # Re-read under lock so a concurrent fulfil is not applied twice
+            commitment = CommittedStock.objects.select_for_update().select_related('stock').get(pk=commitment.pk)
+            if commitment.is_fulfilled:
+                return Response({'error': 'Commitment is already fulfilled'},
+                              status=status.HTTP_400_BAD_REQUEST)
 
-        # Update stock committed quantity
-        stock = commitment.stock
-        stock.committed_quantity = stock.commitments.filter(is_fulfilled=False).aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
-        stock.save(update_fields=['committed_quantity'])
+            # Releases the commitment's units from the stock's committed_quantity
+            commitment.is_fulfilled = True
+            commitment.fulfilled_at = timezone.now()
+            commitment.save()
 
         return Response({
             'message': 'Commitment fulfilled successfully',
@@ -455,6 +452,9 @@ class StockReservationViewSet(viewsets.ModelViewSet):
 
         GET /api/v1/reservations/active/
         """
+        from stock.utils.reservations import expire_due_reservations_without_worker
+        expire_due_reservations_without_worker()
+
         queryset = self.get_queryset().filter(
             status='active',
             expires_at__gt=timezone.now()
@@ -475,17 +475,19 @@ class StockReservationViewSet(viewsets.ModelViewSet):
 
         GET /api/v1/reservations/expired/
         """
+        from stock.utils.reservations import expire_due_reservations_without_worker
+        expire_due_reservations_without_worker()
+
+        # Overdue reservations the sweep has not reached yet are included
         queryset = self.get_queryset().filter(
-            status='active',
-            expires_at__lte=timezone.now()
+            Q(status='expired') | Q(status='active', expires_at__lte=timezone.now())
         )
 
-        # Auto-expire them
-        for reservation in queryset:
-            reservation.expire()
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
 
-        # Refresh and serialize
-        queryset = queryset.filter(status='expired')
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -505,6 +507,8 @@ class StockTransferViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
     filterset_fields = ['status', 'transfer_type', 'from_location', 'to_location', 'created_by']
 
+    BULK_TRANSFER_LIMIT = 1000
+
     def perform_create(self, serializer):
         """Set created_by field when creating transfer"""
         serializer.save(created_by=self.request.user)
@@ -537,16 +541,66 @@ class StockTransferViewSet(viewsets.ModelViewSet):
         """
         transfer = self.get_object()
 
-        if transfer.can_be_completed():
-            transfer.complete(request.user)
+        if not transfer.can_be_completed():
+            return Response({'error': 'Transfer cannot be completed'},
+                          status=status.HTTP_400_BAD_REQUEST)
+
+        if transfer.complete(request.user):
             return Response({
                 'message': 'Transfer completed successfully',
                 'transfer': StockTransferSerializer(transfer).data
             })
 
-        return Response({'error': 'Transfer cannot be completed'},
+        return Response({'error': 'Transfer cannot be completed: not enough stock at the source location'},
                       status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_transfer(self, request):
+        """
+        Create restock transfers for many items between two stores in one request,
+        optionally completing them at once
+
+        POST /api/v1/transfers/bulk/
+        """
+        from stock.utils.transfers import create_bulk_transfer, InsufficientLocationStock
+
+        serializer = BulkTransferSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        if len(data['lines']) > self.BULK_TRANSFER_LIMIT:
+            return Response(
+                {'error': f'At most {self.BULK_TRANSFER_LIMIT} lines per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            result = create_bulk_transfer(
+                from_store=data['from_location'],
+                to_store=data['to_location'],
+                lines=data['lines'],
+                user=request.user,
+                transfer_reason=data['transfer_reason'],
+                notes=data.get('notes'),
+                complete=data['complete'],
+            )
+        except InsufficientLocationStock as e:
+            return Response({
+                'error': 'Not enough stock at source location',
+                'shortages': [
+                    {'stock_id': stock_id, 'available': available, 'requested': requested}
+                    for stock_id, available, requested in e.shortages
+                ]
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'Bulk transfer completed' if data['complete'] else 'Bulk transfer created',
+            **result
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'], url_path='collect')
     def mark_collected(self, request, pk=None):
         """
@@ -556,8 +610,7 @@ class StockTransferViewSet(viewsets.ModelViewSet):
         """
         transfer = self.get_object()
 
-        if transfer.can_be_collected():
-            transfer.mark_collected(request.user)
+        if transfer.can_be_collected() and transfer.mark_collected(request.user):
             return Response({
                 'message': 'Transfer marked as collected',
                 'transfer': StockTransferSerializer(transfer).data
@@ -13,11 +13,20 @@ class StockAuditViewSet(viewsets.ModelViewSet):
     """ViewSet for StockAudit model"""
     serializer_class = StockAuditSerializer
     permission_classes = [IsAuthenticated, StockPermissions]
-    filterset_fields = ['status', 'audit_type']
+    filterset_fields = ['status', 'audit_type', 'scheduled']
     search_fields = ['audit_reference', 'title', 'description']
     ordering_fields = ['created_at', 'planned_start_date', 'planned_end_date']
     ordering = ['-created_at']
 
+    COUNT_BATCH_LIMIT = 1000
+    ITEMS_MAX_PAGE_SIZE = 500
+    ITEM_LIST_FIELDS = [
+        'id', 'audit', 'stock', 'stock__id', 'stock__item_name', 'stock__sku',
+        'system_quantity', 'committed_quantity', 'reserved_quantity', 'physical_count',
+        'variance_quantity', 'counted_by', 'count_date', 'variance_reason', 'variance_notes',
+        'adjustment_applied', 'audit_location', 'audit_aisle', 'abc_class', 'conflicting_count', 'version'
+    ]
+
     def get_serializer_class(self):
         """Use lightweight serializer to avoid loading all audit items"""
         # Always use list serializer since we fetch items separately via /items/ endpoint
@@ -56,6 +65,64 @@ class StockAuditViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=True, methods=['post'], url_path='generate-items')
+    def generate_items(self, request, pk=None):
+        """
+        Re-run audit item generation, e.g. after a failed or lost run (existing items are kept)
+
+        A pending or running generation that has reported no progress for
+        StockAudit.ITEM_GENERATION_STALE_MINUTES is treated as lost and re-queued.
+        """
+        from stock.utils.audits import queue_audit_item_generation
+
+        audit = self.get_object()
+
+        if audit.status not in ['planned', 'in_progress']:
+            return Response(
+                {'error': 'Audit items can only be generated for planned or in-progress audits'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if audit.item_generation_active:
+            return Response(
+                {'error': 'Audit item generation is already in progress'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queue_audit_item_generation(audit)
+        return Response({
+            'message': 'Audit item generation queued',
+            'audit': self.get_serializer(audit).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='schedule-cycle-count')
+    def schedule_cycle_count(self, request):
+        """Create today's ABC cycle-count audit now instead of waiting for the nightly run"""
+        from stock.utils.cycle_counts import schedule_cycle_count
+
+        capacity = request.data.get('capacity')
+        try:
+            capacity = int(capacity) if capacity is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'capacity must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            audit = schedule_cycle_count(capacity=capacity, user=request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if audit is None:
+            return Response(
+                {'error': 'A cycle count is already scheduled for today or no items are due'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'message': 'Cycle count scheduled',
+            'audit': self.get_serializer(audit).data
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
         """Complete stock audit"""
@@ -121,33 +188,82 @@ class StockAuditViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def items(self, request, pk=None):
-        """Get paginated audit items for a stocktake"""
+        """
+        List audit items with search, filters and paging
+
+        GET /api/v1/stock-audits/{id}/items/
+        Query params:
+            sku: exact SKU (jump to a scanned item)
+            search: SKU prefix, item name or aisle
+            status: counted | uncounted | variance
+            after: keyset cursor (the last item id of the previous page)
+            page: offset page number, used when no cursor is given
+            page_size: items per page (max 500)
+        """
+        from django.db.models import Q
+        from ..serializers.stock import StockAuditItemListSerializer
+
         audit = self.get_object()
 
-        # Get query parameters for pagination
-        page = int(request.query_params.get('page', 1))
-        page_size = int(request.query_params.get('page_size', 50))
+        try:
+            page_size = min(max(int(request.query_params.get('page_size', 50)), 1), self.ITEMS_MAX_PAGE_SIZE)
+            after = request.query_params.get('after')
+            after = int(after) if after not in (None, '') else None
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            return Response(
+                {'error': 'page, page_size and after must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Get all items for this audit
-        items = StockAuditItem.objects.filter(audit=audit).select_related(
-            'stock', 'counted_by'
+        # Ordered by (audit, id) so paging walks the index without joining stock
+        items = StockAuditItem.objects.filter(audit=audit).select_related('stock').only(
+            *self.ITEM_LIST_FIELDS
         ).order_by('id')
 
-        # Calculate pagination
+        sku = request.query_params.get('sku', '').strip()
+        if sku:
+            items = items.filter(stock__sku=sku)
+
+        search = request.query_params.get('search', '').strip()
+        if search:
+            items = items.filter(
+                Q(stock__sku__istartswith=search) |
+                Q(stock__item_name__icontains=search) |
+                Q(audit_aisle__iexact=search)
+            )
+
+        item_status = request.query_params.get('status')
+        if item_status == 'counted':
+            items = items.filter(physical_count__isnull=False)
+        elif item_status == 'uncounted':
+            items = items.filter(physical_count__isnull=True)
+        elif item_status == 'variance':
+            items = items.filter(physical_count__isnull=False).exclude(variance_quantity=0)
+
+        if after is not None:
+            # Keyset page: no COUNT and no OFFSET scan
+            rows = list(items.filter(id__gt=after)[:page_size + 1])
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            return Response({
+                'results': StockAuditItemListSerializer(rows, many=True).data,
+                'next_after': rows[-1].id if has_more else None,
+                'page_size': page_size,
+            })
+
         total_items = items.count()
         total_pages = (total_items + page_size - 1) // page_size
         start_idx = (page - 1) * page_size
-        end_idx = start_idx + page_size
-
-        # Get paginated items
-        paginated_items = items[start_idx:end_idx]
+        rows = list(items[start_idx:start_idx + page_size])
 
         return Response({
-            'results': StockAuditItemSerializer(paginated_items, many=True).data,
+            'results': StockAuditItemListSerializer(rows, many=True).data,
             'count': total_items,
             'current_page': page,
             'total_pages': total_pages,
             'page_size': page_size,
+            'next_after': rows[-1].id if rows and start_idx + page_size < total_items else None,
         })
 
     @action(detail=True, methods=['post'])
@@ -171,30 +287,160 @@ class StockAuditViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        from django.db import transaction
+        from django.utils import timezone
+
+        with transaction.atomic():
+            # Locked so a concurrent recount of the same item sees this count as its previous state
+            try:
+                audit_item = StockAuditItem.objects.select_for_update().get(
+                    id=item_id,
+                    audit=audit
+                )
+            except StockAuditItem.DoesNotExist:
+                return Response(
+                    {'error': 'Audit item not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+            before = audit_item.statistics_contribution
+
+            # Update the audit item
+            audit_item.physical_count = counted_quantity
+            audit_item.variance_notes = notes
+            audit_item.counted_by = request.user
+            audit_item.count_date = timezone.now()
+            audit_item.version = StockAudit.allocate_sync_versions(audit.pk)
+            audit_item.save()
+
+            # Adjust total_items_counted, items_with_variances, etc. by this count only
+            StockAudit.apply_statistics_delta(
+                audit.pk, **StockAuditItem.statistics_delta(before, audit_item.statistics_contribution)
+            )
+
+        return Response({
+            'message': 'Item counted successfully',
+            'audit_item': StockAuditItemSerializer(audit_item).data
+        })
+
+    @action(detail=True, methods=['post'], url_path='count-batch')
+    def count_batch(self, request, pk=None):
+        """
+        Submit many counts in one request (e.g. a scanner syncing its buffer)
+
+        POST /api/v1/stock-audits/{id}/count-batch/
+        Body: {"counts": [{"item_id": 1, "count": 5}, {"sku": "ABC-1", "count": 0, "notes": "..."}, ...]}
+        """
+        from stock.utils.audits import record_counts
+        from ..serializers.stock import AuditCountBatchSerializer
+
+        audit = self.get_object()
+
+        if audit.status != 'in_progress':
+            return Response(
+                {'error': 'Can only count items in active audits'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = AuditCountBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        counts = serializer.validated_data['counts']
+        if not counts:
+            return Response(
+                {'error': 'No counts provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(counts) > self.COUNT_BATCH_LIMIT:
+            return Response(
+                {'error': f'At most {self.COUNT_BATCH_LIMIT} counts per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = record_counts(audit, counts, request.user)
+        counted = sum(1 for result in results if result['status'] == 'counted')
+
+        return Response({
+            'counted': counted,
+            'not_found': len(results) - counted,
+            'results': results,
+        })
+
+    @action(detail=True, methods=['get'], url_path='sync/snapshot')
+    def sync_snapshot(self, request, pk=None):
+        """
+        Download every audit item for offline counting
+
+        GET /api/v1/stock-audits/{id}/sync/snapshot/
+        Response: gzip-compressed JSON lines; the first line carries the sync version
+        """
+        return self._sync_response(self.get_object(), since=None)
+
+    @action(detail=True, methods=['get'], url_path='sync/changes')
+    def sync_changes(self, request, pk=None):
+        """
+        Download audit items changed since a sync version
+
+        GET /api/v1/stock-audits/{id}/sync/changes/?since=<version>
+        """
         try:
-            audit_item = StockAuditItem.objects.get(
-                id=item_id,
-                audit=audit
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'since must be the integer version from a previous sync'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except StockAuditItem.DoesNotExist:
+        return self._sync_response(self.get_object(), since=since)
+
+    def _sync_response(self, audit, since):
+        from django.http import StreamingHttpResponse
+        from stock.utils.audits import stream_sync_lines
+
+        response = StreamingHttpResponse(stream_sync_lines(audit, since=since), content_type='application/x-ndjson')
+        response['Content-Encoding'] = 'gzip'
+        response['Cache-Control'] = 'no-store'
+        return response
+
+    @action(detail=True, methods=['post'], url_path='sync/upload')
+    def sync_upload(self, request, pk=None):
+        """
+        Upload counts made offline, with conflict detection
+
+        POST /api/v1/stock-audits/{id}/sync/upload/
+        Body: {"on_conflict": "flag" | "overwrite",
+               "counts": [{"item_id": 1, "count": 5, "base_version": 42}, ...]}
+        A line conflicts when it changed on the server after base_version:
+        "overwrite" applies the upload anyway (last writer wins), "flag" keeps
+        the server count and stores the upload as conflicting_count for review.
+        """
+        from stock.utils.audits import record_counts
+        from ..serializers.stock import AuditSyncUploadSerializer
+
+        audit = self.get_object()
+
+        if audit.status != 'in_progress':
             return Response(
-                {'error': 'Audit item not found'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Can only count items in active audits'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Update the audit item
-        from django.utils import timezone
-        audit_item.physical_count = counted_quantity
-        audit_item.variance_notes = notes
-        audit_item.counted_by = request.user
-        audit_item.count_date = timezone.now()
-        audit_item.save()
-
-        # Update audit statistics (total_items_counted, items_with_variances, etc.)
-        audit.update_statistics()
-        audit.save()
+        serializer = AuditSyncUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        counts = serializer.validated_data['counts']
+        if len(counts) > self.COUNT_BATCH_LIMIT:
+            return Response(
+                {'error': f'At most {self.COUNT_BATCH_LIMIT} counts per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = record_counts(
+            audit, counts, request.user, on_conflict=serializer.validated_data['on_conflict']
+        )
+        audit.refresh_from_db(fields=['sync_version'])
 
         return Response({
-            'message': 'Item counted successfully',
-            'audit_item': StockAuditItemSerializer(audit_item).data
-        })
\ No newline at end of file
+            'version': audit.sync_version,
+            'counted': sum(1 for result in results if result['status'] == 'counted'),
+            'conflicts': sum(1 for result in results if result['status'] == 'conflict'),
+            'not_found': sum(1 for result in results if result['status'] == 'not_found'),
+            'results': results,
+        })
@@ -5,7 +5,7 @@ from .models import (
     Stock, Category, Country, State, City, Person, Contacts, Product, 
     PurchaseOrder, PurchaseOrderItem, Manufacturer, DeliveryPerson, Store, 
     PurchaseOrderHistory, CommittedStock, StockTransfer, StockLocation, UserRole,
-    StockReservation, StockAudit, StockAuditItem
+    StockReservation, StockAudit, StockAuditItem, EmailOutbox
 )
 from .form import StockCreateForm  # Make sure this is the correct import path
 
@@ -83,7 +83,7 @@ class ProductAdmin(admin.ModelAdmin):
 # Manufacturer Admin
 @admin.register(Manufacturer)
 class ManufacturerAdmin(admin.ModelAdmin):
-    list_display = ('company_name', 'company_email', 'company_telephone')
+    list_display = ('company_name', 'company_email', 'company_telephone', 'lead_time_days')
     search_fields = ('company_name', 'company_email')
 
 # Delivery Person Admin
@@ -125,8 +125,8 @@ class UserRoleInline(admin.StackedInline):
 # UserRole Admin
 @admin.register(UserRole)
 class UserRoleAdmin(admin.ModelAdmin):
-    list_display = ('user', 'role', 'created_at')
-    list_filter = ('role',)
+    list_display = ('user', 'role', 'notification_digest', 'created_at')
+    list_filter = ('role', 'notification_digest')
     search_fields = ('user__username',)
 
 # Custom User Admin with Role Inline
@@ -223,3 +223,13 @@ class StockAuditItemAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('audit', 'stock', 'counted_by')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'purchase_order', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject', 'purchase_order__reference_number')
+    readonly_fields = ('attempts', 'last_error', 'sent_at', 'created_at', 'updated_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('purchase_order', 'created_by')
@@ -1316,25 +1316,19 @@ class AuditItemBulkCountForm(forms.Form):
     
     def save(self, audit, counted_by):
         """Save the bulk counts to audit items"""
-        from django.utils import timezone
-        updated_items = []
+        from .utils.audits import record_counts
         
+        entries = []
         for field_name, value in self.cleaned_data.items():
             if field_name and field_name.startswith('count_') and value is not None:
                 item_id_str = field_name.replace('count_', '')
                 if item_id_str.isdigit():  # Ensure we have a valid numeric ID
-                    try:
-                        audit_item = audit.audit_items.get(id=int(item_id_str))
-                        audit_item.physical_count = value
-                        audit_item.variance_quantity = value - audit_item.system_quantity
-                        audit_item.counted_by = counted_by
-                        audit_item.count_date = timezone.now()
-                        audit_item.save()
-                        updated_items.append(audit_item)
-                    except (StockAuditItem.DoesNotExist, ValueError):
-                        continue
+                    entries.append({'item_id': int(item_id_str), 'count': value})
         
-        return updated_items
+        if not entries:
+            return []
+        results = record_counts(audit, entries, counted_by)
+        return [result['item_id'] for result in results if result['status'] == 'counted']
 
 
 # ----------------------------
@@ -0,0 +1,37 @@
+"""
+Django management command to deliver pending outbox emails
+Usage: python manage.py drain_email_outbox [--batch-size 50] [--once]
+"""
+
+from django.core.management.base import BaseCommand
+from stock.utils.email_service import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send due emails from the outbox; use where no Celery worker drains it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Emails sent over each mail connection'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send a single batch instead of draining until nothing is due'
+        )
+
+    def handle(self, *args, **options):
+        sent = failed = 0
+        while True:
+            result = drain_outbox(batch_size=options['batch_size'])
+            sent += result['sent']
+            failed += result['failed']
+            if options['once'] or result['sent'] + result['failed'] < options['batch_size']:
+                break
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} emails failed and will be retried"))
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} outbox emails"))
@@ -0,0 +1,23 @@
+"""
+Django management command to send low-stock alerts
+Usage: python manage.py evaluate_low_stock
+"""
+
+from django.core.management.base import BaseCommand
+from stock.utils.low_stock import evaluate_low_stock
+
+
+class Command(BaseCommand):
+    help = 'Send one aggregated alert for stock items that have dropped to their re-order level since the last run'
+
+    def handle(self, *args, **options):
+        result = evaluate_low_stock()
+
+        if result.get('skipped'):
+            self.stdout.write(self.style.WARNING('Skipped: Redis is unavailable'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['low_items']} items low ({result['new_items']} new), "
+            f"{result['low_locations']} locations low ({result['new_locations']} new)"
+        ))
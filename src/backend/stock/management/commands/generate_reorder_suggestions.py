@@ -0,0 +1,47 @@
+"""
+Django management command to recompute reorder suggestions
+Usage: python manage.py generate_reorder_suggestions [--window-days 90] [--cover-days 30]
+"""
+
+from django.core.management.base import BaseCommand
+from stock.utils.reorder import refresh_reorder_suggestions, DEFAULT_WINDOW_DAYS, DEFAULT_COVER_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Recompute reorder suggestions from issue history and cache them for the dashboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--window-days',
+            type=int,
+            default=DEFAULT_WINDOW_DAYS,
+            help='Days of issue history used to compute consumption velocity'
+        )
+        parser.add_argument(
+            '--cover-days',
+            type=int,
+            default=DEFAULT_COVER_DAYS,
+            help='Days of cover to order on top of the lead time'
+        )
+
+    def handle(self, *args, **options):
+        suggestions = refresh_reorder_suggestions(
+            window_days=options['window_days'],
+            cover_days=options['cover_days']
+        )
+
+        self.stdout.write(
+            f"Evaluated {suggestions['items_evaluated']} stock items"
+        )
+        for group in suggestions['manufacturers']:
+            self.stdout.write(
+                f"  {group['manufacturer_name']}: {len(group['items'])} items to reorder"
+            )
+        if suggestions['unassigned']:
+            self.stdout.write(self.style.WARNING(
+                f"  {len(suggestions['unassigned'])} items need reordering but have no known manufacturer"
+            ))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {suggestions['suggestion_count']} reorder suggestions"
+        ))
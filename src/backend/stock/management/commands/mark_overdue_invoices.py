@@ -0,0 +1,15 @@
+"""
+Django management command to mark pending invoices past their due date as overdue
+Usage: python manage.py mark_overdue_invoices
+"""
+
+from django.core.management.base import BaseCommand
+from stock.utils.payables import mark_overdue_invoices
+
+
+class Command(BaseCommand):
+    help = 'Flip pending invoices past their due date to overdue; use where no Celery beat runs the sweep'
+
+    def handle(self, *args, **options):
+        updated = mark_overdue_invoices()
+        self.stdout.write(self.style.SUCCESS(f"Marked {updated} invoices overdue"))
@@ -0,0 +1,34 @@
+"""
+Django management command to repair drifted committed quantities
+Usage: python manage.py reconcile_committed_quantities [--dry-run]
+"""
+
+from django.core.management.base import BaseCommand
+from stock.utils.allocation import reconcile_committed_quantities
+
+
+class Command(BaseCommand):
+    help = 'Reset Stock.committed_quantity to the total of each item\'s unfulfilled commitments where they differ'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted items without changing them'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        drifted = reconcile_committed_quantities(dry_run=dry_run)
+
+        for stock_id, item_name, stored, correct in drifted:
+            self.stdout.write(f"  {item_name} (#{stock_id}): {stored} -> {correct}")
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"DRY RUN - {len(drifted)} items have drifted committed quantities"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Reconciled committed quantity for {len(drifted)} items"
+            ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0050_update_po_status_choices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='manufacturer',
+            name='lead_time_days',
+            field=models.PositiveIntegerField(default=14, help_text='Typical days from order to delivery, used for reorder suggestions'),
+        ),
+    ]
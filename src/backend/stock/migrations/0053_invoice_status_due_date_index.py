@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0052_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='stock_invoi_status_f4bb7c_idx'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('purchase_order_created', 'Purchase Order Created'), ('purchase_order_confirmed', 'Purchase Order Confirmed'), ('stock_transfer_initiated', 'Stock Transfer Initiated'), ('stock_transfer_completed', 'Stock Transfer Completed'), ('stock_committed', 'Stock Committed'), ('stock_received', 'Stock Received'), ('po_items_received', 'Purchase Order Items Received'), ('stock_audit_started', 'Stock Audit Started'), ('stock_audit_completed', 'Stock Audit Completed'), ('invoice_created', 'Invoice Created'), ('payment_made', 'Payment Made'), ('invoice_overdue', 'Invoice Overdue'), ('stock_low', 'Low Stock Alert'), ('reservation_created', 'Stock Reservation Created'), ('reservation_expired', 'Stock Reservation Expired')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0053_invoice_status_due_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userrole',
+            name='notification_digest',
+            field=models.BooleanField(default=False, help_text='Collapse notifications into one row per type per day'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='collapse_key',
+            field=models.CharField(blank=True, help_text='Events sharing this key are counted on one unread notification', max_length=150, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='occurrence_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['collapse_key', 'created_at'], name='stock_notif_collaps_6acd7e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['is_read', 'read_at'], name='stock_notif_is_read_e52649_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['related_object_type', 'related_object_id'], name='stock_notif_related_2970e8_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0054_notification_collapse_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockaudit',
+            name='item_generation_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='stockaudit',
+            name='item_generation_total',
+            field=models.IntegerField(default=0, help_text='Stock items in scope when item generation started'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0055_stockaudit_item_generation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockaudititem',
+            index=models.Index(fields=['audit', 'id'], name='stock_stock_audit_i_8a5fc2_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0056_stockaudititem_audit_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockaudit',
+            name='sync_version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stockaudititem',
+            name='version',
+            field=models.BigIntegerField(default=0, help_text='Audit sync version of the last change to this item'),
+        ),
+        migrations.AddField(
+            model_name='stockaudititem',
+            name='conflicting_count',
+            field=models.IntegerField(blank=True, help_text='Offline count that conflicted with a newer count, awaiting review', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='stockaudititem',
+            index=models.Index(fields=['audit', 'version'], name='stock_stock_audit_i_704f83_idx'),
+        ),
+    ]
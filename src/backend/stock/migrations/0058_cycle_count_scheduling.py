@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0057_stockaudit_sync_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockaudit',
+            name='scheduled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='stockaudititem',
+            name='abc_class',
+            field=models.CharField(blank=True, choices=[('A', 'A'), ('B', 'B'), ('C', 'C')], max_length=1, null=True),
+        ),
+    ]
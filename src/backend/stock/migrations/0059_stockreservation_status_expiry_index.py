@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0058_cycle_count_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='stock_stock_status_0f843a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0059_stockreservation_status_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockaudit',
+            name='item_generation_heartbeat',
+            field=models.DateTimeField(blank=True, help_text='Last progress reported by item generation', null=True),
+        ),
+    ]
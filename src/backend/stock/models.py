@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
+import json
 
 # ----------------------------
 # User Role & Permission Models
@@ -25,6 +27,7 @@ class UserRole(models.Model):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_user_roles')
+    notification_digest = models.BooleanField(default=False, help_text="Collapse notifications into one row per type per day")
     
     class Meta:
         verbose_name = 'User Role'
@@ -337,28 +340,31 @@ class Stock(models.Model):
             return 0
     
     def add_to_location(self, store, quantity, aisle=None):
-        """Add quantity to a specific location"""
-        location, created = self.locations.get_or_create(
-            store=store,
-            defaults={'quantity': 0, 'aisle': aisle}
-        )
-        location.quantity += quantity
-        if aisle:
-            location.aisle = aisle
-        location.save()
+        """Add quantity to a specific location (an F() increment, safe under concurrency)"""
+        with transaction.atomic():
+            location, created = self.locations.get_or_create(
+                store=store,
+                defaults={'quantity': quantity, 'aisle': aisle}
+            )
+            if not created:
+                changes = {'quantity': models.F('quantity') + quantity, 'last_updated': timezone.now()}
+                if aisle:
+                    changes['aisle'] = aisle
+                StockLocation.objects.filter(pk=location.pk).update(**changes)
+                location.refresh_from_db(fields=['quantity', 'aisle', 'last_updated'])
         return location
     
     def remove_from_location(self, store, quantity):
-        """Remove quantity from a specific location"""
-        try:
-            location = self.locations.get(store=store)
-            if location.quantity >= quantity:
-                location.quantity -= quantity
-                location.save()
-                return True
-            return False
-        except StockLocation.DoesNotExist:
-            return False
+        """
+        Remove quantity from a specific location with one conditional UPDATE.
+        Returns False, changing nothing, if the location holds less than quantity.
+        """
+        return bool(StockLocation.objects.filter(
+            stock=self, store=store, quantity__gte=quantity
+        ).update(
+            quantity=models.F('quantity') - quantity,
+            last_updated=timezone.now()
+        ))
     
     def save(self, *args, **kwargs):
         """Override save to automatically track stock changes in history"""
@@ -373,6 +379,15 @@ class Stock(models.Model):
                 old_quantity = old_stock.quantity or 0
             except Stock.DoesNotExist:
                 old_quantity = 0
+            else:
+                # committed_quantity is maintained by commitment deltas; a full
+                # save must not write back the value loaded with this instance
+                if kwargs.get('update_fields') is None and not kwargs.get('force_insert') and not args:
+                    kwargs['update_fields'] = [
+                        field.name for field in self._meta.concrete_fields
+                        if not field.primary_key and field.name != 'committed_quantity'
+                    ]
+                    self.committed_quantity = old_stock.committed_quantity
         
         # Save the stock record first
         super().save(*args, **kwargs)
@@ -476,13 +491,55 @@ class CommittedStock(models.Model):
         status = "Fulfilled" if self.is_fulfilled else "Active"
         return f"{self.stock.item_name} - {self.quantity}pcs - {self.customer_order_number} ({status})"
     
+    @property
+    def committed_contribution(self):
+        """Units this commitment adds to its stock's committed_quantity"""
+        return 0 if self.is_fulfilled else (self.quantity or 0)
+
+    @staticmethod
+    def apply_committed_delta(stock_id, delta):
+        """Adjust a stock's committed_quantity by a signed delta in one UPDATE"""
+        if delta:
+            Stock.objects.filter(pk=stock_id).update(
+                committed_quantity=Coalesce(models.F('committed_quantity'), models.Value(0)) + delta
+            )
+
     def save(self, *args, **kwargs):
-        # Update the stock's committed_quantity when saving
-        super().save(*args, **kwargs)
-        self.stock.committed_quantity = self.stock.commitments.filter(is_fulfilled=False).aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
-        self.stock.save(update_fields=['committed_quantity'])
+        # Keep the stock's committed_quantity in step with a signed delta
+        # instead of re-aggregating every commitment of the stock
+        with transaction.atomic():
+            before = None
+            if not self._state.adding:
+                # The stored row, locked, so concurrent fulfils apply the delta once
+                before = CommittedStock.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'stock_id', 'quantity', 'is_fulfilled'
+                ).first()
+            super().save(*args, **kwargs)
+
+            if before is not None:
+                before_stock_id, before_quantity, before_fulfilled = before
+                if before_stock_id != self.stock_id:
+                    self.apply_committed_delta(before_stock_id, 0 if before_fulfilled else -before_quantity)
+                    delta = self.committed_contribution
+                else:
+                    delta = self.committed_contribution - (0 if before_fulfilled else before_quantity)
+            else:
+                delta = self.committed_contribution
+            self.apply_committed_delta(self.stock_id, delta)
+
+        if delta and CommittedStock.stock.is_cached(self):
+            self.stock.committed_quantity = (self.stock.committed_quantity or 0) + delta
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            before = CommittedStock.objects.select_for_update().filter(pk=self.pk).values_list(
+                'stock_id', 'quantity', 'is_fulfilled'
+            ).first()
+            result = super().delete(*args, **kwargs)
+            if before is not None:
+                stock_id, quantity, fulfilled = before
+                self.apply_committed_delta(stock_id, 0 if fulfilled else -quantity)
+        return result
 
 
 class StockReservation(models.Model):
@@ -533,6 +590,10 @@ class StockReservation(models.Model):
         ordering = ['-reserved_at']
         verbose_name = 'Stock Reservation'
         verbose_name_plural = 'Stock Reservations'
+        indexes = [
+            # Expiry sweep: active reservations past their expiry time
+            models.Index(fields=['status', 'expires_at']),
+        ]
     
     def __str__(self):
         return f"{self.stock.item_name} - {self.quantity}pcs ({self.get_status_display()}) - {self.customer_name or 'No Customer'}"
@@ -618,6 +679,15 @@ class StockAudit(models.Model):
     # Keep backwards compatibility
     AUDIT_STATUS_CHOICES = STATUS_CHOICES
     
+    ITEM_GENERATION_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    # A pending or running generation without progress for this long has lost its job
+    ITEM_GENERATION_STALE_MINUTES = 15
+    
     audit_reference = models.CharField(max_length=100, unique=True, help_text="Unique audit reference number")
     audit_type = models.CharField(max_length=20, choices=AUDIT_TYPE_CHOICES, default='full')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='planned')
@@ -645,6 +715,17 @@ class StockAudit(models.Model):
     items_with_variances = models.IntegerField(default=0)
     total_variance_value = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     
+    # Last version handed to an audit item; offline devices sync changes past a version
+    sync_version = models.BigIntegerField(default=0)
+    
+    # Created by the cycle-count scheduler with a fixed set of items
+    scheduled = models.BooleanField(default=False)
+    
+    # Background audit item generation
+    item_generation_status = models.CharField(max_length=20, choices=ITEM_GENERATION_STATUS_CHOICES, blank=True, null=True)
+    item_generation_total = models.IntegerField(default=0, help_text="Stock items in scope when item generation started")
+    item_generation_heartbeat = models.DateTimeField(blank=True, null=True, help_text="Last progress reported by item generation")
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -676,102 +757,45 @@ class StockAudit(models.Model):
     
     def can_complete(self):
         """Check if audit can be completed"""
-        return self.status == 'in_progress' and self.audit_items.exists()
+        return (
+            self.status == 'in_progress'
+            and not self.item_generation_active
+            and self.audit_items.exists()
+        )
+    
+    @property
+    def item_generation_active(self):
+        """Item generation is pending or running and still reporting progress"""
+        if self.item_generation_status not in ('pending', 'running'):
+            return False
+        from datetime import timedelta
+        stale_before = timezone.now() - timedelta(minutes=self.ITEM_GENERATION_STALE_MINUTES)
+        return bool(self.item_generation_heartbeat and self.item_generation_heartbeat > stale_before)
     
     def start_audit(self, user):
-        """Start the audit session and create audit items"""
+        """Start the audit session and queue generation of its audit items"""
         if self.can_start():
             from django.utils import timezone
             self.status = 'in_progress'
             self.actual_start_date = timezone.now()
             self.save()
 
-            # Create audit items based on scope
-            self._create_audit_items()
+            # Audits created from the web form already generated their items
+            if self.item_generation_status is None:
+                from .utils.audits import queue_audit_item_generation
+                queue_audit_item_generation(self)
 
             return True
         return False
-
-    def _create_audit_items(self):
-        """Create stock audit items based on audit scope"""
-        from django.db.models import Sum, Q
-        from django.apps import apps
-
-        # Get StockAuditItem model (defined later in file)
-        StockAuditItem = apps.get_model('stock', 'StockAuditItem')
-
-        # Build query based on audit scope (Stock is already defined in this file)
-        stock_query = Stock.objects.all()
-
-        # Filter by locations if specified
-        if self.audit_locations.exists():
-            # Include stocks that either:
-            # 1. Have a StockLocation entry for the selected stores
-            # 2. Have their main store in the selected locations
-            stock_query = stock_query.filter(
-                Q(locations__store__in=self.audit_locations.all()) |
-                Q(store__in=self.audit_locations.all())
-            ).distinct()
-
-        # Filter by categories if specified
-        if self.audit_categories.exists():
-            stock_query = stock_query.filter(
-                category__in=self.audit_categories.all()
-            ).distinct()
-
-        # Create audit items for each stock item
-        items_created = 0
-
-        # Debug: Log query count
-        stock_count = stock_query.count()
-        print(f"DEBUG: Found {stock_count} stock items for audit {self.audit_reference}")
-
-        for stock in stock_query:
-            try:
-                # Get current quantities
-                system_quantity = stock.quantity
-
-                # Get committed quantities safely
-                try:
-                    committed = stock.committed_stock.filter(
-                        status__in=['pending', 'partially_fulfilled']
-                    ).aggregate(
-                        total=Sum('quantity_committed')
-                    )['total'] or 0
-                except Exception:
-                    committed = 0
-
-                # Get reserved quantities safely
-                try:
-                    reserved = stock.reservations.filter(
-                        status='active'
-                    ).aggregate(
-                        total=Sum('quantity')
-                    )['total'] or 0
-                except Exception:
-                    reserved = 0
-
-                # Create audit item
-                StockAuditItem.objects.create(
-                    audit=self,
-                    stock=stock,
-                    system_quantity=system_quantity,
-                    committed_quantity=committed,
-                    reserved_quantity=reserved
-                )
-                items_created += 1
-                print(f"DEBUG: Created audit item for {stock.item_name}")
-            except Exception as e:
-                print(f"ERROR: Failed to create audit item for stock {stock.id}: {str(e)}")
-                continue
-
-        # Update total items planned
-        self.total_items_planned = items_created
-        self.save()
-
-        print(f"DEBUG: Created {items_created} audit items for audit {self.audit_reference}")
-
-        return items_created
+    
+    @property
+    def item_generation_percentage(self):
+        """Progress of the background audit item generation"""
+        if self.item_generation_status == 'completed':
+            return 100
+        if not self.item_generation_total:
+            return 0
+        return round((self.total_items_planned / self.item_generation_total) * 100, 1)
     
     def complete_audit(self, user):
         """Complete the audit session"""
@@ -785,99 +809,79 @@ class StockAudit(models.Model):
         return False
     
     def approve_audit(self, user):
-        """Approve audit and apply adjustments"""
+        """Approve audit and apply adjustments (queued for the worker on large audits)"""
         if self.status == 'completed':
-            self.status = 'approved'
-            self.approved_by = user
-            self.save()
-            self._apply_audit_adjustments()
+            from django.db import transaction
+            from .utils.audits import schedule_audit_adjustments
+            
+            with transaction.atomic():
+                self.status = 'approved'
+                self.approved_by = user
+                self._calculate_audit_summary()
+                self.save()
+                schedule_audit_adjustments(self, user)
             return True
         return False
     
     def _calculate_audit_summary(self):
-        """Calculate audit summary statistics"""
-        audit_items = self.audit_items.all()
-        self.total_items_planned = audit_items.count()
-        self.total_items_counted = audit_items.filter(physical_count__isnull=False).count()
-        self.items_with_variances = audit_items.exclude(variance_quantity=0).count()
+        """Recalculate all audit summary statistics from the audit items"""
+        stats = self._aggregate_statistics()
+        self.total_items_planned = stats['planned']
+        self.total_items_counted = stats['counted']
+        self.items_with_variances = stats['variances']
+        self.total_variance_value = stats['variance_value']
+    
+    def _aggregate_statistics(self):
+        """Audit statistics computed from the audit items in one aggregate query"""
+        from django.db.models import Count, Sum, Q
+        from django.db.models.functions import Abs
+        from decimal import Decimal
         
-        # Calculate total variance value (placeholder - would need item costs)
-        total_variance = sum(
-            abs(item.variance_quantity) * 10  # Placeholder cost calculation
-            for item in audit_items 
-            if item.variance_quantity != 0
+        counted = Q(physical_count__isnull=False)
+        stats = self.audit_items.aggregate(
+            planned=Count('id'),
+            counted=Count('id', filter=counted),
+            variances=Count('id', filter=counted & ~Q(variance_quantity=0)),
+            variance_value=Sum(Abs('variance_quantity'), filter=counted),
         )
-        self.total_variance_value = total_variance
+        stats['variance_value'] = Decimal(stats['variance_value'] or 0)
+        return stats
     
-    def _apply_audit_adjustments(self):
-        """Apply audit adjustments to stock quantities"""
-        from django.utils import timezone
-
-        for audit_item in self.audit_items.exclude(variance_quantity=0):
-            stock = audit_item.stock
-            if audit_item.adjustment_applied:
-                continue
-
-            # Store old quantity for history
-            old_quantity = stock.quantity
-            variance = audit_item.variance_quantity
-
-            # Set flag to prevent duplicate history in Stock.save()
-            stock._audit_adjustment = True
-
-            # Apply the adjustment
-            stock.quantity = audit_item.physical_count
-            stock.last_updated = timezone.now()
-            stock.save()
-
-            # Create specific stocktake history record
-            adjustment_type = "increased" if variance > 0 else "decreased"
-            StockHistory.objects.create(
-                category=stock.category,
-                item_name=stock.item_name,
-                quantity=stock.quantity,
-                issue_quantity=abs(variance) if variance < 0 else 0,
-                receive_quantity=variance if variance > 0 else 0,
-                issued_by=str(self.approved_by) if variance < 0 else None,
-                received_by=str(self.approved_by) if variance > 0 else None,
-                note=f"Stocktake Adjustment ({self.audit_reference}): Quantity {adjustment_type} by {abs(variance)} units. System: {old_quantity}, Physical Count: {audit_item.physical_count}. {audit_item.variance_notes or ''}",
-                created_by=str(self.approved_by),
-                last_updated=timezone.now(),
-                timestamp=timezone.now()
-            )
+    def update_statistics(self):
+        """Recompute the counted / variance statistics from the audit items"""
+        stats = self._aggregate_statistics()
+        self.total_items_counted = stats['counted']
+        self.items_with_variances = stats['variances']
+        self.total_variance_value = stats['variance_value']
+        self.save(update_fields=['total_items_counted', 'items_with_variances', 'total_variance_value', 'updated_at'])
+    
+    @classmethod
+    def allocate_sync_versions(cls, audit_id, count=1):
+        """
+        Reserve ``count`` consecutive item versions and return the first.
 
-            # Mark adjustment as applied
-            audit_item.adjustment_applied = True
-            audit_item.adjustment_date = timezone.now()
-            audit_item.save()
+        Call inside the transaction that writes the items: the UPDATE holds
+        the audit row lock until commit, so versions become visible in order
+        and a device syncing past a version never skips a row.
+        """
+        cls.objects.filter(pk=audit_id).update(sync_version=models.F('sync_version') + count)
+        return cls.objects.filter(pk=audit_id).values_list('sync_version', flat=True).get() - count + 1
     
-    def update_statistics(self):
-        """Update audit statistics based on current audit items"""
-        # Count items that have been counted
-        counted_items = self.audit_items.filter(physical_count__isnull=False)
-        self.total_items_counted = counted_items.count()
-        
-        # Count items with variances (physical count != system quantity)
-        variance_items = counted_items.exclude(variance_quantity=0)
-        self.items_with_variances = variance_items.count()
-        
-        # Calculate total variance value (absolute value of all variances)
-        from django.db.models import Sum, Case, When, IntegerField, F
-        from decimal import Decimal
-        
-        total_variance = counted_items.aggregate(
-            total_variance=Sum(
-                Case(
-                    When(variance_quantity__gt=0, then=F('variance_quantity')),
-                    When(variance_quantity__lt=0, then=F('variance_quantity') * -1),
-                    default=0,
-                    output_field=IntegerField()
-                )
-            )
-        )['total_variance'] or 0
-        
-        self.total_variance_value = Decimal(str(total_variance))
-        self.save()
+    @classmethod
+    def apply_statistics_delta(cls, audit_id, counted=0, variances=0, variance_value=0):
+        """
+        Adjust the running statistics by the change one count made.
+
+        A single F() UPDATE, so concurrent counters never overwrite each
+        other; complete and approve recompute the totals from scratch.
+        """
+        if not (counted or variances or variance_value):
+            return
+        cls.objects.filter(pk=audit_id).update(
+            total_items_counted=models.F('total_items_counted') + counted,
+            items_with_variances=models.F('items_with_variances') + variances,
+            total_variance_value=models.F('total_variance_value') + variance_value,
+        )
     
     @property
     def completion_percentage(self):
@@ -933,12 +937,25 @@ class StockAuditItem(models.Model):
     audit_location = models.CharField(max_length=100, blank=True, null=True)
     audit_aisle = models.CharField(max_length=50, blank=True, null=True)
     
+    # Velocity class of the item when a scheduled cycle count picked it
+    abc_class = models.CharField(max_length=1, choices=[('A', 'A'), ('B', 'B'), ('C', 'C')], blank=True, null=True)
+    
+    # Offline sync
+    version = models.BigIntegerField(default=0, help_text="Audit sync version of the last change to this item")
+    conflicting_count = models.IntegerField(null=True, blank=True, help_text="Offline count that conflicted with a newer count, awaiting review")
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['stock__item_name']
         unique_together = ['audit', 'stock']
+        indexes = [
+            # Keyset paging through an audit's items
+            models.Index(fields=['audit', 'id']),
+            # Offline devices fetching changes since a version
+            models.Index(fields=['audit', 'version']),
+        ]
         verbose_name = 'Audit Item'
         verbose_name_plural = 'Audit Items'
     
@@ -972,6 +989,19 @@ class StockAuditItem(models.Model):
     def is_counted(self):
         """Check if item has been physically counted"""
         return self.physical_count is not None
+    
+    @property
+    def statistics_contribution(self):
+        """This item's share of its audit's statistics: (counted, with variance, absolute variance)"""
+        if self.physical_count is None:
+            return (0, 0, 0)
+        return (1, int(self.variance_quantity != 0), abs(self.variance_quantity))
+    
+    @staticmethod
+    def statistics_delta(before, after):
+        """Keyword arguments for StockAudit.apply_statistics_delta between two contributions"""
+        counted, variances, variance_value = (new - old for old, new in zip(before, after))
+        return {'counted': counted, 'variances': variances, 'variance_value': variance_value}
 
 
 class StockLocation(models.Model):
@@ -1055,12 +1085,26 @@ class StockTransfer(models.Model):
             self.approved_at = timezone.now()
             self.save()
     
+    def _lock(self):
+        """Reload status under a row lock so concurrent completions run once"""
+        self.status = StockTransfer.objects.select_for_update().values_list('status', flat=True).get(pk=self.pk)
+    
     def complete(self, user):
-        if self.can_be_completed():
+        """
+        Move the stock and mark the transfer completed, in one transaction.
+        Returns False, changing nothing, if the transfer cannot be completed
+        or the origin location no longer holds the quantity.
+        """
+        with transaction.atomic():
+            self._lock()
+            if not self.can_be_completed():
+                return False
+            
             # Handle different transfer types
             if self.transfer_type == 'restock':
                 # For restock: move quantity from origin to destination
-                self.stock.remove_from_location(self.from_location, self.quantity)
+                if not self.stock.remove_from_location(self.from_location, self.quantity):
+                    return False
                 self.stock.add_to_location(self.to_location, self.quantity, self.to_aisle)
                 self.status = 'completed'
             elif self.transfer_type == 'customer_collection':
@@ -1075,17 +1119,27 @@ class StockTransfer(models.Model):
             self.completed_by = user
             self.completed_at = timezone.now()
             self.save()
+        return True
     
     def mark_collected(self, user):
-        """Mark customer collection transfer as collected and reduce stock"""
-        if self.can_be_collected():
+        """
+        Mark customer collection transfer as collected and reduce stock.
+        Returns False, changing nothing, if the destination no longer holds the quantity.
+        """
+        with transaction.atomic():
+            self._lock()
+            if not self.can_be_collected():
+                return False
+            
             # Remove the quantity from the destination location (customer has collected)
-            self.stock.remove_from_location(self.to_location, self.quantity)
+            if not self.stock.remove_from_location(self.to_location, self.quantity):
+                return False
             
             self.status = 'collected'
             self.collected_by = user
             self.collected_at = timezone.now()
             self.save()
+        return True
     
     @property
     def is_pending_collection(self):
@@ -1207,6 +1261,7 @@ class Manufacturer(models.Model):
     postal_code = models.CharField(max_length=20)
     company_telephone = models.CharField(max_length=20)
     abn = models.CharField(max_length=20, blank=True, null=True, help_text="Australian Business Number")
+    lead_time_days = models.PositiveIntegerField(default=14, help_text="Typical days from order to delivery, used for reorder suggestions")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -1604,6 +1659,9 @@ class Invoice(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['purchase_order', 'invoice_number']
+        indexes = [
+            models.Index(fields=['status', 'due_date']),
+        ]
     
     def save(self, *args, **kwargs):
         # Calculate outstanding amount
@@ -1618,9 +1676,64 @@ class Invoice(models.Model):
             self.status = 'overdue'
         
         super().save(*args, **kwargs)
+        Invoice.invalidate_ap_aging()
     
     def __str__(self):
         return f"Invoice {self.invoice_number} - {self.purchase_order.reference_number}"
+
+    @staticmethod
+    def ap_aging_cache_key(day):
+        return f'ap_aging:{day.isoformat()}'
+
+    @classmethod
+    def invalidate_ap_aging(cls):
+        """Drop today's cached aging report once the current transaction commits"""
+        from django.core.cache import cache
+        from django.db import transaction
+
+        cache_key = cls.ap_aging_cache_key(timezone.localdate())
+        transaction.on_commit(lambda: cache.delete(cache_key))
+
+    @classmethod
+    def apply_payment_delta(cls, invoice_id, amount, paid_at=None):
+        """
+        Add a signed amount to an invoice's total_paid in a single UPDATE.
+
+        Outstanding amount and status are derived in the same statement from
+        the pre-update total, so concurrent payments cannot overwrite each
+        other and the invoice save() logic and signals are not re-run.
+        Callers must already hold the invoice row lock (see Payment.save).
+        """
+        amount = Decimal(amount)
+        if not amount:
+            return 0
+
+        now = timezone.now()
+        new_total = models.F('total_paid') + amount
+        updates = {
+            'outstanding_amount': models.F('invoice_total') - new_total,
+            'status': models.Case(
+                models.When(total_paid__gte=models.F('invoice_total') - amount, then=models.Value('fully_paid')),
+                models.When(total_paid__gt=-amount, then=models.Value('partially_paid')),
+                # Fully reversed: fall back to pending/overdue by due date
+                models.When(
+                    status__in=['partially_paid', 'fully_paid'], due_date__lt=timezone.localdate(now),
+                    then=models.Value('overdue')
+                ),
+                models.When(status__in=['partially_paid', 'fully_paid'], then=models.Value('pending')),
+                default=models.F('status'),
+            ),
+            'updated_at': now,
+        }
+        if amount > 0:
+            updates['last_payment_date'] = paid_at or now
+        # Assigned last: MySQL evaluates SET clauses left to right, so every
+        # expression above must still see the old total_paid
+        updates['total_paid'] = new_total
+
+        updated = cls.objects.filter(pk=invoice_id).update(**updates)
+        cls.invalidate_ap_aging()
+        return updated
     
     @property
     def is_overdue(self):
@@ -1679,24 +1792,103 @@ class Payment(models.Model):
     class Meta:
         ordering = ['-payment_date', '-created_at']
     
+    @property
+    def applied_amount(self):
+        """Amount this payment contributes to the invoice total"""
+        return self.payment_amount if self.payment_status == 'completed' else Decimal('0')
+
+    @staticmethod
+    def lock_invoices(invoice_ids):
+        """Lock invoice rows in primary key order so concurrent writers cannot deadlock"""
+        return list(
+            Invoice.objects.select_for_update().filter(pk__in=set(invoice_ids)).order_by('pk').values_list('pk', flat=True)
+        )
+
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # Update invoice totals when payment is saved
-        self.invoice.total_paid = self.invoice.payments.filter(
-            payment_status='completed'
-        ).aggregate(total=models.Sum('payment_amount'))['total'] or 0
-        self.invoice.last_payment_date = timezone.now()
-        self.invoice.save()
-    
+        from django.db import transaction
+
+        with transaction.atomic():
+            invoice_ids = [self.invoice_id]
+            if self.pk:
+                # The payment may be moving from another invoice; lock both
+                invoice_ids += Payment.objects.filter(pk=self.pk).values_list('invoice_id', flat=True)
+            self.lock_invoices(invoice_ids)
+
+            # Read the stored row under the invoice lock so the reversed amount is current
+            previous = None
+            if self.pk:
+                previous = Payment.objects.filter(pk=self.pk).values(
+                    'invoice_id', 'payment_amount', 'payment_status'
+                ).first()
+
+            super().save(*args, **kwargs)
+
+            # Apply only the change in this payment's contribution
+            deltas = {self.invoice_id: self.applied_amount}
+            if previous and previous['payment_status'] == 'completed':
+                deltas[previous['invoice_id']] = deltas.get(previous['invoice_id'], 0) - previous['payment_amount']
+            for invoice_id, delta in deltas.items():
+                Invoice.apply_payment_delta(invoice_id, delta)
+
+        self.refresh_cached_invoice()
+
     def delete(self, *args, **kwargs):
-        invoice = self.invoice
-        super().delete(*args, **kwargs)
-        # Update invoice totals when payment is deleted
-        invoice.total_paid = invoice.payments.filter(
-            payment_status='completed'
-        ).aggregate(total=models.Sum('payment_amount'))['total'] or 0
-        invoice.save()
-    
+        from django.db import transaction
+
+        with transaction.atomic():
+            self.lock_invoices([self.invoice_id])
+            applied = Payment.objects.filter(pk=self.pk, payment_status='completed').values_list(
+                'payment_amount', flat=True
+            ).first()
+            result = super().delete(*args, **kwargs)
+            if applied:
+                Invoice.apply_payment_delta(self.invoice_id, -applied)
+
+        self.refresh_cached_invoice()
+        return result
+
+    INVOICE_PAYMENT_FIELDS = ['total_paid', 'outstanding_amount', 'status', 'last_payment_date', 'updated_at']
+
+    def refresh_cached_invoice(self):
+        """Reload the payment totals of an already loaded invoice after a delta was applied"""
+        if Payment.invoice.is_cached(self):
+            self.invoice.refresh_from_db(fields=self.INVOICE_PAYMENT_FIELDS)
+
+    @classmethod
+    def bulk_record(cls, payments):
+        """
+        Record many unsaved Payment instances in one transaction.
+
+        Invoices are locked once and each receives a single delta for the
+        sum of its payments instead of one update per payment. Rows are
+        inserted individually (MySQL returns no primary keys from
+        bulk_create) so ids and post_save notifications are preserved.
+
+        Returns:
+            list: The created Payment instances.
+        """
+        from django.db import transaction
+
+        deltas = {}
+        for payment in payments:
+            deltas[payment.invoice_id] = deltas.get(payment.invoice_id, Decimal('0')) + payment.applied_amount
+
+        with transaction.atomic():
+            cls.lock_invoices(deltas.keys())
+            for payment in payments:
+                # Plain model save; invoice totals are applied once per invoice below
+                super(Payment, payment).save()
+            for invoice_id, delta in deltas.items():
+                Invoice.apply_payment_delta(invoice_id, delta)
+
+        # One reload per loaded invoice, shared by its payments
+        refreshed = set()
+        for payment in payments:
+            if Payment.invoice.is_cached(payment) and id(payment.invoice) not in refreshed:
+                refreshed.add(id(payment.invoice))
+                payment.refresh_cached_invoice()
+        return payments
+
     def __str__(self):
         return f"Payment {self.payment_reference} - {self.payment_amount} ({self.payment_date})"
 
@@ -1719,6 +1911,7 @@ class Notification(models.Model):
         ('stock_audit_completed', 'Stock Audit Completed'),
         ('invoice_created', 'Invoice Created'),
         ('payment_made', 'Payment Made'),
+        ('invoice_overdue', 'Invoice Overdue'),
         ('stock_low', 'Low Stock Alert'),
         ('reservation_created', 'Stock Reservation Created'),
         ('reservation_expired', 'Stock Reservation Expired'),
@@ -1749,11 +1942,18 @@ class Notification(models.Model):
     # Additional data for the notification (JSON format)
     extra_data = models.JSONField(default=dict, blank=True, help_text="Additional data for the notification")
     
+    # Events with the same collapse key update one unread row
+    collapse_key = models.CharField(max_length=150, blank=True, null=True, help_text="Events sharing this key are counted on one unread notification")
+    occurrence_count = models.PositiveIntegerField(default=1)
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['recipient', 'is_read', '-created_at']),
             models.Index(fields=['recipient', 'notification_type']),
+            models.Index(fields=['collapse_key', 'created_at']),
+            models.Index(fields=['is_read', 'read_at']),
+            models.Index(fields=['related_object_type', 'related_object_id']),
         ]
     
     def __str__(self):
@@ -1761,28 +1961,156 @@ class Notification(models.Model):
     
     def mark_as_read(self):
         """Mark notification as read"""
-        if not self.is_read:
-            self.is_read = True
-            self.read_at = timezone.now()
-            self.save(update_fields=['is_read', 'read_at'])
+        if self.is_read:
+            return
+        now = timezone.now()
+        # Conditional update so concurrent requests only decrement the counter once
+        updated = Notification.objects.filter(pk=self.pk, is_read=False).update(is_read=True, read_at=now)
+        self.is_read = True
+        if updated == 1:
+            self.read_at = now
+            Notification.publish_changes({self.recipient_id: -1}, event='read')
+    
+    @staticmethod
+    def publish_changes(unread_deltas, event='created'):
+        """
+        Adjust unread counters and push a change event to each user's stream
+        once the transaction commits.
+        """
+        from django.db import transaction
+        from .utils.realtime import publish_notification_changes
+        
+        unread_deltas = dict(unread_deltas)
+        transaction.on_commit(lambda: publish_notification_changes(unread_deltas, event=event))
+    
+    @classmethod
+    def deliver(cls, notifications, batch_size=1000):
+        """
+        Write notifications and notify their recipients' streams.
+
+        Non-urgent notifications are given a collapse key: per type and
+        related object, or for digest users per type and day. One whose key
+        matches an unread row for the same recipient bumps that row's
+        occurrence_count, and points it at the latest event, instead of
+        inserting; the rest are inserted with one bulk_create. Repeated
+        events about the same object therefore keep a single unread row.
+
+        Returns:
+            list: The inserted notifications.
+        """
+        digest_user_ids = cls.get_digest_user_ids()
+        now = timezone.now()
+        today = timezone.localdate(now)
+        type_labels = dict(cls.NOTIFICATION_TYPE_CHOICES)
+        
+        plain = []
+        collapsible = {}
+        for notification in notifications:
+            if notification.priority == 'urgent':
+                plain.append(notification)
+                continue
+            if notification.recipient_id in digest_user_ids:
+                notification.collapse_key = f'digest:{notification.notification_type}:{today.isoformat()}'
+                notification.title = f"{type_labels.get(notification.notification_type, 'Notification')} digest"
+            elif notification.related_object_type and notification.related_object_id:
+                notification.collapse_key = (
+                    f'{notification.notification_type}:{notification.related_object_type}:'
+                    f'{notification.related_object_id}'
+                )
+            else:
+                plain.append(notification)
+                continue
+            key = (notification.recipient_id, notification.collapse_key)
+            if key in collapsible:
+                # Several events in one batch: keep the latest text, add up the count
+                notification.occurrence_count += collapsible[key].occurrence_count
+            collapsible[key] = notification
+        
+        existing = {}
+        if collapsible:
+            rows = cls.objects.filter(
+                collapse_key__in={key for _, key in collapsible},
+                recipient_id__in={recipient_id for recipient_id, _ in collapsible},
+                is_read=False
+            ).values_list('recipient_id', 'collapse_key', 'id')
+            for recipient_id, collapse_key, notification_id in rows:
+                if (recipient_id, collapse_key) in collapsible:
+                    existing.setdefault((recipient_id, collapse_key), notification_id)
+        
+        # A bumped row takes the latest event's text and link. Rows bumped
+        # with identical values share one UPDATE
+        bumps = {}
+        for key, notification_id in existing.items():
+            notification = collapsible[key]
+            bump = (
+                notification.occurrence_count, notification.title, notification.message, notification.priority,
+                notification.related_object_type, notification.related_object_id,
+                json.dumps(notification.extra_data or {}, sort_keys=True, default=str),
+            )
+            bumps.setdefault(bump, (notification, []))[1].append(notification_id)
+        for notification, notification_ids in bumps.values():
+            cls.objects.filter(id__in=notification_ids).update(
+                occurrence_count=models.F('occurrence_count') + notification.occurrence_count,
+                title=notification.title,
+                message=notification.message,
+                priority=notification.priority,
+                related_object_type=notification.related_object_type,
+                related_object_id=notification.related_object_id,
+                extra_data=notification.extra_data or {},
+                created_at=now
+            )
+        
+        to_insert = plain + [n for key, n in collapsible.items() if key not in existing]
+        created = cls.objects.bulk_create(to_insert, batch_size=batch_size)
+        
+        unread_deltas = {recipient_id: 0 for recipient_id, _ in existing}
+        for notification in to_insert:
+            if not notification.is_read:
+                unread_deltas[notification.recipient_id] = unread_deltas.get(notification.recipient_id, 0) + 1
+        cls.publish_changes(unread_deltas)
+        return created
+    
+    DIGEST_USERS_CACHE_KEY = 'notification_digest_users'
+    
+    @classmethod
+    def get_digest_user_ids(cls):
+        """Ids of users who opted into daily digests (cached with the recipient lists)"""
+        from django.core.cache import cache
+        
+        user_ids = cache.get(cls.DIGEST_USERS_CACHE_KEY)
+        if user_ids is None:
+            user_ids = set(UserRole.objects.filter(notification_digest=True).values_list('user_id', flat=True))
+            cache.set(cls.DIGEST_USERS_CACHE_KEY, user_ids, cls.RECIPIENT_CACHE_TIMEOUT)
+        return user_ids
+    
+    # related_object_type -> model, and the page each notification links to
+    RELATED_OBJECT_MODELS = {
+        'purchase_order': PurchaseOrder,
+        'stock_transfer': StockTransfer,
+        'stock': Stock,
+        'committed_stock': CommittedStock,
+        'stock_reservation': StockReservation,
+        'stock_audit': StockAudit,
+        'invoice': Invoice,
+        'payment': Payment,
+    }
+    ACTION_URLS = {
+        'purchase_order': lambda obj: f'/purchase-orders/{obj.id}/',
+        'stock_transfer': lambda obj: '/transfers/',
+        'stock': lambda obj: f'/stock_detail/{obj.id}/',
+        'committed_stock': lambda obj: f'/stock_detail/{obj.stock_id}/',
+        'stock_reservation': lambda obj: f'/reservations/{obj.id}/',
+        'stock_audit': lambda obj: f'/audits/{obj.id}/',
+        'invoice': lambda obj: f'/invoices/{obj.id}/',
+        'payment': lambda obj: f'/payments/{obj.id}/',
+    }
     
     def get_related_object(self):
         """Get the related object if it exists"""
         if not self.related_object_type or not self.related_object_id:
             return None
         
-        model_mapping = {
-            'purchase_order': PurchaseOrder,
-            'stock_transfer': StockTransfer,
-            'stock': Stock,
-            'committed_stock': CommittedStock,
-            'stock_reservation': StockReservation,
-            'stock_audit': StockAudit,
-            'invoice': Invoice,
-            'payment': Payment,
-        }
-        
-        model_class = model_mapping.get(self.related_object_type)
+        model_class = self.RELATED_OBJECT_MODELS.get(self.related_object_type)
         if model_class:
             try:
                 return model_class.objects.get(id=self.related_object_id)
@@ -1790,106 +2118,266 @@ class Notification(models.Model):
                 return None
         return None
     
+    @classmethod
+    def build_action_url(cls, related_object_type, related_object):
+        """URL path for a related object, or None for unknown types"""
+        url_func = cls.ACTION_URLS.get(related_object_type)
+        if url_func is None or related_object is None:
+            return None
+        try:
+            return url_func(related_object)
+        except Exception:
+            return None
+    
     def get_action_url(self):
         """Get URL for the notification action based on the related object"""
-        related_obj = self.get_related_object()
-        if not related_obj:
-            return None
+        if 'action_url' in self.extra_data:
+            return self.extra_data['action_url']
+        if hasattr(self, '_action_url'):
+            return self._action_url
+        self._action_url = self.build_action_url(self.related_object_type, self.get_related_object())
+        return self._action_url
+    
+    @classmethod
+    def resolve_action_urls(cls, notifications):
+        """
+        Resolve action URLs for a page of notifications.
+
+        URLs stored in extra_data at creation need no lookup; the rest are
+        grouped by related_object_type and each type is loaded with one
+        in_bulk() query. The results are cached on the instances so
+        get_action_url() does not query again.
+        """
+        notifications = list(notifications)
+        pending = {}
+        for notification in notifications:
+            if 'action_url' in notification.extra_data:
+                continue
+            notification._action_url = None
+            if notification.related_object_type in cls.RELATED_OBJECT_MODELS and notification.related_object_id:
+                pending.setdefault(notification.related_object_type, set()).add(notification.related_object_id)
         
-        url_mapping = {
-            'purchase_order': lambda obj: f'/purchase-orders/{obj.id}/',
-            'stock_transfer': lambda obj: f'/transfers/',
-            'stock': lambda obj: f'/stock_detail/{obj.id}/',
-            'committed_stock': lambda obj: f'/stock_detail/{obj.stock.id}/',
-            'stock_reservation': lambda obj: f'/reservations/{obj.id}/',
-            'stock_audit': lambda obj: f'/audits/{obj.id}/',
-            'invoice': lambda obj: f'/invoices/{obj.id}/',
-            'payment': lambda obj: f'/payments/{obj.id}/',
+        related = {
+            object_type: cls.RELATED_OBJECT_MODELS[object_type].objects.in_bulk(object_ids)
+            for object_type, object_ids in pending.items()
         }
-        
-        url_func = url_mapping.get(self.related_object_type)
-        if url_func:
-            try:
-                return url_func(related_obj)
-            except:
-                return None
-        return None
+        for notification in notifications:
+            if 'action_url' in notification.extra_data:
+                continue
+            related_object = related.get(notification.related_object_type, {}).get(notification.related_object_id)
+            notification._action_url = cls.build_action_url(notification.related_object_type, related_object)
+        return notifications
     
+    # Model name -> related_object_type, for models whose type is not just the model name
+    RELATED_OBJECT_TYPES = {
+        'purchaseorder': 'purchase_order',
+        'stocktransfer': 'stock_transfer',
+        'committedstock': 'committed_stock',
+        'stockreservation': 'stock_reservation',
+        'stockaudit': 'stock_audit',
+    }
+
+    # Roles notified for each activity type
+    ACTIVITY_RECIPIENT_ROLES = {
+        'purchase_order_created': ['admin', 'owner', 'logistics', 'accountant'],
+        'purchase_order_confirmed': ['admin', 'owner', 'logistics', 'warehouse', 'accountant'],
+        'stock_transfer_initiated': ['admin', 'owner', 'logistics', 'warehouse'],
+        'stock_transfer_completed': ['admin', 'owner', 'logistics', 'warehouse'],
+        'stock_committed': ['admin', 'owner', 'logistics', 'sales'],
+        'stock_received': ['admin', 'owner', 'logistics', 'warehouse'],
+        'po_items_received': ['admin', 'owner', 'logistics', 'warehouse', 'accountant'],
+        'stock_audit_started': ['admin', 'owner', 'stocktake_manager'],
+        'stock_audit_completed': ['admin', 'owner', 'stocktake_manager'],
+        'invoice_created': ['admin', 'owner', 'accountant'],
+        'payment_made': ['admin', 'owner', 'accountant'],
+        'invoice_overdue': ['admin', 'owner', 'accountant'],
+        'stock_low': ['admin', 'owner', 'logistics', 'warehouse'],
+        'reservation_created': ['admin', 'owner', 'logistics', 'sales'],
+        'reservation_expired': ['admin', 'owner', 'logistics', 'sales'],
+    }
+
+    RECIPIENT_CACHE_KEY = 'notification_recipients:{activity_type}'
+    RECIPIENT_CACHE_TIMEOUT = 60 * 60
+
+    @classmethod
+    def get_related_object_type(cls, related_object):
+        """Resolve the related_object_type stored for a model instance"""
+        model_name = related_object._meta.model_name
+        return cls.RELATED_OBJECT_TYPES.get(model_name, model_name)
+
     @classmethod
     def create_notification(cls, recipients, notification_type, title, message, 
                           related_object=None, priority='medium', extra_data=None):
-        """Create notifications for multiple recipients"""
+        """
+        Create notifications for multiple recipients with a single bulk INSERT.
+
+        Recipients may be User instances or user ids (as returned by
+        get_recipients_for_activity).
+        """
         if not isinstance(recipients, (list, tuple)):
             recipients = [recipients]
         
-        notifications = []
-        for recipient in recipients:
-            # Determine related object info
-            related_object_type = None
-            related_object_id = None
-            if related_object:
-                model_name = related_object.__class__.__name__.lower()
-                if model_name == 'purchaseorder':
-                    related_object_type = 'purchase_order'
-                elif model_name == 'stocktransfer':
-                    related_object_type = 'stock_transfer'
-                elif model_name == 'committedstock':
-                    related_object_type = 'committed_stock'
-                elif model_name == 'stockreservation':
-                    related_object_type = 'stock_reservation'
-                elif model_name == 'stockaudit':
-                    related_object_type = 'stock_audit'
-                else:
-                    related_object_type = model_name
-                related_object_id = related_object.id
-            
-            notification = cls.objects.create(
-                recipient=recipient,
+        related_object_type = None
+        related_object_id = None
+        extra_data = dict(extra_data or {})
+        if related_object:
+            related_object_type = cls.get_related_object_type(related_object)
+            related_object_id = related_object.id
+            # Stored now so listing notifications never has to load the object
+            extra_data.setdefault('action_url', cls.build_action_url(related_object_type, related_object))
+        
+        notifications = [
+            cls(
+                recipient_id=getattr(recipient, 'pk', recipient),
                 notification_type=notification_type,
                 title=title,
                 message=message,
                 priority=priority,
                 related_object_type=related_object_type,
                 related_object_id=related_object_id,
-                extra_data=extra_data or {}
+                extra_data=extra_data
             )
-            notifications.append(notification)
-        
-        return notifications
+            for recipient in recipients
+        ]
+        return cls.deliver(notifications)
     
     @classmethod
     def get_recipients_for_activity(cls, activity_type, related_object=None):
-        """Get list of users who should receive notifications for an activity type"""
-        # This can be customized based on user roles and permissions
-        from django.contrib.auth.models import User
-        
-        activity_recipients = {
-            'purchase_order_created': ['admin', 'owner', 'logistics', 'accountant'],
-            'purchase_order_confirmed': ['admin', 'owner', 'logistics', 'warehouse', 'accountant'],
-            'stock_transfer_initiated': ['admin', 'owner', 'logistics', 'warehouse'],
-            'stock_transfer_completed': ['admin', 'owner', 'logistics', 'warehouse'],
-            'stock_committed': ['admin', 'owner', 'logistics', 'sales'],
-            'stock_received': ['admin', 'owner', 'logistics', 'warehouse'],
-            'po_items_received': ['admin', 'owner', 'logistics', 'warehouse', 'accountant'],
-            'stock_audit_started': ['admin', 'owner', 'stocktake_manager'],
-            'stock_audit_completed': ['admin', 'owner', 'stocktake_manager'],
-            'invoice_created': ['admin', 'owner', 'accountant'],
-            'payment_made': ['admin', 'owner', 'accountant'],
-            'stock_low': ['admin', 'owner', 'logistics', 'warehouse'],
-            'reservation_created': ['admin', 'owner', 'logistics', 'sales'],
-            'reservation_expired': ['admin', 'owner', 'logistics', 'sales'],
-        }
-        
-        roles = activity_recipients.get(activity_type, [])
+        """
+        Get ids of active users who should be notified for an activity type.
+
+        Lists are cached per activity type and dropped by the UserRole/User
+        signals whenever roles or active flags change.
+        """
+        roles = cls.ACTIVITY_RECIPIENT_ROLES.get(activity_type, [])
         if not roles:
             return []
         
-        # Get users with these roles
-        users = User.objects.filter(
-            role__role__in=roles,
-            is_active=True
-        ).distinct()
+        from django.core.cache import cache
+        
+        cache_key = cls.RECIPIENT_CACHE_KEY.format(activity_type=activity_type)
+        recipient_ids = cache.get(cache_key)
+        if recipient_ids is None:
+            recipient_ids = list(
+                User.objects.filter(
+                    role__role__in=roles,
+                    is_active=True
+                ).order_by('pk').values_list('pk', flat=True).distinct()
+            )
+            cache.set(cache_key, recipient_ids, cls.RECIPIENT_CACHE_TIMEOUT)
+        
+        return recipient_ids
+    
+    @classmethod
+    def invalidate_recipient_cache(cls):
+        """Drop every cached recipient list once the current transaction commits"""
+        from django.core.cache import cache
+        from django.db import transaction
         
-        return list(users)
+        cache_keys = [
+            cls.RECIPIENT_CACHE_KEY.format(activity_type=activity_type)
+            for activity_type in cls.ACTIVITY_RECIPIENT_ROLES
+        ] + [cls.DIGEST_USERS_CACHE_KEY]
+        transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
 
+# ----------------------------
+# Email Outbox Models
+# ----------------------------
+
+class EmailOutbox(models.Model):
+    """Queue outgoing emails so requests never wait on the mail server"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    # Retry backoff: 1, 2, 4, 8... minutes, capped at one hour
+    RETRY_BASE_SECONDS = 60
+    RETRY_MAX_SECONDS = 3600
+
+    subject = models.CharField(max_length=255)
+    body_text = models.TextField(blank=True, default='')
+    body_html = models.TextField(blank=True, null=True)
+    from_email = models.CharField(max_length=255, blank=True, null=True)
+    recipients = models.JSONField(default=list, help_text="List of recipient email addresses")
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    # Related objects
+    purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.SET_NULL, null=True, blank=True, related_name='emails')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='queued_emails')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Outbox Email'
+        verbose_name_plural = 'Email Outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.get_status_display()})"
+
+    def mark_sent(self):
+        """Record a successful delivery"""
+        self.status = 'sent'
+        self.attempts += 1
+        self.sent_at = timezone.now()
+        self.last_error = None
+        self.save(update_fields=['status', 'attempts', 'sent_at', 'last_error', 'updated_at'])
+
+    def mark_failed(self, error):
+        """Record a failed attempt and schedule a retry with exponential backoff"""
+        from datetime import timedelta
+        self.attempts += 1
+        self.last_error = str(error)[:2000]
+        if self.attempts >= self.max_attempts:
+            self.status = 'failed'
+        else:
+            delay = min(self.RETRY_BASE_SECONDS * (2 ** (self.attempts - 1)), self.RETRY_MAX_SECONDS)
+            self.status = 'pending'
+            self.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        self.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'updated_at'])
+
+    def retry(self):
+        """Put a failed email back in the queue for immediate delivery"""
+        if self.status != 'failed':
+            return False
+        self.status = 'pending'
+        self.max_attempts = self.attempts + 1
+        self.next_attempt_at = timezone.now()
+        self.save(update_fields=['status', 'max_attempts', 'next_attempt_at', 'updated_at'])
+        return True
+
+    @classmethod
+    def queue(cls, subject, recipient_list, html_message=None, message='', from_email=None,
+              purchase_order=None, created_by=None):
+        """
+        Write an email to the outbox and schedule delivery once the
+        surrounding transaction commits (see ``schedule_outbox_drain``).
+        """
+        from django.conf import settings
+
+        email = cls.objects.create(
+            subject=subject,
+            body_text=message or '',
+            body_html=html_message,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL or settings.EMAIL_HOST_USER,
+            recipients=list(recipient_list),
+            purchase_order=purchase_order,
+            created_by=created_by,
+        )
 
+        from .utils.email_service import schedule_outbox_drain
+        schedule_outbox_drain()
+        return email
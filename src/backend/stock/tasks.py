@@ -112,4 +112,202 @@ def send_purchase_order_email(purchase_order_id):
         return {
             'status': 'error',
             'message': str(exc)
-        }
\ No newline at end of file
+        }
+
+@shared_task
+def generate_reorder_suggestions(window_days=90, cover_days=30):
+    """
+    Nightly task that recomputes reorder suggestions for the full catalogue.
+
+    Returns:
+        dict: Result status and suggestion counts
+    """
+    from .utils.reorder import refresh_reorder_suggestions
+
+    suggestions = refresh_reorder_suggestions(window_days=window_days, cover_days=cover_days)
+    return {
+        'status': 'success',
+        'items_evaluated': suggestions['items_evaluated'],
+        'suggestion_count': suggestions['suggestion_count'],
+    }
+
+
+@shared_task
+def evaluate_low_stock():
+    """
+    Periodic task that raises one aggregated alert for items that have
+    dropped to their re-order level since the previous run.
+
+    Returns:
+        dict: Result status and low / newly low counts
+    """
+    from .utils.low_stock import evaluate_low_stock as evaluate
+
+    return {
+        'status': 'success',
+        **evaluate(),
+    }
+
+
+@shared_task
+def generate_audit_items(audit_id):
+    """
+    Background task that creates the audit items for a started audit.
+
+    Returns:
+        dict: Result status and number of audit items created
+    """
+    from .utils.audits import generate_audit_items as generate
+
+    return {
+        'status': 'success',
+        'audit_id': audit_id,
+        'items_created': generate(audit_id),
+    }
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_kwargs={'max_retries': 3, 'countdown': 60})
+def apply_audit_adjustments(self, audit_id, user_id=None):
+    """
+    Background task that applies an approved audit's stock adjustments.
+    Safe to retry: items already applied are skipped.
+
+    Returns:
+        dict: Result status and number of adjustments applied
+    """
+    from .utils.audits import apply_audit_adjustments as apply
+
+    return {
+        'status': 'success',
+        'audit_id': audit_id,
+        'adjustments_applied': apply(audit_id, user_id),
+    }
+
+
+@shared_task
+def expire_reservations():
+    """
+    Periodic task that expires reservations past their expiry time.
+
+    Returns:
+        dict: Result status and number of reservations expired
+    """
+    from .utils.reservations import expire_due_reservations
+
+    return {
+        'status': 'success',
+        'expired': expire_due_reservations(),
+    }
+
+
+@shared_task
+def schedule_cycle_count():
+    """
+    Nightly task that creates the day's ABC cycle-count audit.
+
+    Returns:
+        dict: Result status and the scheduled audit, if any
+    """
+    from .utils.cycle_counts import schedule_cycle_count as schedule
+
+    audit = schedule()
+    return {
+        'status': 'success',
+        'audit_id': audit.pk if audit else None,
+        'items_scheduled': audit.item_generation_total if audit else 0,
+    }
+
+
+@shared_task
+def drain_email_outbox(batch_size=50):
+    """
+    Deliver pending outbox emails using one SMTP connection per batch.
+
+    Keeps draining while full batches come back so a backlog clears in one run.
+
+    Returns:
+        dict: Result status and delivery counts
+    """
+    from .utils.email_service import drain_outbox
+
+    sent = failed = 0
+    while True:
+        result = drain_outbox(batch_size=batch_size)
+        sent += result['sent']
+        failed += result['failed']
+        if result['sent'] + result['failed'] < batch_size:
+            break
+
+    return {
+        'status': 'success',
+        'sent': sent,
+        'failed': failed,
+    }
+
+
+@shared_task
+def mark_overdue_invoices():
+    """
+    Daily task that flips pending invoices past their due date to overdue.
+
+    Returns:
+        dict: Result status and number of invoices updated
+    """
+    from .utils.payables import mark_overdue_invoices as sweep
+
+    return {
+        'status': 'success',
+        'marked_overdue': sweep(),
+    }
+
+
+@shared_task
+def process_notification_events(events):
+    """
+    Build notifications for a batch of [event_type, object_id] events
+    recorded by the model signals after their transaction committed.
+
+    Returns:
+        dict: Result status and number of notifications created
+    """
+    from .utils.notifications import process_events
+
+    return {
+        'status': 'success',
+        'events': len(events),
+        'notifications_created': process_events(events),
+    }
+
+
+@shared_task
+def reconcile_unread_notification_counts():
+    """
+    Periodic task that resets the Redis unread counters from the database
+    so missed or duplicated adjustments never drift for long.
+
+    Returns:
+        dict: Result status and number of counters written
+    """
+    from .utils.realtime import reconcile_unread_counts
+
+    return {
+        'status': 'success',
+        'counters': reconcile_unread_counts(),
+    }
+
+
+@shared_task
+def purge_read_notifications(days=None):
+    """
+    Periodic task that deletes notifications read longer ago than the
+    NOTIFICATION_RETENTION_DAYS setting.
+
+    Returns:
+        dict: Result status and number of notifications deleted
+    """
+    from .utils.notifications import purge_read_notifications as purge
+
+    return {
+        'status': 'success',
+        'deleted': purge(days=days),
+    }
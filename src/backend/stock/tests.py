@@ -1,3 +1,289 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .models import (
+    Stock, CommittedStock, StockReservation, StockLocation, StockTransfer, Store,
+    Manufacturer, DeliveryPerson, PurchaseOrder, Invoice, Payment,
+)
+from .utils.allocation import allocate, reallocate, InsufficientStock, reconcile_committed_quantities
+from .utils.payables import record_bank_matches
+from .utils.transfers import create_bulk_transfer, InsufficientLocationStock
+
+
+class AllocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('allocator')
+        self.stock = Stock.objects.create(item_name='Amplifier', sku='AMP-1', quantity=5)
+
+    def commitment(self, quantity):
+        return CommittedStock(
+            stock_id=self.stock.pk, quantity=quantity, committed_by=self.user,
+            customer_order_number='SO-1', deposit_amount=Decimal('10.00'), customer_name='Customer',
+        )
+
+    def reservation(self, quantity):
+        return StockReservation(
+            stock_id=self.stock.pk, quantity=quantity, reserved_by=self.user,
+            reason='Hold', expires_at=timezone.now() + timedelta(days=1),
+        )
+
+    def test_commitment_and_reservation_share_available_stock(self):
+        allocate(self.commitment(3))
+        allocate(self.reservation(2))
+
+        with self.assertRaises(InsufficientStock) as raised:
+            allocate(self.reservation(1))
+        self.assertEqual(raised.exception.available, 0)
+
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.committed_quantity, 3)
+        self.assertEqual(self.stock.available_for_sale, 0)
+
+    def test_updates_that_take_more_stock_are_checked(self):
+        commitment = allocate(self.commitment(3))
+        allocate(self.reservation(1))
+
+        with self.assertRaises(InsufficientStock) as raised:
+            reallocate(commitment, {'quantity': 5})
+        self.assertEqual(raised.exception.available, 4)
+
+        reallocate(commitment, {'quantity': 4})
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.committed_quantity, 4)
+        self.assertEqual(self.stock.available_for_sale, 0)
+
+    def test_rejected_allocation_is_not_saved(self):
+        with self.assertRaises(InsufficientStock):
+            allocate(self.commitment(6))
+        self.assertFalse(CommittedStock.objects.exists())
+
+
+class CommittedQuantityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('committer')
+        self.stock = Stock.objects.create(item_name='Speaker', sku='SPK-1', quantity=20)
+
+    def commit(self, quantity):
+        return CommittedStock.objects.create(
+            stock=self.stock, quantity=quantity, committed_by=self.user,
+            customer_order_number='SO-1', deposit_amount=Decimal('10.00'), customer_name='Customer',
+        )
+
+    def committed(self):
+        self.stock.refresh_from_db()
+        return self.stock.committed_quantity
+
+    def test_create_fulfil_edit_and_delete_apply_deltas(self):
+        first = self.commit(4)
+        second = self.commit(3)
+        self.assertEqual(self.committed(), 7)
+
+        second.quantity = 5
+        second.save()
+        self.assertEqual(self.committed(), 9)
+
+        first.is_fulfilled = True
+        first.save()
+        first.save()  # Saving a fulfilled commitment again changes nothing
+        self.assertEqual(self.committed(), 5)
+
+        second.delete()
+        self.assertEqual(self.committed(), 0)
+
+    def test_full_stock_save_keeps_committed_quantity(self):
+        stale = Stock.objects.get(pk=self.stock.pk)
+        self.commit(4)
+
+        stale.quantity = 18
+        stale.save()
+        self.assertEqual(stale.committed_quantity, 4)
+        self.assertEqual(self.committed(), 4)
+        self.assertEqual(self.stock.quantity, 18)
+
+    def test_reconcile_repairs_drift(self):
+        self.commit(4)
+        Stock.objects.filter(pk=self.stock.pk).update(committed_quantity=11)
+
+        self.assertEqual(reconcile_committed_quantities(dry_run=True), [(self.stock.pk, 'Speaker', 11, 4)])
+        self.assertEqual(self.committed(), 11)
+
+        reconcile_committed_quantities()
+        self.assertEqual(self.committed(), 4)
+        self.assertEqual(reconcile_committed_quantities(), [])
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('mover')
+        self.warehouse = Store.objects.create(name='Warehouse', location='Silverwater')
+        self.store = Store.objects.create(name='Store', location='Sydney')
+        self.stocks = [
+            Stock.objects.create(item_name=f'Cable {n}', sku=f'CBL-{n}', quantity=10)
+            for n in range(3)
+        ]
+        for stock in self.stocks:
+            StockLocation.objects.create(stock=stock, store=self.warehouse, quantity=10)
+        StockLocation.objects.create(stock=self.stocks[0], store=self.store, quantity=2)
+
+    def quantity_at(self, stock, store):
+        location = StockLocation.objects.filter(stock=stock, store=store).first()
+        return location.quantity if location else 0
+
+    def test_restock_completion_fails_cleanly_without_source_stock(self):
+        transfer = StockTransfer.objects.create(
+            stock=self.stocks[0], quantity=11, from_location=self.warehouse, to_location=self.store,
+            transfer_type='restock', transfer_reason='Restock', created_by=self.user,
+        )
+
+        self.assertFalse(transfer.complete(self.user))
+
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, 'pending')
+        self.assertEqual(self.quantity_at(self.stocks[0], self.warehouse), 10)
+        self.assertEqual(self.quantity_at(self.stocks[0], self.store), 2)
+
+    def test_bulk_transfer_moves_all_lines(self):
+        lines = [{'stock_id': stock.pk, 'quantity': 4} for stock in self.stocks]
+        lines.append({'stock_id': self.stocks[1].pk, 'quantity': 1, 'to_aisle': 'B2'})
+
+        result = create_bulk_transfer(self.warehouse, self.store, lines, self.user, 'Replenish', complete=True)
+
+        self.assertEqual(result, {'transfers_created': 3, 'units': 13})
+        self.assertEqual(StockTransfer.objects.filter(status='completed').count(), 3)
+        self.assertEqual(self.quantity_at(self.stocks[0], self.store), 6)
+        self.assertEqual(self.quantity_at(self.stocks[1], self.warehouse), 5)
+        self.assertEqual(StockLocation.objects.get(stock=self.stocks[1], store=self.store).aisle, 'B2')
+
+    def test_bulk_transfer_with_a_short_line_writes_nothing(self):
+        lines = [{'stock_id': self.stocks[0].pk, 'quantity': 4}, {'stock_id': self.stocks[1].pk, 'quantity': 12}]
+
+        with self.assertRaises(InsufficientLocationStock) as raised:
+            create_bulk_transfer(self.warehouse, self.store, lines, self.user, 'Replenish', complete=True)
+
+        self.assertEqual(raised.exception.shortages, [(self.stocks[1].pk, 10, 12)])
+        self.assertFalse(StockTransfer.objects.exists())
+        self.assertEqual(self.quantity_at(self.stocks[0], self.warehouse), 10)
+
+
+class PaymentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('accounts')
+        manufacturer = Manufacturer.objects.create(
+            company_name='Maker', company_email='ap@maker.test', street_address='1 Road', city='Sydney',
+            country='Australia', region='NSW', postal_code='2000', company_telephone='0200000000',
+        )
+        purchase_order = PurchaseOrder.objects.create(
+            manufacturer=manufacturer, created_by=self.user,
+            delivery_person=DeliveryPerson.objects.create(name='Driver', phone_number='0400000000'),
+        )
+        self.invoice = Invoice.objects.create(
+            purchase_order=purchase_order, invoice_number='INV-1', created_by=self.user,
+            invoice_date=timezone.localdate(), due_date=timezone.localdate() + timedelta(days=30),
+            invoice_amount_exc=Decimal('100.00'), gst_amount=Decimal('10.00'), invoice_total=Decimal('110.00'),
+        )
+
+    def match(self, reference, amount):
+        return {
+            'invoice': self.invoice.pk, 'payment_reference': reference,
+            'payment_date': timezone.localdate(), 'payment_amount': Decimal(amount),
+        }
+
+    def test_resubmitted_matches_are_not_recorded_twice(self):
+        matches = [self.match('EFT 001', '50.00')]
+        payments, errors = record_bank_matches(matches, self.user)
+        self.assertEqual((len(payments), errors), (1, []))
+
+        payments, errors = record_bank_matches(matches, self.user)
+        self.assertEqual(payments, [])
+        self.assertEqual(errors[0]['error'], 'Reference already recorded')
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_repeats_and_overpayments_in_a_batch_are_rejected(self):
+        payments, errors = record_bank_matches([
+            self.match('EFT-1', '60.00'),
+            self.match('eft 1', '10.00'),
+            self.match('EFT-2', '60.00'),
+        ], self.user)
+
+        self.assertEqual(len(payments), 1)
+        self.assertEqual([e['index'] for e in errors], [1, 2])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.outstanding_amount, Decimal('50.00'))
+
+    def test_saving_a_payment_refreshes_its_loaded_invoice(self):
+        payment = Payment(
+            invoice=self.invoice, payment_reference='CHQ 7', payment_date=timezone.localdate(),
+            payment_amount=Decimal('110.00'), payment_method='check', created_by=self.user,
+        )
+        payment.save()
+        self.assertEqual((self.invoice.status, self.invoice.outstanding_amount), ('fully_paid', Decimal('0.00')))
+
+        payment.delete()
+        self.assertEqual((self.invoice.status, self.invoice.outstanding_amount), ('pending', Decimal('110.00')))
+
+
+@skipUnless(connection.features.has_select_for_update, 'Needs row locks')
+class ConcurrentAllocationTests(TransactionTestCase):
+    """Parallel allocations of the last units must not oversell"""
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user('allocator')
+        self.stock = Stock.objects.create(item_name='Amplifier', sku='AMP-1', quantity=3)
+
+    def run_in_parallel(self, make_allocation):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def worker(n):
+            try:
+                barrier.wait()
+                allocate(make_allocation(n))
+                results.append('allocated')
+            except InsufficientStock:
+                results.append('rejected')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_parallel_commitments_do_not_oversell(self):
+        results = self.run_in_parallel(lambda n: CommittedStock(
+            stock_id=self.stock.pk, quantity=1, committed_by=self.user,
+            customer_order_number=f'SO-{n}', deposit_amount=Decimal('10.00'), customer_name='Customer',
+        ))
+
+        self.assertEqual(results.count('allocated'), 3)
+        self.assertEqual(results.count('rejected'), self.THREADS - 3)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.committed_quantity, 3)
+
+    def test_parallel_commitments_and_reservations_do_not_oversell(self):
+        def make_allocation(n):
+            if n % 2:
+                return StockReservation(
+                    stock_id=self.stock.pk, quantity=1, reserved_by=self.user,
+                    reason='Hold', expires_at=timezone.now() + timedelta(days=1),
+                )
+            return CommittedStock(
+                stock_id=self.stock.pk, quantity=1, committed_by=self.user,
+                customer_order_number=f'SO-{n}', deposit_amount=Decimal('10.00'), customer_name='Customer',
+            )
+
+        results = self.run_in_parallel(make_allocation)
+
+        self.assertEqual(results.count('allocated'), 3)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.available_for_sale, 0)
@@ -60,6 +60,8 @@ urlpatterns = [
     path('api/notifications/mark-read/', views.mark_notification_read, name='mark_notification_read'),
     path('api/notifications/mark-all-read/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
     path('api/notifications/count/', views.get_unread_count, name='get_unread_count'),
+    path('api/notifications/poll/', views.poll_notifications, name='poll_notifications'),
+    path('api/notifications/stream/', views.notification_stream, name='notification_stream'),
     
     # Notification pages
     path('notifications/', views.notifications_list, name='notifications_list'),
@@ -123,6 +125,7 @@ urlpatterns = [
     path('invoices/<int:invoice_id>/record-payment/', views.record_payment, name='record_payment'),
     path('payments/<int:payment_id>/', views.payment_detail, name='payment_detail'),
     path('financial-dashboard/', views.financial_dashboard, name='financial_dashboard'),
+    path('financial-dashboard/aging-export/', views.ap_aging_export, name='ap_aging_export'),
 
     # Minimal password reset URLs that registration backend expects
     path('accounts/password/reset/', 
@@ -0,0 +1,152 @@
+"""
+Stock allocation
+
+Commitments and reservations are recorded through ``allocate`` (and
+edited through ``reallocate``) so the availability check and the write
+happen under a row lock on the stock item. Concurrent allocations of the same item queue on that lock, so two
+requests can no longer both take the last unit. Form and serializer checks
+of ``available_for_sale`` remain only as early feedback.
+
+``Stock.committed_quantity`` is maintained by signed deltas applied as
+commitments are created, fulfilled, cancelled and deleted (see
+``CommittedStock.save``); ``reconcile_committed_quantities`` repairs any
+drift, e.g. after bulk deletes that bypass the model.
+"""
+from django.db import transaction
+from django.db.models import Sum
+
+from ..models import Stock, CommittedStock
+
+
+class InsufficientStock(ValueError):
+    """Raised when an allocation asks for more than is available for sale"""
+
+    def __init__(self, available, requested):
+        self.available = available
+        self.requested = requested
+        super().__init__(f"Not enough stock available. Available: {available}, Requested: {requested}")
+
+
+def allocate(allocation):
+    """
+    Save an unsaved CommittedStock or StockReservation if its stock item
+    has enough available for sale.
+
+    The stock row is locked with SELECT ... FOR UPDATE before available
+    stock (on hand - committed - active reservations) is read, and stays
+    locked until the allocation is written.
+
+    Returns:
+        The saved allocation.
+
+    Raises:
+        InsufficientStock: If the quantity exceeds what is available.
+        Stock.DoesNotExist: If the stock item does not exist.
+    """
+    with transaction.atomic():
+        stock = Stock.objects.select_for_update().get(pk=allocation.stock_id)
+        available = stock.available_for_sale
+        if allocation.quantity > available:
+            raise InsufficientStock(available, allocation.quantity)
+
+        allocation.stock = stock
+        allocation.save()
+    return allocation
+
+
+def _held(allocation):
+    """Units a commitment or reservation currently takes from available stock"""
+    if isinstance(allocation, CommittedStock):
+        return allocation.committed_contribution
+    return allocation.quantity if allocation.is_active() else 0
+
+
+def reallocate(allocation, changes):
+    """
+    Apply changes to a saved CommittedStock or StockReservation, re-checking
+    availability when it would take more stock.
+
+    The allocation row and then its old and new stock rows are locked
+    before the check. Units the allocation already holds on the target
+    stock count as available to it, so shrinking or editing other fields
+    never fails.
+
+    Returns:
+        The saved allocation.
+
+    Raises:
+        InsufficientStock: If the change needs more than is available.
+        Stock.DoesNotExist: If the new stock item does not exist.
+    """
+    model = type(allocation)
+    with transaction.atomic():
+        stored = model.objects.select_for_update().get(pk=allocation.pk)
+        for attr, value in changes.items():
+            setattr(allocation, attr, value)
+
+        stocks = {
+            stock.pk: stock
+            for stock in Stock.objects.select_for_update().filter(
+                pk__in={stored.stock_id, allocation.stock_id}
+            ).order_by('pk')
+        }
+        if allocation.stock_id not in stocks:
+            raise Stock.DoesNotExist(f"Stock {allocation.stock_id} does not exist")
+
+        held = _held(stored) if stored.stock_id == allocation.stock_id else 0
+        needed = _held(allocation)
+        if needed > held:
+            available = stocks[allocation.stock_id].available_for_sale + held
+            if needed > available:
+                raise InsufficientStock(available, allocation.quantity)
+
+        allocation.stock = stocks[allocation.stock_id]
+        allocation.save()
+    return allocation
+
+
+def _open_commitment_totals(stock_ids=None):
+    """Unfulfilled committed units per stock id (one grouped query)"""
+    commitments = CommittedStock.objects.filter(is_fulfilled=False)
+    if stock_ids is not None:
+        commitments = commitments.filter(stock_id__in=stock_ids)
+    return dict(
+        commitments.order_by().values('stock_id').annotate(
+            total=Sum('quantity')
+        ).values_list('stock_id', 'total')
+    )
+
+
+def reconcile_committed_quantities(dry_run=False):
+    """
+    Reset committed_quantity wherever it differs from the stock's open
+    commitments.
+
+    Drifted items are found with one aggregate pass, then each is corrected
+    under a row lock from a fresh total so concurrent deltas are not lost.
+
+    Returns:
+        list: (stock id, item name, stored quantity, correct quantity) per drifted item.
+    """
+    expected = _open_commitment_totals()
+    drifted = [
+        (stock_id, item_name, committed or 0, expected.get(stock_id, 0))
+        for stock_id, item_name, committed in Stock.objects.order_by('id').values_list(
+            'id', 'item_name', 'committed_quantity'
+        ).iterator(chunk_size=5000)
+        if (committed or 0) != expected.get(stock_id, 0)
+    ]
+    if dry_run or not drifted:
+        return drifted
+
+    corrected = []
+    for stock_id, item_name, _, _ in drifted:
+        with transaction.atomic():
+            stored = Stock.objects.select_for_update().filter(pk=stock_id).values_list(
+                'committed_quantity', flat=True
+            ).first() or 0
+            total = _open_commitment_totals([stock_id]).get(stock_id, 0)
+            if stored != total:
+                Stock.objects.filter(pk=stock_id).update(committed_quantity=total)
+                corrected.append((stock_id, item_name, stored, total))
+    return corrected
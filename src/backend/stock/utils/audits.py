@@ -0,0 +1,457 @@
+"""
+Stock audit item generation and counting
+
+Starting an audit snapshots every stock item in its scope into a
+StockAuditItem. The scope and the committed / reserved quantities are
+resolved by one annotated queryset, and items are inserted in keyset-ordered
+chunks with ``bulk_create`` by a background job that records its progress on
+the audit, so large audits never run inside the request.
+
+Counts submitted in batches are resolved, written and folded into the audit
+statistics with a fixed number of queries per batch, and approved variances
+are applied to stock in one transaction of bulk statements.
+
+Every write to an audit item stamps it with the next audit sync version, so
+offline devices can download a snapshot once and then fetch only the lines
+changed past the version they last saw.
+"""
+import json
+import logging
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from django.contrib.auth.models import User
+
+from ..models import (
+    Stock, StockLocation, StockHistory, CommittedStock, StockReservation, StockAudit, StockAuditItem
+)
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CHUNK_SIZE = 2000
+
+# Audits with more variances than this are adjusted by the worker
+ADJUSTMENT_INLINE_LIMIT = 500
+
+# Offline sync line layout: (output key, queryset field)
+SYNC_FIELDS = [
+    ('id', 'id'),
+    ('stock_id', 'stock_id'),
+    ('sku', 'stock__sku'),
+    ('item_name', 'stock__item_name'),
+    ('system_quantity', 'system_quantity'),
+    ('physical_count', 'physical_count'),
+    ('variance_quantity', 'variance_quantity'),
+    ('variance_notes', 'variance_notes'),
+    ('audit_location', 'audit_location'),
+    ('audit_aisle', 'audit_aisle'),
+    ('conflicting_count', 'conflicting_count'),
+    ('version', 'version'),
+]
+SYNC_CHUNK_SIZE = 2000
+
+
+def audit_scope(audit):
+    """Stock items covered by an audit's locations and categories"""
+    if audit.scheduled:
+        # Scheduled cycle counts are fixed to the items picked when they were created
+        return Stock.objects.filter(audit_items__audit=audit)
+
+    stocks = Stock.objects.all()
+
+    store_ids = list(audit.audit_locations.values_list('id', flat=True))
+    if store_ids:
+        # Held at one of the stores, either as the item's home location or a StockLocation row
+        stocks = stocks.filter(
+            Q(location_id__in=store_ids) |
+            Exists(StockLocation.objects.filter(stock=OuterRef('pk'), store_id__in=store_ids))
+        )
+
+    category_ids = list(audit.audit_categories.values_list('id', flat=True))
+    if category_ids:
+        stocks = stocks.filter(category_id__in=category_ids)
+
+    return stocks
+
+
+def _snapshot_rows(audit, now, stocks=None):
+    """Scope rows not yet in the audit, annotated with their committed and reserved totals"""
+    committed = CommittedStock.objects.filter(
+        stock=OuterRef('pk'),
+        is_fulfilled=False,
+    ).order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+
+    reserved = StockReservation.objects.filter(
+        stock=OuterRef('pk'),
+        status='active',
+        expires_at__gt=now,
+    ).order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+
+    stocks = audit_scope(audit) if stocks is None else stocks
+    return stocks.exclude(
+        Exists(StockAuditItem.objects.filter(audit=audit, stock=OuterRef('pk')))
+    ).annotate(
+        system_quantity=Coalesce(F('quantity'), Value(0)),
+        committed_total=Coalesce(Subquery(committed), Value(0)),
+        reserved_total=Coalesce(Subquery(reserved), Value(0)),
+    ).values_list(
+        'id', 'system_quantity', 'committed_total', 'reserved_total', 'location__name', 'aisle'
+    )
+
+
+def insert_snapshot_rows(audit_id, rows, abc_classes=None):
+    """
+    Bulk insert audit items from ``_snapshot_rows`` tuples, stamped with
+    fresh sync versions. Call inside a transaction.
+    """
+    abc_classes = abc_classes or {}
+    first_version = StockAudit.allocate_sync_versions(audit_id, len(rows))
+    return StockAuditItem.objects.bulk_create([
+        StockAuditItem(
+            audit_id=audit_id,
+            stock_id=stock_id,
+            system_quantity=system_quantity,
+            committed_quantity=committed,
+            reserved_quantity=reserved,
+            audit_location=location_name,
+            audit_aisle=aisle,
+            abc_class=abc_classes.get(stock_id),
+            version=first_version + offset,
+        )
+        for offset, (stock_id, system_quantity, committed, reserved, location_name, aisle) in enumerate(rows)
+    ], batch_size=GENERATION_CHUNK_SIZE)
+
+
+def generate_audit_items(audit_id, chunk_size=GENERATION_CHUNK_SIZE):
+    """
+    Create audit items for every stock item in the audit's scope.
+
+    Items already on the audit are skipped, so the job can be re-run after a
+    failure. ``total_items_planned`` grows with each committed chunk and
+    ``item_generation_total`` holds the target, which together give progress;
+    ``item_generation_heartbeat`` is stamped at every step so a job that was
+    lost can be told from one that is still working.
+
+    Returns:
+        int: Number of audit items created.
+    """
+    audit = StockAudit.objects.get(pk=audit_id)
+    now = timezone.now()
+    rows = _snapshot_rows(audit, now)
+
+    existing = audit.audit_items.count()
+    StockAudit.objects.filter(pk=audit_id).update(
+        item_generation_status='running',
+        item_generation_total=existing + rows.count(),
+        item_generation_heartbeat=timezone.now(),
+        total_items_planned=existing,
+    )
+
+    created = 0
+    last_id = 0
+    try:
+        while True:
+            chunk = list(rows.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+
+            with transaction.atomic():
+                # Stop if the audit was completed or cancelled meanwhile
+                if not StockAudit.objects.select_for_update().filter(
+                    pk=audit_id, status__in=['planned', 'in_progress']
+                ).exists():
+                    logger.warning(f"Audit {audit.audit_reference} closed during item generation; stopping")
+                    StockAudit.objects.filter(pk=audit_id).update(item_generation_status='failed')
+                    return created
+                insert_snapshot_rows(audit_id, chunk)
+                StockAudit.objects.filter(pk=audit_id).update(
+                    total_items_planned=F('total_items_planned') + len(chunk),
+                    item_generation_heartbeat=timezone.now(),
+                )
+            created += len(chunk)
+    except Exception:
+        StockAudit.objects.filter(pk=audit_id).update(item_generation_status='failed')
+        logger.exception(f"Audit item generation failed for {audit.audit_reference} after {created} items")
+        raise
+
+    StockAudit.objects.filter(pk=audit_id).update(
+        item_generation_status='completed',
+        item_generation_heartbeat=timezone.now(),
+        total_items_planned=existing + created,
+    )
+    logger.info(f"Created {created} audit items for audit {audit.audit_reference}")
+    return created
+
+
+def queue_audit_item_generation(audit):
+    """
+    Mark the audit as pending generation and start the job once the current
+    transaction commits (inline when Celery is unavailable).
+    """
+    audit.item_generation_status = 'pending'
+    audit.item_generation_heartbeat = timezone.now()
+    StockAudit.objects.filter(pk=audit.pk).update(
+        item_generation_status='pending',
+        item_generation_heartbeat=audit.item_generation_heartbeat,
+    )
+
+    from ..tasks import generate_audit_items as generate_audit_items_task
+
+    def dispatch():
+        if getattr(settings, 'CELERY_AVAILABLE', False):
+            generate_audit_items_task.delay(audit.pk)
+        else:
+            generate_audit_items_task(audit.pk)
+
+    transaction.on_commit(dispatch)
+
+
+def record_counts(audit, entries, counted_by, on_conflict=None):
+    """
+    Apply a batch of physical counts to an audit.
+
+    Each entry identifies its line by ``item_id`` or by the stock ``sku``
+    (``barcode`` is accepted as an alias for scanners). Lines are resolved
+    with one locking query, written with one ``bulk_update`` and the audit
+    statistics are adjusted with one delta UPDATE. When a line appears more
+    than once the last count wins.
+
+    Entries uploaded from offline devices carry the ``base_version`` they
+    were counted against. When the line has changed since, ``on_conflict``
+    decides: ``'overwrite'`` applies the count anyway (last writer wins) and
+    ``'flag'`` keeps the server count and stores the upload in
+    ``conflicting_count`` for review.
+
+    Returns:
+        list: One result dict per entry, in order.
+    """
+    item_ids = {entry['item_id'] for entry in entries if entry.get('item_id') is not None}
+    codes = {entry.get('sku') or entry.get('barcode') for entry in entries} - {None, ''}
+
+    now = timezone.now()
+    with transaction.atomic():
+        items = list(
+            audit.audit_items.select_for_update().select_related('stock').only(
+                'id', 'audit', 'stock', 'stock__sku', 'system_quantity', 'physical_count', 'variance_quantity',
+                'variance_notes', 'variance_reason', 'counted_by', 'count_date', 'updated_at',
+                'version', 'conflicting_count'
+            ).filter(Q(id__in=item_ids) | Q(stock__sku__in=codes)).order_by('id')  # Consistent lock order
+        )
+        by_id = {item.id: item for item in items}
+        by_code = {item.stock.sku: item for item in items if item.stock.sku}
+
+        before = {}
+        results = []
+        for index, entry in enumerate(entries):
+            if entry.get('item_id') is not None:
+                item = by_id.get(entry['item_id'])
+            else:
+                item = by_code.get(entry.get('sku') or entry.get('barcode'))
+            if item is None:
+                results.append({'index': index, 'status': 'not_found'})
+                continue
+
+            before.setdefault(item.id, item.statistics_contribution)
+            base_version = entry.get('base_version')
+            conflict = base_version is not None and item.version > base_version
+            if conflict and on_conflict == 'flag':
+                item.conflicting_count = entry['count']
+                item.updated_at = now
+                results.append({
+                    'index': index,
+                    'status': 'conflict',
+                    'item_id': item.id,
+                    'physical_count': item.physical_count,
+                    'version': item.version,
+                })
+                continue
+
+            item.physical_count = entry['count']
+            item.conflicting_count = None
+            item.variance_quantity = item.physical_count - item.system_quantity
+            if entry.get('notes') is not None:
+                item.variance_notes = entry['notes']
+            if entry.get('variance_reason'):
+                item.variance_reason = entry['variance_reason']
+            item.counted_by = counted_by
+            item.count_date = now
+            item.updated_at = now
+            results.append({
+                'index': index,
+                'status': 'counted',
+                'item_id': item.id,
+                'variance': item.variance_quantity,
+            })
+            if conflict:
+                results[-1]['overwrote'] = True
+
+        counted = [by_id[item_id] for item_id in before]
+        if counted:
+            first_version = StockAudit.allocate_sync_versions(audit.pk, len(counted))
+            for offset, item in enumerate(counted):
+                item.version = first_version + offset
+        StockAuditItem.objects.bulk_update(
+            counted,
+            ['physical_count', 'variance_quantity', 'variance_notes', 'variance_reason',
+             'counted_by', 'count_date', 'updated_at', 'version', 'conflicting_count'],
+            batch_size=500,
+        )
+        for result in results:
+            if 'item_id' in result:
+                result['version'] = by_id[result['item_id']].version
+
+        delta = {'counted': 0, 'variances': 0, 'variance_value': 0}
+        for item in counted:
+            for key, value in StockAuditItem.statistics_delta(before[item.id], item.statistics_contribution).items():
+                delta[key] += value
+        StockAudit.apply_statistics_delta(audit.pk, **delta)
+
+    return results
+
+
+def stream_sync_lines(audit, since=None):
+    """
+    Yield an audit's items as gzip-compressed JSON lines for offline devices.
+
+    The first line is a header with the audit's current sync version, which
+    the device sends back as ``since`` on its next fetch. Without ``since``
+    every item is sent (the snapshot); with it only items changed after that
+    version, oldest change first. Rows are read with a server-side iterator
+    and compressed as they stream, so the payload is never held in memory.
+    Rows changed while the stream runs may also appear; re-applying them on
+    the next fetch is harmless.
+    """
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    keys = [key for key, _ in SYNC_FIELDS]
+
+    header = {
+        'audit': audit.pk,
+        'audit_reference': audit.audit_reference,
+        'status': audit.status,
+        'version': StockAudit.objects.filter(pk=audit.pk).values_list('sync_version', flat=True).get(),
+        'since': since,
+    }
+    yield compressor.compress((json.dumps(header) + '\n').encode())
+
+    items = StockAuditItem.objects.filter(audit=audit)
+    if since is None:
+        items = items.order_by('id')
+    else:
+        items = items.filter(version__gt=since).order_by('version')
+
+    rows = items.values_list(*[field for _, field in SYNC_FIELDS])
+    for row in rows.iterator(chunk_size=SYNC_CHUNK_SIZE):
+        data = compressor.compress((json.dumps(dict(zip(keys, row)), cls=DjangoJSONEncoder) + '\n').encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _pending_adjustments(audit):
+    """Counted variance items whose adjustment has not been applied yet"""
+    return audit.audit_items.filter(
+        adjustment_applied=False,
+        physical_count__isnull=False,
+    ).exclude(variance_quantity=0)
+
+
+def apply_audit_adjustments(audit_id, user_id=None):
+    """
+    Set stock quantities to the physical counts of an audit's variance items.
+
+    Runs as one transaction: stock rows are locked and written with
+    ``bulk_update``, stocktake history rows are inserted with
+    ``bulk_create`` and the items are marked applied with one UPDATE. Only
+    items not yet marked applied are touched, so a retried or repeated run
+    never adjusts an item twice.
+
+    Returns:
+        int: Number of adjustments applied.
+    """
+    user = User.objects.filter(pk=user_id).first() if user_id else None
+    username = user.username if user else 'System'
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Serialises concurrent runs for the same audit
+        audit = StockAudit.objects.select_for_update().get(pk=audit_id)
+
+        items = list(
+            _pending_adjustments(audit).order_by('stock_id').values_list(
+                'id', 'stock_id', 'physical_count', 'variance_quantity', 'variance_reason', 'variance_notes'
+            )
+        )
+        if not items:
+            return 0
+
+        stocks = Stock.objects.select_for_update().only(
+            'id', 'quantity', 'item_name', 'category_id', 'last_updated'
+        ).in_bulk([stock_id for _, stock_id, _, _, _, _ in items])
+
+        reasons = dict(StockAuditItem.VARIANCE_REASON_CHOICES)
+        history = []
+        for _, stock_id, physical_count, variance, reason, notes in items:
+            stock = stocks[stock_id]
+            old_quantity = stock.quantity
+            stock.quantity = physical_count
+            stock.last_updated = now
+
+            adjustment_type = "increased" if variance > 0 else "decreased"
+            note = (
+                f"Stocktake Adjustment ({audit.audit_reference}): Quantity {adjustment_type} by {abs(variance)} units. "
+                f"System: {old_quantity}, Physical Count: {physical_count}. "
+                f"{reasons.get(reason, '')} {notes or ''}"
+            ).strip()
+            history.append(StockHistory(
+                category_id=stock.category_id,
+                item_name=stock.item_name,
+                quantity=physical_count,
+                issue_quantity=abs(variance) if variance < 0 else 0,
+                receive_quantity=variance if variance > 0 else 0,
+                issued_by=username if variance < 0 else None,
+                received_by=username if variance > 0 else None,
+                note=note[:255],
+                created_by=username,
+                last_updated=now,
+                timestamp=now,
+            ))
+
+        Stock.objects.bulk_update(list(stocks.values()), ['quantity', 'last_updated'], batch_size=1000)
+        StockHistory.objects.bulk_create(history, batch_size=1000)
+        StockAuditItem.objects.filter(id__in=[item_id for item_id, _, _, _, _, _ in items]).update(
+            adjustment_applied=True,
+            adjustment_date=now,
+            updated_at=now,
+            version=StockAudit.allocate_sync_versions(audit_id, 1),
+        )
+
+    logger.info(f"Applied {len(items)} stocktake adjustments for audit {audit.audit_reference}")
+    return len(items)
+
+
+def schedule_audit_adjustments(audit, user):
+    """
+    Apply an audit's adjustments inline when there are few, otherwise queue
+    them for the worker after the current transaction commits.
+
+    Returns:
+        int or None: Adjustments applied inline, or None when queued.
+    """
+    from ..tasks import apply_audit_adjustments as apply_audit_adjustments_task
+
+    user_id = user.pk if user else None
+    if (
+        not getattr(settings, 'CELERY_AVAILABLE', False)
+        or _pending_adjustments(audit).count() <= ADJUSTMENT_INLINE_LIMIT
+    ):
+        return apply_audit_adjustments(audit.pk, user_id)
+
+    transaction.on_commit(lambda: apply_audit_adjustments_task.delay(audit.pk, user_id))
+    return None
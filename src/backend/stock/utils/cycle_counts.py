@@ -0,0 +1,202 @@
+"""
+ABC cycle-count scheduling
+
+Stock items are classified A/B/C by movement value (issued quantity over the
+velocity window times the last purchase price): the items making up the
+first 80% of value are A, the next 15% B and the rest C. Each class has a
+count interval, and every night the most overdue items, weighted by class,
+are put into one cycle-count audit sized to the daily counting capacity, so
+A items come round most often and no audit holds the whole catalogue.
+"""
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ..models import Stock, StockAudit, StockAuditItem
+from .audits import _snapshot_rows, insert_snapshot_rows
+from .reorder import DEFAULT_WINDOW_DAYS, _issued_by_item_name, _last_purchase_by_product
+
+logger = logging.getLogger(__name__)
+
+# Cumulative share of movement value closing classes A and B
+CLASS_A_SHARE = 0.80
+CLASS_B_SHARE = 0.95
+
+DEFAULT_CAPACITY = 300
+MAX_CAPACITY = 5000
+DEFAULT_INTERVAL_DAYS = {'A': 30, 'B': 90, 'C': 180}
+
+
+def classify_stock(window_days=DEFAULT_WINDOW_DAYS):
+    """
+    Classify every stock item by movement value.
+
+    Returns:
+        tuple: (stock ids, movement values, classes) as parallel numpy arrays.
+    """
+    since = timezone.now() - timedelta(days=window_days)
+    rows = list(Stock.objects.order_by().values_list('id', 'item_name').iterator(chunk_size=5000))
+    count = len(rows)
+    if not count:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype='<U1')
+
+    issued_map = _issued_by_item_name(since)
+    last_purchase = _last_purchase_by_product()
+
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=count)
+    issued = np.fromiter((issued_map.get(r[1], 0) or 0 for r in rows), dtype=np.float64, count=count)
+    price = np.fromiter(
+        (float(last_purchase.get(r[1], (None, None))[1] or np.nan) for r in rows),
+        dtype=np.float64, count=count
+    )
+
+    # Items never purchased through a PO are valued at the median known price
+    known = ~np.isnan(price)
+    price[~known] = np.median(price[known]) if known.any() else 1.0
+    value = issued * price
+
+    classes = np.full(count, 'C', dtype='<U1')
+    total = value.sum()
+    if total > 0:
+        order = np.argsort(-value, kind='stable')
+        # Share of value held by the items ranked before each one
+        preceding = (np.cumsum(value[order]) - value[order]) / total
+        ranked = np.where(preceding < CLASS_A_SHARE, 'A', np.where(preceding < CLASS_B_SHARE, 'B', 'C'))
+        classes[order] = ranked
+        classes[value <= 0] = 'C'
+
+    return ids, value, classes
+
+
+def _last_counted():
+    """Most recent physical count date per stock id (one grouped query)"""
+    return dict(
+        StockAuditItem.objects.filter(
+            physical_count__isnull=False,
+        ).order_by().values('stock_id').annotate(
+            last=Max('count_date')
+        ).values_list('stock_id', 'last')
+    )
+
+
+def _open_scheduled_stock_ids():
+    """Stock already waiting on an open scheduled cycle count"""
+    return set(
+        StockAuditItem.objects.filter(
+            audit__scheduled=True,
+            audit__status__in=['planned', 'in_progress'],
+        ).values_list('stock_id', flat=True)
+    )
+
+
+def pick_cycle_count_items(capacity, interval_days=None, now=None):
+    """
+    Choose the stock items due for counting, most overdue first.
+
+    Overdue-ness is days since the last count divided by the class interval;
+    items never counted come first, highest movement value first.
+
+    Returns:
+        dict: stock id -> ABC class for at most ``capacity`` items.
+    """
+    if capacity < 1:
+        return {}
+    now = now or timezone.now()
+    interval_days = interval_days or getattr(settings, 'CYCLE_COUNT_INTERVAL_DAYS', DEFAULT_INTERVAL_DAYS)
+
+    ids, value, classes = classify_stock()
+    if not len(ids):
+        return {}
+
+    last_counted = _last_counted()
+    waiting = _open_scheduled_stock_ids()
+
+    days_since = np.fromiter(
+        ((now - last_counted[i]).days if last_counted.get(i) else np.inf for i in ids.tolist()),
+        dtype=np.float64, count=len(ids)
+    )
+    interval = np.select(
+        [classes == 'A', classes == 'B'],
+        [interval_days['A'], interval_days['B']],
+        default=interval_days['C']
+    ).astype(np.float64)
+    overdue = days_since / interval
+
+    eligible = (overdue >= 1) & ~np.isin(ids, np.fromiter(waiting, dtype=np.int64, count=len(waiting)))
+    candidates = np.nonzero(eligible)[0]
+    # lexsort sorts by the last key first: overdue, then value, both descending
+    candidates = candidates[np.lexsort((-value[candidates], -overdue[candidates]))][:capacity]
+
+    return {int(ids[i]): str(classes[i]) for i in candidates}
+
+
+def _scheduler_user():
+    username = getattr(settings, 'CYCLE_COUNT_USER', None)
+    users = User.objects.filter(is_active=True)
+    if username:
+        return users.filter(username=username).first()
+    return users.filter(is_superuser=True).order_by('pk').first()
+
+
+def schedule_cycle_count(day=None, capacity=None, user=None):
+    """
+    Create the cycle-count audit for a day, with its items.
+
+    Does nothing when a scheduled audit already exists for the day or no
+    items are due.
+
+    Returns:
+        StockAudit or None: The created audit.
+
+    Raises:
+        ValueError: If the capacity is not between 1 and ``MAX_CAPACITY``.
+    """
+    day = day or timezone.localdate()
+    if capacity is None:
+        capacity = getattr(settings, 'CYCLE_COUNT_DAILY_CAPACITY', DEFAULT_CAPACITY)
+    if not 1 <= capacity <= MAX_CAPACITY:
+        raise ValueError(f"Cycle count capacity must be between 1 and {MAX_CAPACITY}")
+
+    if StockAudit.objects.filter(scheduled=True, audit_type='cycle', planned_start_date=day).exists():
+        return None
+
+    user = user or _scheduler_user()
+    if user is None:
+        logger.warning("No user to own scheduled cycle counts; set CYCLE_COUNT_USER")
+        return None
+
+    picked = pick_cycle_count_items(capacity)
+    if not picked:
+        logger.info(f"No stock due for cycle counting on {day.isoformat()}")
+        return None
+
+    with transaction.atomic():
+        audit = StockAudit.objects.create(
+            audit_type='cycle',
+            title=f'Cycle Count {day.isoformat()}',
+            description='Scheduled ABC cycle count',
+            planned_start_date=day,
+            planned_end_date=day + timedelta(days=1),
+            created_by=user,
+            scheduled=True,
+            item_generation_status='completed',
+        )
+        rows = list(_snapshot_rows(audit, timezone.now(), stocks=Stock.objects.filter(id__in=picked)))
+        insert_snapshot_rows(audit.pk, rows, abc_classes=picked)
+        StockAudit.objects.filter(pk=audit.pk).update(
+            total_items_planned=len(rows),
+            item_generation_total=len(rows),
+        )
+
+    class_counts = {abc_class: list(picked.values()).count(abc_class) for abc_class in 'ABC'}
+    logger.info(
+        f"Scheduled cycle count {audit.audit_reference} with {len(rows)} items "
+        f"(A: {class_counts['A']}, B: {class_counts['B']}, C: {class_counts['C']})"
+    )
+    return audit
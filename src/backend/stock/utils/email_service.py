@@ -2,6 +2,7 @@
 Railway-friendly email service with automatic fallback
 """
 import logging
+import threading
 from django.core.mail import send_mail
 from django.conf import settings
 from django.core.mail.backends.console import EmailBackend as ConsoleBackend
@@ -66,27 +67,159 @@ class RailwayEmailService:
                 # Re-raise in development or for non-network errors
                 raise e
 
-def send_purchase_order_email_safe(purchase_order, recipient_emails, email_subject, email_body):
+# One background drain per process when there is no Celery worker
+_drain_lock = threading.Lock()
+_drain_requested = threading.Event()
+
+
+def schedule_outbox_drain():
     """
-    Safe wrapper for sending purchase order emails
+    Deliver due outbox emails once the current transaction commits.
+
+    The email worker does it when Celery is available. Otherwise a daemon
+    thread drains the outbox after the response, so SMTP never runs inside
+    the request; a drain already running in this process picks up the new
+    rows instead of starting another thread.
     """
-    service = RailwayEmailService()
-    
+    from django.db import transaction
+
+    if getattr(settings, 'CELERY_AVAILABLE', False):
+        from ..tasks import drain_email_outbox
+        transaction.on_commit(lambda: drain_email_outbox.delay())
+    else:
+        transaction.on_commit(start_background_drain)
+
+
+def start_background_drain():
+    _drain_requested.set()
+    if _drain_lock.acquire(blocking=False):
+        threading.Thread(target=_drain_in_background, name='email-outbox-drain', daemon=True).start()
+
+
+def _drain_in_background():
+    from django.db import connection
+
     try:
-        result = service.send_email(
-            subject=email_subject,
-            message='',
-            html_message=email_body,
-            from_email=settings.DEFAULT_FROM_EMAIL or settings.EMAIL_HOST_USER,
-            recipient_list=recipient_emails,
-            fail_silently=False
+        while _drain_requested.is_set():
+            _drain_requested.clear()
+            while True:
+                result = drain_outbox()
+                if not result['sent'] and not result['failed']:
+                    break
+    except Exception as e:
+        logger.error(f"Background email outbox drain failed: {e}")
+    finally:
+        connection.close()
+        _drain_lock.release()
+
+    # A request that arrived while this thread was finishing
+    if _drain_requested.is_set():
+        start_background_drain()
+
+
+def queue_purchase_order_email(purchase_order, user=None):
+    """
+    Render the purchase order email and write it to the outbox.
+
+    Call inside the same transaction as the PO status change; delivery is
+    scheduled once that transaction commits.
+
+    Returns:
+        tuple: (EmailOutbox, list of recipient emails)
+    """
+    from django.template.loader import render_to_string
+    from ..models import EmailOutbox
+
+    context = {
+        'purchase_order': purchase_order,
+        'items': purchase_order.items.all(),
+        'company_name': getattr(settings, 'COMPANY_NAME', 'Your Company'),
+    }
+    email_subject = f'Purchase Order {purchase_order.reference_number}'
+    email_body = render_to_string('stock/email/purchase_order_email.html', context)
+
+    recipient_emails = [purchase_order.manufacturer.company_email]
+    if purchase_order.manufacturer.additional_email:
+        recipient_emails.append(purchase_order.manufacturer.additional_email)
+
+    email = EmailOutbox.queue(
+        subject=email_subject,
+        recipient_list=recipient_emails,
+        html_message=email_body,
+        purchase_order=purchase_order,
+        created_by=user,
+    )
+    return email, recipient_emails
+
+
+def drain_outbox(batch_size=50, stale_after_minutes=10):
+    """
+    Deliver due outbox emails over a single reused mail connection.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+    workers never send the same email twice. Rows left in 'sending' by a
+    crashed worker are picked up again after ``stale_after_minutes``.
+
+    Returns:
+        dict: Counts of sent and failed emails
+    """
+    from datetime import timedelta
+    from django.core.mail import get_connection, EmailMultiAlternatives
+    from django.db import transaction
+    from django.db.models import Q
+    from django.utils import timezone
+    from ..models import EmailOutbox
+
+    now = timezone.now()
+    with transaction.atomic():
+        claimed_ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True).filter(
+                Q(status='pending', next_attempt_at__lte=now) |
+                Q(status='sending', updated_at__lt=now - timedelta(minutes=stale_after_minutes))
+            ).order_by('next_attempt_at').values_list('id', flat=True)[:batch_size]
         )
-        
-        if result['success']:
-            return f"Purchase Order {purchase_order.reference_number} sent successfully via {result['method']}!"
-        else:
-            return f"Purchase Order {purchase_order.reference_number} updated. {result['message']}"
-            
+        if claimed_ids:
+            EmailOutbox.objects.filter(id__in=claimed_ids).update(status='sending', updated_at=now)
+
+    if not claimed_ids:
+        return {'sent': 0, 'failed': 0}
+
+    emails = list(EmailOutbox.objects.filter(id__in=claimed_ids).order_by('next_attempt_at'))
+    sent = failed = 0
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
     except Exception as e:
-        logger.error(f"Purchase order email failed: {e}")
-        return f"Purchase Order {purchase_order.reference_number} updated, but email failed: {str(e)}"
\ No newline at end of file
+        logger.error(f"Email outbox could not connect to mail server: {e}")
+        for email in emails:
+            email.mark_failed(e)
+        return {'sent': 0, 'failed': len(emails)}
+
+    try:
+        for email in emails:
+            try:
+                message = EmailMultiAlternatives(
+                    subject=email.subject,
+                    body=email.body_text,
+                    from_email=email.from_email,
+                    to=email.recipients,
+                    connection=connection,
+                )
+                if email.body_html:
+                    message.attach_alternative(email.body_html, 'text/html')
+                message.send()
+                email.mark_sent()
+                sent += 1
+            except Exception as e:
+                logger.error(f"Outbox email {email.id} to {email.recipients} failed: {e}")
+                email.mark_failed(e)
+                failed += 1
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    logger.info(f"Email outbox drained: {sent} sent, {failed} failed")
+    return {'sent': sent, 'failed': failed}
@@ -0,0 +1,219 @@
+"""
+Scheduled low-stock evaluation
+
+Low stock is no longer checked on every Stock save. A periodic sweep finds
+all low items with one set-based query per level (catalogue-wide available
+quantity, and per-location quantity), diffs the result against the set
+alerted on the previous run, which is kept in Redis, and sends one
+aggregated notification for the items that have newly dropped to their
+re-order level. Items that recover leave the set and alert again the next
+time they run low.
+
+Without Celery there is no beat to run the sweep, so stock saves trigger it
+after commit through ``evaluate_low_stock_without_worker``, at most once per
+interval in each process.
+"""
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import Stock, StockLocation, StockReservation, Notification
+from .realtime import get_redis
+
+logger = logging.getLogger(__name__)
+
+ALERTED_STOCK_KEY = 'stockdc:low_stock:alerted:stock'
+ALERTED_LOCATION_KEY = 'stockdc:low_stock:alerted:location'
+
+# Lines listed in the alert message before it is summarised
+MESSAGE_LINES = 10
+
+# Matches the beat schedule of the evaluate-low-stock task
+FALLBACK_EVALUATION_INTERVAL_SECONDS = 600
+_last_fallback_evaluation = None
+
+
+def low_stock_items(now=None):
+    """
+    Items whose available quantity (on hand - committed - active
+    reservations) is at or below their re-order level, in one query.
+
+    Returns:
+        dict: stock id -> (item name, available, re-order level)
+    """
+    now = now or timezone.now()
+    reserved = StockReservation.objects.filter(
+        stock=OuterRef('pk'),
+        status='active',
+        expires_at__gt=now,
+    ).order_by().values('stock').annotate(total=Sum('quantity')).values('total')
+
+    rows = Stock.objects.annotate(
+        available=(
+            Coalesce(F('quantity'), Value(0))
+            - Coalesce(F('committed_quantity'), Value(0))
+            - Coalesce(Subquery(reserved), Value(0))
+        ),
+        re_order_level=Coalesce(F('re_order'), Value(0)),
+    ).filter(
+        available__lte=F('re_order_level')
+    ).order_by().values_list('id', 'item_name', 'available', 're_order_level')
+
+    return {stock_id: (item_name, available, re_order) for stock_id, item_name, available, re_order in rows}
+
+
+def low_stock_locations():
+    """
+    Store locations holding no more than the item's re-order level, in one query.
+
+    Returns:
+        dict: location id -> (item name, store name, quantity)
+    """
+    rows = StockLocation.objects.filter(
+        quantity__lte=Coalesce(F('stock__re_order'), Value(0))
+    ).order_by().values_list('id', 'stock__item_name', 'store__name', 'quantity')
+
+    return {location_id: (item_name, store_name, quantity) for location_id, item_name, store_name, quantity in rows}
+
+
+def _replace_alerted(client, key, ids):
+    """Swap the stored alerted set for the current one atomically"""
+    pipe = client.pipeline(transaction=True)
+    pipe.delete(key)
+    if ids:
+        pipe.sadd(key, *ids)
+    pipe.execute()
+
+
+def _alerted(client, key):
+    return {int(member) for member in client.smembers(key)}
+
+
+def _summarise(lines):
+    if len(lines) <= MESSAGE_LINES:
+        return lines
+    return lines[:MESSAGE_LINES] + [f'...and {len(lines) - MESSAGE_LINES} more']
+
+
+def _build_alert(new_items, new_locations):
+    """Title, message, related object and extra data for one aggregated alert"""
+    lines = [
+        f'{item_name}: {available} available (reorder level: {re_order})'
+        for item_name, available, re_order in sorted(new_items.values(), key=lambda item: item[1])
+    ]
+    location_lines = [
+        f'{item_name} at {store_name}: {quantity} units'
+        for item_name, store_name, quantity in sorted(new_locations.values(), key=lambda location: location[2])
+    ]
+
+    related_object = None
+    if len(new_items) == 1:
+        stock_id = next(iter(new_items))
+        title = f'Low Stock Alert: {new_items[stock_id][0]}'
+        related_object = Stock(id=stock_id)
+    elif new_items:
+        title = f'Low Stock Alert: {len(new_items)} items'
+    else:
+        title = f'Low Stock Alert: {len(new_locations)} store locations'
+
+    parts = []
+    if lines:
+        parts.append('; '.join(_summarise(lines)) + '.')
+    if location_lines:
+        parts.append('Low at store level: ' + '; '.join(_summarise(location_lines)) + '.')
+    message = ' '.join(parts)
+
+    extra_data = {
+        'stock_ids': sorted(new_items),
+        'location_ids': sorted(new_locations),
+    }
+    return title, message, related_object, extra_data
+
+
+def evaluate_low_stock():
+    """
+    Find newly low items and send one aggregated alert for them.
+
+    Skipped, with a warning, while Redis is unreachable: without the set
+    alerted on the previous run every low item would alert again.
+
+    Returns:
+        dict: Counts of low and newly low items and locations.
+    """
+    items = low_stock_items()
+    locations = low_stock_locations()
+
+    try:
+        client = get_redis()
+        alerted_items = _alerted(client, ALERTED_STOCK_KEY)
+        alerted_locations = _alerted(client, ALERTED_LOCATION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Low stock evaluation skipped, Redis unavailable: {e}")
+        return {'skipped': True, 'low_items': len(items), 'new_items': 0,
+                'low_locations': len(locations), 'new_locations': 0}
+    new_items = {k: v for k, v in items.items() if k not in alerted_items}
+    new_locations = {k: v for k, v in locations.items() if k not in alerted_locations}
+
+    if new_items or new_locations:
+        recipients = Notification.get_recipients_for_activity('stock_low')
+        if recipients:
+            title, message, related_object, extra_data = _build_alert(new_items, new_locations)
+            Notification.create_notification(
+                recipients=recipients,
+                notification_type='stock_low',
+                title=title,
+                message=message,
+                related_object=related_object,
+                priority='high',
+                extra_data=extra_data,
+            )
+
+    # Written after the alert so a failed delivery is retried on the next run
+    try:
+        _replace_alerted(client, ALERTED_STOCK_KEY, items)
+        _replace_alerted(client, ALERTED_LOCATION_KEY, locations)
+    except redis.RedisError as e:
+        logger.warning(f"Could not store alerted low stock, the next run may repeat alerts: {e}")
+
+    logger.info(
+        f"Low stock evaluated: {len(items)} items ({len(new_items)} new), "
+        f"{len(locations)} locations ({len(new_locations)} new)"
+    )
+    return {
+        'low_items': len(items),
+        'new_items': len(new_items),
+        'low_locations': len(locations),
+        'new_locations': len(new_locations),
+    }
+
+
+def evaluate_low_stock_without_worker():
+    """
+    Run the evaluation inline when Celery is unavailable, at most once per
+    ``FALLBACK_EVALUATION_INTERVAL_SECONDS`` in this process.
+
+    Returns:
+        dict or None: The evaluation counts, or None when nothing ran.
+    """
+    global _last_fallback_evaluation
+
+    if getattr(settings, 'CELERY_AVAILABLE', False):
+        return None
+    started = time.monotonic()
+    if (
+        _last_fallback_evaluation is not None
+        and started - _last_fallback_evaluation < FALLBACK_EVALUATION_INTERVAL_SECONDS
+    ):
+        return None
+    _last_fallback_evaluation = started
+    try:
+        return evaluate_low_stock()
+    except Exception as e:
+        # Runs after a stock save commits; an alert failure must not fail the request
+        logger.error(f"Low stock evaluation failed: {str(e)}")
+        return None
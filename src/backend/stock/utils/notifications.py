@@ -0,0 +1,329 @@
+"""
+Deferred notification events
+
+Model signals only record ``(event_type, object_id)`` pairs. The events of an
+atomic block are collected into one batch that is handed to the
+``process_notification_events`` task after commit (or processed inline when
+Celery is unavailable), so write requests never pay for recipient lookups,
+duplicate checks or notification inserts.
+"""
+import logging
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import (
+    PurchaseOrder, StockTransfer, CommittedStock, StockAudit, Invoice,
+    Payment, StockReservation, PurchaseOrderReceiving, Notification
+)
+
+logger = logging.getLogger(__name__)
+
+# Repeats of the same event for the same object inside this window are dropped
+COALESCE_SECONDS = 30
+COALESCE_CACHE_KEY = 'notification_event:{event_type}:{object_id}'
+
+PURGE_CHUNK_SIZE = 5000
+
+
+class _EventBatch:
+    """Ordered, de-duplicated events waiting for their atomic block to commit"""
+
+    def __init__(self, batches, key):
+        self.events = {}
+        self.batches = batches
+        self.key = key
+
+    def add(self, event_type, object_id):
+        self.events[(event_type, object_id)] = None
+
+    def flush(self):
+        self.batches.pop(self.key, None)
+        events, self.events = self.events, {}
+        dispatch_events([list(event) for event in events])
+
+
+def queue_notification_event(event_type, object_id):
+    """
+    Record a notification event for the current transaction.
+
+    Events raised inside one atomic block share a single on_commit hook and
+    are dispatched together once the transaction commits; outside a
+    transaction they are dispatched immediately.
+
+    Batches are kept per savepoint, and the connection holds them only
+    weakly: the on_commit hook is a batch's one strong reference, so when a
+    rollback discards the hook the batch and its events go with it and the
+    next event starts a fresh batch.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        dispatch_events([[event_type, object_id]])
+        return
+
+    batches = getattr(connection, '_notification_event_batches', None)
+    if batches is None:
+        batches = connection._notification_event_batches = weakref.WeakValueDictionary()
+
+    key = tuple(connection.savepoint_ids)
+    batch = batches.get(key)
+    if batch is None:
+        batch = batches[key] = _EventBatch(batches, key)
+        transaction.on_commit(batch.flush)
+    batch.add(event_type, object_id)
+
+
+def _coalesce(events):
+    """Drop events already dispatched for the same object within the window"""
+    fresh = []
+    for event_type, object_id in events:
+        key = COALESCE_CACHE_KEY.format(event_type=event_type, object_id=object_id)
+        try:
+            if not cache.add(key, 1, COALESCE_SECONDS):
+                continue
+        except Exception:
+            pass  # Without the cache every event is delivered
+        fresh.append([event_type, object_id])
+    return fresh
+
+
+def dispatch_events(events):
+    """Send a batch of events to the notification worker, or process it inline"""
+    events = _coalesce(events)
+    if not events:
+        return
+
+    from ..tasks import process_notification_events
+
+    try:
+        if getattr(settings, 'CELERY_AVAILABLE', False):
+            process_notification_events.delay(events)
+        else:
+            process_notification_events(events)
+    except Exception as e:
+        # Runs after commit; a notification failure must not fail the request
+        logger.error(f"Failed to dispatch notification events: {str(e)}")
+
+
+# ----------------------------
+# Event builders
+# ----------------------------
+# Each builder returns (title, message, related_object, priority) or None to skip.
+
+def _purchase_order_created(po):
+    return (
+        f'New Purchase Order Created: {po.reference_number}',
+        f'Purchase order {po.reference_number} has been created for {po.manufacturer.company_name}.',
+        po, 'medium'
+    )
+
+
+def _purchase_order_confirmed(po):
+    return (
+        f'Purchase Order Confirmed: {po.reference_number}',
+        f'Purchase order {po.reference_number} has been confirmed.',
+        po, 'medium'
+    )
+
+
+def _stock_transfer_initiated(transfer):
+    return (
+        f'Stock Transfer Initiated: {transfer.stock.item_name}',
+        f'Transfer of {transfer.quantity} units of {transfer.stock.item_name} from {transfer.from_location} to {transfer.to_location} has been initiated.',
+        transfer, 'medium'
+    )
+
+
+def _stock_transfer_completed(transfer):
+    if transfer.status != 'completed':
+        return None
+    return (
+        f'Stock Transfer Completed: {transfer.stock.item_name}',
+        f'Transfer of {transfer.quantity} units of {transfer.stock.item_name} has been completed.',
+        transfer, 'medium'
+    )
+
+
+def _stock_committed(commitment):
+    return (
+        f'Stock Committed: {commitment.stock.item_name}',
+        f'{commitment.quantity} units of {commitment.stock.item_name} have been committed for order {commitment.customer_order_number}.',
+        commitment, 'medium'
+    )
+
+
+def _reservation_created(reservation):
+    return (
+        f'Stock Reserved: {reservation.stock.item_name}',
+        f'{reservation.quantity} units of {reservation.stock.item_name} have been reserved ({reservation.get_reservation_type_display()}).',
+        reservation, 'medium'
+    )
+
+
+def _reservation_expired(reservation):
+    if reservation.status != 'expired':
+        return None
+    return (
+        f'Reservation Expired: {reservation.stock.item_name}',
+        f'Reservation of {reservation.quantity} units of {reservation.stock.item_name} for {reservation.customer_name or "no customer"} has expired.',
+        reservation, 'medium'
+    )
+
+
+def _stock_audit_started(audit):
+    return (
+        f'Stock Audit Started: {audit.audit_reference}',
+        f'Stock audit "{audit.title}" has been started.',
+        audit, 'medium'
+    )
+
+
+def _stock_audit_completed(audit):
+    return (
+        f'Stock Audit Completed: {audit.audit_reference}',
+        f'Stock audit "{audit.title}" has been completed.',
+        audit, 'high' if audit.has_variances else 'medium'
+    )
+
+
+def _invoice_created(invoice):
+    return (
+        f'New Invoice: {invoice.invoice_number}',
+        f'Invoice {invoice.invoice_number} for ${invoice.invoice_total} has been created for PO {invoice.purchase_order.reference_number}.',
+        invoice, 'medium'
+    )
+
+
+def _payment_made(payment):
+    return (
+        f'Payment Made: ${payment.payment_amount}',
+        f'Payment of ${payment.payment_amount} has been made for invoice {payment.invoice.invoice_number}.',
+        payment, 'medium'
+    )
+
+
+def _po_items_received(receiving):
+    item = receiving.purchase_order_item
+    return (
+        f'Items Received: {item.product}',
+        f'{receiving.quantity_received} units of {item.product} have been received for PO {item.purchase_order.reference_number}.',
+        item.purchase_order, 'medium'
+    )
+
+
+# event type -> (model, select_related, builder)
+EVENT_HANDLERS = {
+    'purchase_order_created': (PurchaseOrder, ['manufacturer'], _purchase_order_created),
+    'purchase_order_confirmed': (PurchaseOrder, [], _purchase_order_confirmed),
+    'stock_transfer_initiated': (StockTransfer, ['stock', 'from_location', 'to_location'], _stock_transfer_initiated),
+    'stock_transfer_completed': (StockTransfer, ['stock'], _stock_transfer_completed),
+    'stock_committed': (CommittedStock, ['stock'], _stock_committed),
+    'reservation_created': (StockReservation, ['stock'], _reservation_created),
+    'reservation_expired': (StockReservation, ['stock'], _reservation_expired),
+    'stock_audit_started': (StockAudit, [], _stock_audit_started),
+    'stock_audit_completed': (StockAudit, [], _stock_audit_completed),
+    'invoice_created': (Invoice, ['purchase_order'], _invoice_created),
+    'payment_made': (Payment, ['invoice'], _payment_made),
+    'po_items_received': (PurchaseOrderReceiving, ['purchase_order_item__purchase_order'], _po_items_received),
+}
+
+
+def _already_notified(event_type, related_object_type, object_ids):
+    """Object ids that already have a notification of this type (one query)"""
+    existing = Notification.objects.filter(
+        notification_type=event_type,
+        related_object_type=related_object_type,
+        related_object_id__in=object_ids,
+    )
+    return set(existing.values_list('related_object_id', flat=True))
+
+
+def process_events(events):
+    """
+    Turn a batch of events into notifications.
+
+    Objects are loaded with one query per event type, duplicate checks are
+    one query per type, and all notifications are written with a single
+    bulk INSERT.
+
+    Returns:
+        int: Number of notifications created.
+    """
+    ids_by_type = {}
+    for event_type, object_id in events:
+        if event_type in EVENT_HANDLERS:
+            ids_by_type.setdefault(event_type, []).append(object_id)
+
+    notifications = []
+    for event_type, object_ids in ids_by_type.items():
+        recipients = Notification.get_recipients_for_activity(event_type)
+        if not recipients:
+            continue
+
+        model, select_related, builder = EVENT_HANDLERS[event_type]
+        objects = model.objects.select_related(*select_related).in_bulk(object_ids)
+
+        skip = set()
+        if event_type == 'stock_transfer_completed':
+            skip = _already_notified(event_type, 'stock_transfer', object_ids)
+
+        for object_id in object_ids:
+            instance = objects.get(object_id)
+            if instance is None or object_id in skip:
+                continue
+            built = builder(instance)
+            if built is None:
+                continue
+
+            title, message, related_object, priority = built
+            related_object_type = Notification.get_related_object_type(related_object)
+            extra_data = {'action_url': Notification.build_action_url(related_object_type, related_object)}
+            notifications.extend(
+                Notification(
+                    recipient_id=recipient_id,
+                    notification_type=event_type,
+                    title=title,
+                    message=message,
+                    priority=priority,
+                    related_object_type=related_object_type,
+                    related_object_id=related_object.id,
+                    extra_data=extra_data,
+                )
+                for recipient_id in recipients
+            )
+
+    Notification.deliver(notifications)
+    return len(notifications)
+
+
+def purge_read_notifications(days=None, chunk_size=PURGE_CHUNK_SIZE):
+    """
+    Delete notifications that were read more than ``days`` ago.
+
+    Rows are deleted in primary-key chunks so each DELETE holds its locks
+    briefly and the unread index stays small.
+
+    Returns:
+        int: Number of notifications deleted.
+    """
+    if days is None:
+        days = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 30)
+    cutoff = timezone.now() - timedelta(days=days)
+
+    deleted = 0
+    while True:
+        ids = list(
+            Notification.objects.filter(is_read=True, read_at__lt=cutoff)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        count, _ = Notification.objects.filter(id__in=ids).delete()
+        deleted += count
+
+    logger.info(f"Purged {deleted} notifications read before {cutoff:%Y-%m-%d}")
+    return deleted
@@ -0,0 +1,504 @@
+"""
+Accounts payable services
+
+Set-based maintenance jobs for manufacturer invoices, bank statement
+reconciliation of payments and the AP aging report.
+"""
+import csv
+import io
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from ..models import Invoice, Payment, PurchaseOrderHistory, Notification
+
+logger = logging.getLogger(__name__)
+
+
+def mark_overdue_invoices(today=None):
+    """
+    Flip every pending invoice past its due date to overdue.
+
+    The affected rows are locked and updated with a single UPDATE backed by
+    the (status, due_date) index, then one notification per invoice and
+    recipient is inserted with ``bulk_create``.
+
+    Returns:
+        int: Number of invoices marked overdue.
+    """
+    today = today or timezone.localdate()
+
+    with transaction.atomic():
+        overdue = Invoice.objects.filter(status='pending', due_date__lt=today)
+        rows = list(
+            overdue.select_for_update().order_by('pk').values_list(
+                'id', 'invoice_number', 'outstanding_amount', 'due_date',
+                'purchase_order__reference_number'
+            )
+        )
+        if not rows:
+            return 0
+
+        updated = Invoice.objects.filter(
+            pk__in=[row[0] for row in rows], status='pending'
+        ).update(status='overdue', updated_at=timezone.now())
+
+        recipients = Notification.get_recipients_for_activity('invoice_overdue')
+        notifications = [
+            Notification(
+                recipient_id=recipient_id,
+                notification_type='invoice_overdue',
+                title=f'Invoice Overdue: {invoice_number}',
+                message=(
+                    f'Invoice {invoice_number} for PO {reference_number} was due on {due_date} '
+                    f'and has ${outstanding_amount} outstanding.'
+                ),
+                priority='high',
+                related_object_type='invoice',
+                related_object_id=invoice_id,
+                extra_data={'action_url': Notification.build_action_url('invoice', Invoice(id=invoice_id))},
+            )
+            for invoice_id, invoice_number, outstanding_amount, due_date, reference_number in rows
+            for recipient_id in recipients
+        ]
+        Notification.deliver(notifications)
+        Invoice.invalidate_ap_aging()
+
+    logger.info(f"Marked {updated} invoices overdue")
+    return updated
+
+
+# ----------------------------
+# Bank statement reconciliation
+# ----------------------------
+
+BANK_COLUMN_ALIASES = {
+    'date': ['date', 'transaction date', 'posted date', 'value date'],
+    'reference': ['reference', 'description', 'narrative', 'details', 'memo', 'payee'],
+    'amount': ['amount', 'debit', 'withdrawal', 'debit amount'],
+}
+BANK_DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%m/%d/%Y']
+OPEN_INVOICE_EXCLUDED_STATUSES = ['fully_paid', 'cancelled']
+
+_TOKEN_SPLIT = re.compile(r'[\s,;/|]+')
+_NON_ALNUM = re.compile(r'[^0-9A-Z]')
+_CENT = Decimal('0.01')
+
+
+def _normalize_reference(value):
+    return _NON_ALNUM.sub('', (value or '').upper())
+
+
+def _recorded_references():
+    """Normalised references of every payment that has not been cancelled"""
+    return {
+        _normalize_reference(reference)
+        for reference in Payment.objects.exclude(payment_status='cancelled').values_list(
+            'payment_reference', flat=True
+        ).iterator(chunk_size=5000)
+    }
+
+
+def _parse_bank_date(value):
+    value = (value or '').strip()
+    for fmt in BANK_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_bank_amount(value):
+    """Signed amount; accounting parentheses mean negative"""
+    cleaned = (value or '').replace('$', '').replace(',', '').strip()
+    if cleaned.startswith('(') and cleaned.endswith(')'):
+        cleaned = '-' + cleaned[1:-1]
+    try:
+        return Decimal(cleaned).quantize(_CENT)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def parse_bank_csv(uploaded_file):
+    """
+    Read a bank statement CSV into normalised lines.
+
+    Column headers are matched case-insensitively against
+    ``BANK_COLUMN_ALIASES``. Lines without a usable date or amount are
+    returned with an ``error`` so the preview can show them.
+
+    Amounts are signed so that outgoing payments are positive and incoming
+    credits (refunds, reversals) negative. A debit column already holds
+    payments as positive values; a signed ``amount`` column holding any
+    negative values is read as money in positive, money out negative and
+    flipped to match.
+
+    Returns:
+        list: One dict per statement line.
+    """
+    content = uploaded_file.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig', errors='replace')
+
+    try:
+        rows = list(csv.DictReader(io.StringIO(content)))
+    except csv.Error as e:
+        raise ValueError(f"Could not read bank CSV: {e}")
+
+    headers = {(name or '').strip().lower(): name for name in (rows[0].keys() if rows else [])}
+    columns = {}
+    for key, aliases in BANK_COLUMN_ALIASES.items():
+        columns[key] = next((headers[alias] for alias in aliases if alias in headers), None)
+    missing = [key for key, column in columns.items() if column is None]
+    if missing:
+        raise ValueError(f"Bank CSV is missing required columns: {', '.join(missing)}")
+
+    amounts = [_parse_bank_amount(row.get(columns['amount'])) for row in rows]
+    if columns['amount'].strip().lower() == 'amount' and any(a is not None and a < 0 for a in amounts):
+        amounts = [-a if a is not None else None for a in amounts]
+
+    lines = []
+    for line_number, (row, amount) in enumerate(zip(rows, amounts), start=2):
+        payment_date = _parse_bank_date(row.get(columns['date']))
+        line = {
+            'line': line_number,
+            'date': payment_date,
+            'reference': (row.get(columns['reference']) or '').strip(),
+            'amount': amount,
+        }
+        if payment_date is None:
+            line['error'] = 'Unrecognised date'
+        elif not amount:
+            line['error'] = 'Missing or zero amount'
+        lines.append(line)
+    return lines
+
+
+def match_bank_lines(lines):
+    """
+    Match statement lines to open invoices.
+
+    Open invoices and existing payment references are loaded once and
+    indexed in memory, so each line is resolved with dictionary lookups:
+
+    1. Incoming credits (negative amounts) are flagged ``credit`` and not
+       matched; a refund or reversal is not a payment.
+    2. A reference already recorded as a payment is a ``duplicate``.
+    3. A reference token equal to an invoice number matches that invoice.
+    4. Otherwise a single open invoice whose outstanding amount equals the
+       line amount is matched; several candidates are ``ambiguous``.
+
+    Returns:
+        list: The lines annotated with ``status``, ``match_type`` and the
+        matched invoice (or candidate ids).
+    """
+    by_number = defaultdict(list)
+    by_amount = defaultdict(list)
+    invoices = {}
+    open_invoices = Invoice.objects.exclude(
+        status__in=OPEN_INVOICE_EXCLUDED_STATUSES
+    ).filter(outstanding_amount__gt=0).values(
+        'id', 'invoice_number', 'outstanding_amount', 'purchase_order__reference_number'
+    )
+    for invoice in open_invoices.iterator(chunk_size=5000):
+        invoices[invoice['id']] = invoice
+        by_number[_normalize_reference(invoice['invoice_number'])].append(invoice['id'])
+        by_amount[invoice['outstanding_amount'].quantize(_CENT)].append(invoice['id'])
+
+    recorded_references = _recorded_references()
+
+    claimed = set()
+    results = []
+    for line in lines:
+        result = dict(line, status='unmatched', match_type=None, invoice=None, candidates=[])
+        results.append(result)
+        if line.get('error'):
+            result['status'] = 'invalid'
+            continue
+        if line['amount'] < 0:
+            result['status'] = 'credit'
+            continue
+
+        normalized = _normalize_reference(line['reference'])
+        if normalized and normalized in recorded_references:
+            result['status'] = 'duplicate'
+            continue
+
+        # Invoice number anywhere in the reference
+        number_hits = []
+        for token in [line['reference']] + _TOKEN_SPLIT.split(line['reference']):
+            for invoice_id in by_number.get(_normalize_reference(token), []):
+                if invoice_id not in number_hits:
+                    number_hits.append(invoice_id)
+        if len(number_hits) > 1:
+            # Same number on several POs: the amount decides
+            number_hits = [i for i in number_hits if invoices[i]['outstanding_amount'] == line['amount']] or number_hits
+
+        if len(number_hits) == 1:
+            invoice_id, match_type = number_hits[0], 'invoice_number'
+        else:
+            amount_hits = [i for i in by_amount.get(line['amount'], []) if i not in claimed]
+            candidates = number_hits or amount_hits
+            if len(candidates) != 1:
+                if candidates:
+                    result['status'] = 'ambiguous'
+                    result['candidates'] = candidates
+                continue
+            invoice_id, match_type = candidates[0], 'amount'
+
+        claimed.add(invoice_id)
+        if normalized:
+            recorded_references.add(normalized)  # Repeated lines in one statement
+        invoice = invoices[invoice_id]
+        result.update({
+            'status': 'matched',
+            'match_type': match_type,
+            'invoice': {
+                'id': invoice_id,
+                'invoice_number': invoice['invoice_number'],
+                'purchase_order': invoice['purchase_order__reference_number'],
+                'outstanding_amount': invoice['outstanding_amount'],
+            },
+            'amount_matches': invoice['outstanding_amount'] == line['amount'],
+        })
+    return results
+
+
+def record_bank_matches(matches, user, payment_method='bank_transfer'):
+    """
+    Record accepted reconciliation matches as payments in one transaction.
+
+    Each match needs ``invoice``, ``payment_reference``, ``payment_date`` and
+    ``payment_amount``. The matches come back from the client, so they are
+    checked again once the invoices are locked: a reference already recorded
+    or repeated in the batch, a closed invoice or an amount above what is
+    still outstanding is returned as an error instead of being recorded.
+    This makes a retried or double-submitted commit record nothing twice.
+
+    The accepted payments go through ``Payment.bulk_record`` and the
+    purchase order history rows are inserted with ``bulk_create``.
+
+    Returns:
+        tuple: (created Payment instances, errors), one error dict with
+        ``index``, ``payment_reference`` and ``error`` per rejected match.
+    """
+    invoices = Invoice.objects.select_related('purchase_order').in_bulk(
+        {match['invoice'] for match in matches}
+    )
+    unknown = {match['invoice'] for match in matches} - set(invoices)
+    if unknown:
+        raise ValueError(f"Unknown invoices: {', '.join(str(i) for i in sorted(unknown))}")
+
+    payments = []
+    errors = []
+    with transaction.atomic():
+        Payment.lock_invoices(invoices)
+        # Read after the lock so concurrent commits are seen
+        outstanding = dict(
+            Invoice.objects.filter(_open_invoice_q(), pk__in=invoices).values_list('pk', 'outstanding_amount')
+        )
+        recorded_references = _recorded_references()
+
+        for index, match in enumerate(matches):
+            normalized = _normalize_reference(match['payment_reference'])
+            remaining = outstanding.get(match['invoice'])
+            if not normalized:
+                error = 'Missing reference'
+            elif normalized in recorded_references:
+                error = 'Reference already recorded'
+            elif remaining is None:
+                error = 'Invoice is not open'
+            elif match['payment_amount'] > remaining:
+                error = f'Amount exceeds outstanding ${remaining}'
+            else:
+                error = None
+            if error:
+                errors.append({'index': index, 'payment_reference': match['payment_reference'], 'error': error})
+                continue
+
+            # Later matches in the batch see this one
+            recorded_references.add(normalized)
+            outstanding[match['invoice']] = remaining - match['payment_amount']
+            payments.append(Payment(
+                invoice=invoices[match['invoice']],
+                payment_reference=match['payment_reference'],
+                payment_date=match['payment_date'],
+                payment_amount=match['payment_amount'],
+                payment_method=payment_method,
+                notes='Imported from bank statement',
+                created_by=user,
+            ))
+
+        Payment.bulk_record(payments)
+        PurchaseOrderHistory.objects.bulk_create([
+            PurchaseOrderHistory(
+                purchase_order=payment.invoice.purchase_order,
+                action='payment_recorded',
+                notes=f'Payment recorded from bank statement: {payment.payment_reference} - ${payment.payment_amount}',
+                created_by=user,
+            )
+            for payment in payments
+        ], batch_size=1000)
+
+    logger.info(f"Recorded {len(payments)} payments from bank reconciliation ({len(errors)} rejected)")
+    return payments, errors
+
+
+# ----------------------------
+# AP aging report
+# ----------------------------
+
+AGING_BANDS = [
+    ('current', 'Current'),
+    ('days_1_30', '1-30 days'),
+    ('days_31_60', '31-60 days'),
+    ('days_61_90', '61-90 days'),
+    ('days_90_plus', '90+ days'),
+]
+AP_AGING_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _open_invoice_q():
+    return ~Q(status__in=OPEN_INVOICE_EXCLUDED_STATUSES) & Q(outstanding_amount__gt=0)
+
+
+def _aging_band_filters(today):
+    """Due-date filter for each aging band, keyed like AGING_BANDS"""
+    day_30, day_60, day_90 = (today - timedelta(days=days) for days in (30, 60, 90))
+    return {
+        'current': Q(due_date__gte=today),
+        'days_1_30': Q(due_date__lt=today, due_date__gte=day_30),
+        'days_31_60': Q(due_date__lt=day_30, due_date__gte=day_60),
+        'days_61_90': Q(due_date__lt=day_60, due_date__gte=day_90),
+        'days_90_plus': Q(due_date__lt=day_90),
+    }
+
+
+def _aging_band(due_date, today):
+    days_overdue = (today - due_date).days
+    if days_overdue <= 0:
+        return 'current'
+    if days_overdue <= 30:
+        return 'days_1_30'
+    if days_overdue <= 60:
+        return 'days_31_60'
+    if days_overdue <= 90:
+        return 'days_61_90'
+    return 'days_90_plus'
+
+
+def compute_ap_aging(today=None):
+    """
+    Bucket outstanding invoice amounts by manufacturer and age band.
+
+    The per-manufacturer buckets come from one grouped query using
+    conditional aggregation, and the headline invoice figures for the
+    financial dashboard from one more aggregate. Pending and overdue counts
+    follow invoice ``status``, which ``mark_overdue_invoices`` keeps current.
+
+    Returns:
+        dict: ``manufacturers`` rows with one amount per band, band
+        ``totals`` and the dashboard ``summary``.
+    """
+    today = today or timezone.localdate()
+    band_filters = _aging_band_filters(today)
+
+    rows = Invoice.objects.filter(_open_invoice_q()).order_by().values(
+        'purchase_order__manufacturer_id', 'purchase_order__manufacturer__company_name'
+    ).annotate(
+        invoice_count=Count('id'),
+        total_outstanding=Sum('outstanding_amount'),
+        **{
+            band: Sum('outstanding_amount', filter=band_filter, default=Decimal('0'))
+            for band, band_filter in band_filters.items()
+        }
+    )
+
+    manufacturers = []
+    totals = {band: Decimal('0') for band, _ in AGING_BANDS}
+    totals['total_outstanding'] = Decimal('0')
+    for row in rows:
+        manufacturers.append({
+            'manufacturer_id': row['purchase_order__manufacturer_id'],
+            'manufacturer_name': row['purchase_order__manufacturer__company_name'],
+            'invoice_count': row['invoice_count'],
+            'total_outstanding': row['total_outstanding'],
+            **{band: row[band] for band, _ in AGING_BANDS},
+        })
+        for key in totals:
+            totals[key] += row[key]
+    manufacturers.sort(key=lambda m: m['manufacturer_name'] or '')
+
+    summary = Invoice.objects.aggregate(
+        total_invoices=Count('id'),
+        pending_invoices=Count('id', filter=Q(status='pending')),
+        overdue_invoices=Count('id', filter=Q(status='overdue')),
+        total_invoice_amount=Sum('invoice_total', default=Decimal('0')),
+        total_paid_amount=Sum('total_paid', default=Decimal('0')),
+        total_outstanding=Sum('outstanding_amount', filter=_open_invoice_q(), default=Decimal('0')),
+    )
+
+    return {
+        'as_of': today.isoformat(),
+        'bands': [{'key': band, 'label': label} for band, label in AGING_BANDS],
+        'manufacturers': manufacturers,
+        'totals': totals,
+        'summary': summary,
+    }
+
+
+def get_ap_aging(refresh=False):
+    """Return today's aging report from the cache, computing it on a miss"""
+    today = timezone.localdate()
+    cache_key = Invoice.ap_aging_cache_key(today)
+    report = None if refresh else cache.get(cache_key)
+    if report is None:
+        report = compute_ap_aging(today)
+        cache.set(cache_key, report, AP_AGING_CACHE_TIMEOUT)
+    return report
+
+
+class _Echo:
+    """File-like object whose write() hands the row back to csv.writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def stream_ap_aging_csv(today=None):
+    """
+    Yield the invoice-level aging detail as CSV lines.
+
+    Rows are read with a server-side iterator so the export never holds the
+    full invoice set in memory.
+    """
+    today = today or timezone.localdate()
+    band_labels = dict(AGING_BANDS)
+    writer = csv.writer(_Echo())
+
+    yield writer.writerow([
+        'Manufacturer', 'Invoice Number', 'Purchase Order', 'Invoice Date', 'Due Date',
+        'Days Overdue', 'Aging Band', 'Invoice Total', 'Total Paid', 'Outstanding'
+    ])
+
+    invoices = Invoice.objects.filter(_open_invoice_q()).order_by(
+        'purchase_order__manufacturer__company_name', 'due_date', 'id'
+    ).values_list(
+        'purchase_order__manufacturer__company_name', 'invoice_number',
+        'purchase_order__reference_number', 'invoice_date', 'due_date',
+        'invoice_total', 'total_paid', 'outstanding_amount'
+    )
+    for manufacturer, number, reference, invoice_date, due_date, invoice_total, paid, outstanding in invoices.iterator(chunk_size=2000):
+        yield writer.writerow([
+            manufacturer, number, reference, invoice_date, due_date,
+            max((today - due_date).days, 0), band_labels[_aging_band(due_date, today)],
+            invoice_total, paid, outstanding
+        ])
@@ -0,0 +1,142 @@
+"""
+Realtime notification delivery over Redis
+
+Every change to a user's notifications bumps a per-user version counter and
+publishes a small event on the user's pub/sub channel. The SSE stream relays
+those events to the browser, and the polling fallback compares the version
+against the client's ETag so unchanged polls never reach the database.
+
+Unread counts are kept as per-user counters adjusted by the same pipeline,
+seeded from the database on first read and reconciled periodically.
+"""
+import json
+import logging
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_KEY = 'stockdc:notifications:channel:{user_id}'
+VERSION_KEY = 'stockdc:notifications:version:{user_id}'
+UNREAD_KEY = 'stockdc:notifications:unread:{user_id}'
+UNREAD_TIMEOUT = 60 * 60 * 24
+
+# Adjust a counter only once it has been seeded, never below zero
+_ADJUST_UNREAD = '''
+if redis.call('exists', KEYS[1]) == 0 then return nil end
+local value = redis.call('incrby', KEYS[1], ARGV[1])
+if value < 0 then redis.call('set', KEYS[1], 0, 'KEEPTTL') value = 0 end
+return value
+'''
+
+_client = None
+_adjust_unread_script = None
+
+
+def get_redis():
+    """Shared synchronous Redis client (connection pooled per process)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def notification_channel(user_id):
+    return CHANNEL_KEY.format(user_id=user_id)
+
+
+def _adjust_unread(keys, args, client):
+    global _adjust_unread_script
+    if _adjust_unread_script is None:
+        _adjust_unread_script = get_redis().register_script(_ADJUST_UNREAD)
+    return _adjust_unread_script(keys=keys, args=args, client=client)
+
+
+def publish_notification_changes(unread_deltas, event='created'):
+    """
+    Apply unread deltas, bump the version and publish an event for each
+    user, in one round trip.
+
+    Args:
+        unread_deltas: ``{user_id: change in unread count}``
+
+    Delivery is best effort: failures are logged and the periodic reconcile
+    repairs the counters.
+    """
+    if not unread_deltas:
+        return
+
+    payload = json.dumps({'event': event})
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id, delta in unread_deltas.items():
+            if delta:
+                _adjust_unread([UNREAD_KEY.format(user_id=user_id)], [delta], pipe)
+            pipe.incr(VERSION_KEY.format(user_id=user_id))
+            pipe.publish(notification_channel(user_id), payload)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to publish notification changes: {str(e)}")
+
+
+def get_unread_count(user_id):
+    """
+    Unread notification count from the user's counter.
+
+    A missing counter is seeded from the database; when Redis is unavailable
+    the database count is returned directly.
+    """
+    from ..models import Notification
+
+    key = UNREAD_KEY.format(user_id=user_id)
+    try:
+        value = get_redis().get(key)
+    except redis.RedisError:
+        value = None
+        key = None
+    if value is not None:
+        return int(value)
+
+    count = Notification.objects.filter(recipient_id=user_id, is_read=False).count()
+    if key:
+        try:
+            # NX: a concurrent seed or adjustment wins over this read
+            get_redis().set(key, count, ex=UNREAD_TIMEOUT, nx=True)
+        except redis.RedisError:
+            pass
+    return count
+
+
+def reconcile_unread_counts():
+    """
+    Reset every active user's unread counter from one grouped query.
+
+    Returns:
+        int: Number of counters written.
+    """
+    from django.contrib.auth.models import User
+    from django.db.models import Count
+    from ..models import Notification
+
+    counts = dict(
+        Notification.objects.filter(is_read=False).order_by().values('recipient_id').annotate(
+            total=Count('id')
+        ).values_list('recipient_id', 'total')
+    )
+    user_ids = set(User.objects.filter(is_active=True).values_list('id', flat=True)) | set(counts)
+
+    pipe = get_redis().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.set(UNREAD_KEY.format(user_id=user_id), counts.get(user_id, 0), ex=UNREAD_TIMEOUT)
+    pipe.execute()
+    return len(user_ids)
+
+
+def get_notification_version(user_id):
+    """Current notification version for a user, or None when Redis is unavailable"""
+    try:
+        version = get_redis().get(VERSION_KEY.format(user_id=user_id))
+    except redis.RedisError:
+        return None
+    return version.decode() if version else '0'
@@ -0,0 +1,259 @@
+"""
+Reorder suggestion engine
+
+Computes consumption velocity for every stock item from issue history,
+projects days of cover against the re-order level and the supplier's lead
+time, and groups the resulting suggestions by manufacturer so they can be
+drafted into purchase orders in bulk.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from ..models import (
+    Stock, StockHistory, StockReservation, Manufacturer,
+    PurchaseOrder, PurchaseOrderItem, PurchaseOrderHistory
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_COVER_DAYS = 30
+DEFAULT_LEAD_TIME_DAYS = 14
+
+SUGGESTIONS_CACHE_KEY = 'reorder_suggestions'
+SUGGESTIONS_CACHE_TIMEOUT = 60 * 60 * 26  # Outlives the nightly schedule
+
+
+def _issued_by_item_name(since):
+    """Total issued quantity per item name since the given time (one grouped query)"""
+    return dict(
+        StockHistory.objects.filter(
+            timestamp__gte=since,
+            issue_quantity__gt=0,
+        ).exclude(
+            note__startswith='Stocktake Adjustment'  # Count corrections are not consumption
+        ).order_by().values('item_name').annotate(
+            total=Sum('issue_quantity')
+        ).values_list('item_name', 'total')
+    )
+
+
+def _reserved_by_stock(now):
+    """Active reserved quantity per stock id (one grouped query)"""
+    return dict(
+        StockReservation.objects.filter(
+            status='active',
+            expires_at__gt=now,
+        ).order_by().values('stock_id').annotate(
+            total=Sum('quantity')
+        ).values_list('stock_id', 'total')
+    )
+
+
+def _last_purchase_by_product():
+    """Most recent (manufacturer id, price) per product name from purchase order lines"""
+    last_purchase = {}
+    lines = PurchaseOrderItem.objects.exclude(
+        purchase_order__status='cancelled'
+    ).order_by('purchase_order__created_at', 'id').values_list(
+        'product', 'purchase_order__manufacturer_id', 'price_inc'
+    )
+    for product, manufacturer_id, price_inc in lines.iterator(chunk_size=5000):
+        last_purchase[product] = (manufacturer_id, price_inc)
+    return last_purchase
+
+
+def compute_reorder_suggestions(window_days=DEFAULT_WINDOW_DAYS, cover_days=DEFAULT_COVER_DAYS):
+    """
+    Compute reorder suggestions for the full catalogue.
+
+    Quantities are loaded with a fixed number of flat queries and the
+    projection is evaluated as vectorised array operations, so the cost is
+    dominated by reading the rows rather than by per-item Python work.
+
+    Returns:
+        dict: Suggestions grouped by manufacturer plus an ``unassigned`` list
+        for items with no known supplier.
+    """
+    now = timezone.now()
+    since = now - timedelta(days=window_days)
+
+    rows = list(
+        Stock.objects.order_by().values_list(
+            'id', 'item_name', 'sku', 'quantity', 'committed_quantity', 're_order',
+            'source_purchase_order__manufacturer_id'
+        ).iterator(chunk_size=5000)
+    )
+
+    result = {
+        'generated_at': now.isoformat(),
+        'window_days': window_days,
+        'cover_days': cover_days,
+        'items_evaluated': len(rows),
+        'suggestion_count': 0,
+        'manufacturers': [],
+        'unassigned': [],
+    }
+    if not rows:
+        return result
+
+    issued_map = _issued_by_item_name(since)
+    reserved_map = _reserved_by_stock(now)
+    last_purchase = _last_purchase_by_product()
+    manufacturers = {
+        m_id: (name, lead_time)
+        for m_id, name, lead_time in Manufacturer.objects.values_list('id', 'company_name', 'lead_time_days')
+    }
+
+    # Resolve supplier per row: the PO the stock came from, else the latest PO line for the item
+    supplier_ids = []
+    prices = []
+    for _, item_name, _, _, _, _, source_manufacturer_id in rows:
+        purchase_manufacturer_id, price = last_purchase.get(item_name, (None, None))
+        supplier_ids.append(source_manufacturer_id or purchase_manufacturer_id)
+        prices.append(price)
+
+    count = len(rows)
+    quantity = np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=count)
+    committed = np.fromiter((r[4] or 0 for r in rows), dtype=np.int64, count=count)
+    re_order = np.fromiter((r[5] or 0 for r in rows), dtype=np.int64, count=count)
+    reserved = np.fromiter((reserved_map.get(r[0], 0) for r in rows), dtype=np.int64, count=count)
+    issued = np.fromiter((issued_map.get(r[1], 0) or 0 for r in rows), dtype=np.int64, count=count)
+    lead_time = np.fromiter(
+        (manufacturers.get(m_id, (None, DEFAULT_LEAD_TIME_DAYS))[1] for m_id in supplier_ids),
+        dtype=np.float64, count=count
+    )
+
+    available = quantity - committed - reserved
+    velocity = issued / float(window_days)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(velocity > 0, available / velocity, np.inf)
+
+    # Reorder once projected stock at delivery would dip under the re-order level
+    reorder_point = re_order + velocity * lead_time
+    target_level = reorder_point + velocity * cover_days
+    suggested = np.ceil(np.maximum(target_level - available, 0)).astype(np.int64)
+    needs_reorder = (available <= reorder_point) & (suggested > 0)
+
+    # Most urgent first
+    indices = np.nonzero(needs_reorder)[0]
+    indices = indices[np.argsort(days_of_cover[indices], kind='stable')]
+
+    groups = {}
+    for i in indices.tolist():
+        stock_id, item_name, sku = rows[i][0], rows[i][1], rows[i][2]
+        cover = days_of_cover[i]
+        suggestion = {
+            'stock_id': stock_id,
+            'item_name': item_name,
+            'sku': sku,
+            'available': int(available[i]),
+            're_order': int(re_order[i]),
+            'daily_velocity': round(float(velocity[i]), 3),
+            'days_of_cover': None if np.isinf(cover) else round(float(cover), 1),
+            'lead_time_days': int(lead_time[i]),
+            'suggested_quantity': int(suggested[i]),
+            'last_price_inc': prices[i],
+        }
+
+        manufacturer_id = supplier_ids[i]
+        if manufacturer_id not in manufacturers:
+            result['unassigned'].append(suggestion)
+            continue
+
+        if manufacturer_id not in groups:
+            name, lead = manufacturers[manufacturer_id]
+            groups[manufacturer_id] = {
+                'manufacturer_id': manufacturer_id,
+                'manufacturer_name': name,
+                'lead_time_days': lead,
+                'items': [],
+            }
+        groups[manufacturer_id]['items'].append(suggestion)
+
+    result['manufacturers'] = sorted(groups.values(), key=lambda g: g['manufacturer_name'] or '')
+    result['suggestion_count'] = int(len(indices))
+    return result
+
+
+def refresh_reorder_suggestions(window_days=DEFAULT_WINDOW_DAYS, cover_days=DEFAULT_COVER_DAYS):
+    """Recompute suggestions and store them in the cache for the dashboards"""
+    suggestions = compute_reorder_suggestions(window_days=window_days, cover_days=cover_days)
+    cache.set(SUGGESTIONS_CACHE_KEY, suggestions, SUGGESTIONS_CACHE_TIMEOUT)
+    logger.info(
+        f"Reorder suggestions refreshed: {suggestions['suggestion_count']} suggestions "
+        f"across {suggestions['items_evaluated']} items"
+    )
+    return suggestions
+
+
+def get_reorder_suggestions():
+    """Return the cached nightly suggestions, computing them if the cache is empty"""
+    suggestions = cache.get(SUGGESTIONS_CACHE_KEY)
+    if suggestions is None:
+        suggestions = refresh_reorder_suggestions()
+    return suggestions
+
+
+def create_draft_purchase_orders(suggestions, user, delivery_person, store=None,
+                                 creating_store=None, manufacturer_ids=None):
+    """
+    Create one draft PurchaseOrder per manufacturer from a suggestions payload.
+
+    Order lines and history rows are inserted with ``bulk_create`` and the
+    whole batch runs in a single transaction.
+
+    Returns:
+        list: The created PurchaseOrder instances.
+    """
+    groups = suggestions.get('manufacturers', [])
+    if manufacturer_ids:
+        wanted = set(manufacturer_ids)
+        groups = [g for g in groups if g['manufacturer_id'] in wanted]
+
+    purchase_orders = []
+    order_items = []
+    history = []
+
+    with transaction.atomic():
+        for group in groups:
+            if not group['items']:
+                continue
+
+            purchase_order = PurchaseOrder.objects.create(
+                manufacturer_id=group['manufacturer_id'],
+                delivery_person=delivery_person,
+                store=store,
+                creating_store=creating_store or store,
+                status='draft',
+                created_by=user,
+            )
+            purchase_orders.append(purchase_order)
+
+            for item in group['items']:
+                order_items.append(PurchaseOrderItem(
+                    purchase_order=purchase_order,
+                    product=(item['item_name'] or item['sku'] or f"Stock #{item['stock_id']}")[:255],
+                    price_inc=item['last_price_inc'] or Decimal('0.00'),
+                    quantity=item['suggested_quantity'],
+                ))
+
+            history.append(PurchaseOrderHistory(
+                purchase_order=purchase_order,
+                action='created',
+                notes=f"Draft created from reorder suggestions ({len(group['items'])} items)",
+                created_by=user,
+            ))
+
+        PurchaseOrderItem.objects.bulk_create(order_items, batch_size=1000)
+        PurchaseOrderHistory.objects.bulk_create(history)
+
+    return purchase_orders
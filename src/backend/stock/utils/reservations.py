@@ -0,0 +1,88 @@
+"""
+Reservation expiry sweep
+
+Reservations past their expiry time are expired by a periodic sweep rather
+than by the pages that list them. Each chunk of due reservations is locked,
+expired with one UPDATE and queued for ``reservation_expired``
+notifications, which are dispatched together when the chunk commits.
+
+Without Celery there is no beat to run the sweep, so the reservation lists
+run it themselves through ``expire_due_reservations_without_worker``, at
+most once per interval in each process.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import StockReservation
+from .notifications import queue_notification_event
+
+logger = logging.getLogger(__name__)
+
+SWEEP_CHUNK_SIZE = 1000
+
+# Matches the beat schedule of the expire-reservations task
+FALLBACK_SWEEP_INTERVAL_SECONDS = 300
+_last_fallback_sweep = None
+
+
+def due_reservations(now=None):
+    """Active reservations whose expiry time has passed"""
+    return StockReservation.objects.filter(
+        status='active',
+        expires_at__lte=now or timezone.now(),
+    )
+
+
+def expire_due_reservations(now=None, chunk_size=SWEEP_CHUNK_SIZE):
+    """
+    Expire every reservation that is past due.
+
+    Rows being fulfilled or cancelled concurrently are skipped rather than
+    waited on; the next sweep picks them up if they are still active.
+
+    Returns:
+        int: Number of reservations expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                due_reservations(now).select_for_update(skip_locked=True)
+                .order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            expired += StockReservation.objects.filter(id__in=ids).update(status='expired')
+            for reservation_id in ids:
+                queue_notification_event('reservation_expired', reservation_id)
+
+        if len(ids) < chunk_size:
+            break
+
+    if expired:
+        logger.info(f"Expired {expired} overdue reservations")
+    return expired
+
+
+def expire_due_reservations_without_worker():
+    """
+    Run the sweep inline when Celery is unavailable, at most once per
+    ``FALLBACK_SWEEP_INTERVAL_SECONDS`` in this process.
+
+    Returns:
+        int: Number of reservations expired.
+    """
+    global _last_fallback_sweep
+
+    if getattr(settings, 'CELERY_AVAILABLE', False):
+        return 0
+    started = time.monotonic()
+    if _last_fallback_sweep is not None and started - _last_fallback_sweep < FALLBACK_SWEEP_INTERVAL_SECONDS:
+        return 0
+    _last_fallback_sweep = started
+    return expire_due_reservations()
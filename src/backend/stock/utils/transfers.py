@@ -0,0 +1,187 @@
+"""
+Bulk stock transfers
+
+Moves many lines between two stores in one transaction: the origin
+locations are locked and checked in one query, the transfer rows are
+written with one bulk INSERT and, for completed batches, the origin and
+destination quantities are adjusted with one CASE UPDATE each (plus one
+INSERT for destinations the items are not stocked at yet). A single
+notification covers the whole batch.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from ..models import Stock, StockLocation, StockTransfer, Notification
+
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = 500
+
+
+class InsufficientLocationStock(ValueError):
+    """Raised when origin locations hold less than the lines ask to move"""
+
+    def __init__(self, shortages):
+        # shortages: [(stock id, available, requested)]
+        self.shortages = shortages
+        super().__init__(
+            'Not enough stock at source location for: '
+            + ', '.join(f'#{stock_id} (available {available}, requested {requested})'
+                        for stock_id, available, requested in shortages)
+        )
+
+
+def _merge_lines(lines):
+    """Sum repeated stock ids; the last destination aisle given wins"""
+    merged = {}
+    for line in lines:
+        stock_id = line['stock_id']
+        quantity, aisle = merged.get(stock_id, (0, None))
+        merged[stock_id] = (quantity + line['quantity'], line.get('to_aisle') or aisle)
+    return merged
+
+
+def _move(from_store, to_store, merged, source_ids, now):
+    """Apply a batch's quantities to the origin and destination locations"""
+    StockLocation.objects.filter(pk__in=source_ids.values()).update(
+        quantity=Case(
+            *[When(pk=source_ids[stock_id], then=F('quantity') - quantity)
+              for stock_id, (quantity, _) in merged.items()],
+            default=F('quantity'), output_field=IntegerField()
+        ),
+        last_updated=now,
+    )
+
+    destinations = dict(
+        StockLocation.objects.select_for_update().filter(
+            store=to_store, stock_id__in=merged
+        ).order_by('id').values_list('stock_id', 'id')
+    )
+    if destinations:
+        aisle_updates = [
+            When(pk=location_id, then=Value(merged[stock_id][1]))
+            for stock_id, location_id in destinations.items() if merged[stock_id][1]
+        ]
+        changes = {
+            'quantity': Case(
+                *[When(pk=location_id, then=F('quantity') + merged[stock_id][0])
+                  for stock_id, location_id in destinations.items()],
+                default=F('quantity'), output_field=IntegerField()
+            ),
+            'last_updated': now,
+        }
+        if aisle_updates:
+            changes['aisle'] = Case(*aisle_updates, default=F('aisle'))
+        StockLocation.objects.filter(pk__in=destinations.values()).update(**changes)
+
+    StockLocation.objects.bulk_create([
+        StockLocation(stock_id=stock_id, store=to_store, quantity=quantity, aisle=aisle)
+        for stock_id, (quantity, aisle) in merged.items() if stock_id not in destinations
+    ], batch_size=BULK_CHUNK_SIZE)
+
+
+def _notify(from_store, to_store, transfer_count, units, completed):
+    """One notification for a whole batch"""
+    notification_type = 'stock_transfer_completed' if completed else 'stock_transfer_initiated'
+    if completed:
+        title = f'Bulk Transfer Completed: {transfer_count} items'
+        message = f'{units} units across {transfer_count} items moved from {from_store.name} to {to_store.name}.'
+    else:
+        title = f'Bulk Transfer Initiated: {transfer_count} items'
+        message = f'Transfer of {units} units across {transfer_count} items from {from_store.name} to {to_store.name} has been initiated.'
+
+    try:
+        recipients = Notification.get_recipients_for_activity(notification_type)
+        if recipients:
+            Notification.create_notification(
+                recipients=recipients,
+                notification_type=notification_type,
+                title=title,
+                message=message,
+                priority='medium',
+                extra_data={
+                    'transfer_count': transfer_count,
+                    'units': units,
+                    'from_location_id': from_store.pk,
+                    'to_location_id': to_store.pk,
+                },
+            )
+    except Exception as e:
+        # Runs after commit; a notification failure must not fail the request
+        logger.error(f"Failed to send bulk transfer notification: {str(e)}")
+
+
+def create_bulk_transfer(from_store, to_store, lines, user, transfer_reason, notes=None, complete=False):
+    """
+    Create restock transfers for many stock items between two stores.
+
+    Args:
+        lines: Dicts with ``stock_id``, ``quantity`` and optional ``to_aisle``.
+        complete: Move the stock now and create the transfers completed;
+            otherwise they are created pending, to be approved and
+            completed as usual.
+
+    Returns:
+        dict: Transfers created and units moved.
+
+    Raises:
+        ValueError: If a stock item does not exist.
+        InsufficientLocationStock: If an origin location holds too little;
+            nothing is written.
+    """
+    merged = _merge_lines(lines)
+
+    unknown = set(merged) - set(Stock.objects.filter(id__in=merged).values_list('id', flat=True))
+    if unknown:
+        raise ValueError(f"Unknown stock items: {', '.join(str(i) for i in sorted(unknown))}")
+
+    now = timezone.now()
+    with transaction.atomic():
+        sources = {
+            stock_id: (location_id, quantity)
+            for stock_id, location_id, quantity in StockLocation.objects.select_for_update().filter(
+                store=from_store, stock_id__in=merged
+            ).order_by('id').values_list('stock_id', 'id', 'quantity')
+        }
+        shortages = [
+            (stock_id, sources.get(stock_id, (None, 0))[1], quantity)
+            for stock_id, (quantity, _) in sorted(merged.items())
+            if sources.get(stock_id, (None, 0))[1] < quantity
+        ]
+        if shortages:
+            raise InsufficientLocationStock(shortages)
+
+        StockTransfer.objects.bulk_create([
+            StockTransfer(
+                stock_id=stock_id,
+                quantity=quantity,
+                from_location=from_store,
+                to_location=to_store,
+                to_aisle=aisle,
+                transfer_type='restock',
+                transfer_reason=transfer_reason,
+                notes=notes,
+                status='completed' if complete else 'pending',
+                created_by=user,
+                completed_by=user if complete else None,
+                completed_at=now if complete else None,
+            )
+            for stock_id, (quantity, aisle) in merged.items()
+        ], batch_size=BULK_CHUNK_SIZE)
+
+        if complete:
+            _move(from_store, to_store, merged,
+                  {stock_id: location_id for stock_id, (location_id, _) in sources.items()}, now)
+
+        units = sum(quantity for quantity, _ in merged.values())
+        # bulk_create sends no post_save, so the batch gets one notification instead
+        transaction.on_commit(lambda: _notify(from_store, to_store, len(merged), units, complete))
+
+    logger.info(
+        f"Bulk transfer of {units} units across {len(merged)} items "
+        f"from {from_store.name} to {to_store.name} ({'completed' if complete else 'pending'})"
+    )
+    return {'transfers_created': len(merged), 'units': units}
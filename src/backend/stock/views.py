@@ -14,7 +14,7 @@ from .form import *
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.http import JsonResponse
-from .utils.email_service import send_purchase_order_email_safe
+from .utils.email_service import queue_purchase_order_email
 
 # Create your views here.
 
@@ -610,8 +610,7 @@ def complete_transfer(request, pk):
     """Complete an approved transfer"""
     transfer = get_object_or_404(StockTransfer, id=pk)
     
-    if transfer.can_be_completed():
-        transfer.complete(request.user)
+    if transfer.can_be_completed() and transfer.complete(request.user):
         
         # CREATE HISTORY RECORD for completion
         from django.utils import timezone
@@ -631,7 +630,7 @@ def complete_transfer(request, pk):
         
         messages.success(request, f'Transfer completed: {transfer.stock.item_name} is now at {transfer.to_location}')
     else:
-        messages.error(request, 'This transfer cannot be completed.')
+        messages.error(request, 'This transfer cannot be completed, or the source location no longer holds its quantity.')
     
     return redirect('transfer_list')
 
@@ -677,8 +676,7 @@ def mark_collected(request, pk):
     """Mark a customer collection transfer as collected"""
     transfer = get_object_or_404(StockTransfer, id=pk)
     
-    if transfer.can_be_collected():
-        transfer.mark_collected(request.user)
+    if transfer.can_be_collected() and transfer.mark_collected(request.user):
         
         # CREATE HISTORY RECORD for customer collection
         from django.utils import timezone
@@ -697,7 +695,7 @@ def mark_collected(request, pk):
         
         messages.success(request, f'Customer collection confirmed: {transfer.customer_name} collected {transfer.quantity} units of {transfer.stock.item_name}')
     else:
-        messages.error(request, 'This transfer is not awaiting collection.')
+        messages.error(request, 'This transfer is not awaiting collection, or the destination no longer holds its quantity.')
     
     return redirect('transfer_list')
 
@@ -1047,16 +1045,17 @@ def commit_stock(request, pk):
         if form.is_valid():
             commit_quantity = form.cleaned_data['quantity']
             
-            # Check if enough stock available
-            if commit_quantity > stock.available_for_sale:
-                messages.error(request, f'Cannot commit {commit_quantity} items. Only {stock.available_for_sale} available for sale.')
-                return render(request, 'stock/commit_stock.html', {'form': form, 'stock': stock})
-            
-            # Create commitment record
+            # Create commitment record, checking availability under a lock on the stock row
+            from .utils.allocation import allocate, InsufficientStock
             commitment = form.save(commit=False)
             commitment.stock = stock
             commitment.committed_by = request.user
-            commitment.save()
+            try:
+                allocate(commitment)
+            except InsufficientStock as e:
+                messages.error(request, f'Cannot commit {commit_quantity} items. Only {e.available} available for sale.')
+                return render(request, 'stock/commit_stock.html', {'form': form, 'stock': stock})
+            stock = commitment.stock
             
             # Create history record for stock commitment
             from django.utils import timezone
@@ -1088,27 +1087,31 @@ def commit_stock(request, pk):
 @login_required
 def fulfill_commitment(request, pk):
     """Fulfill a stock commitment - customer has paid in full and taken the items"""
-    commitment = CommittedStock.objects.get(id=pk)
-    
-    if commitment.is_fulfilled:
-        messages.warning(request, 'This commitment is already fulfilled.')
-        return redirect('stock_detail', pk=commitment.stock.pk)
-    
-    # Check if there's enough stock to fulfill
-    if commitment.quantity > commitment.stock.quantity:
-        messages.error(request, f'Cannot fulfill commitment. Only {commitment.stock.quantity} items in stock, but {commitment.quantity} needed.')
-        return redirect('stock_detail', pk=commitment.stock.pk)
-    
-    # Issue the stock (reduce quantity)
-    commitment.stock.quantity -= commitment.quantity
-    commitment.stock.issue_quantity = commitment.quantity
-    commitment.stock.issued_by = request.user.username
-    commitment.stock.save()
-    
-    # Mark commitment as fulfilled
-    commitment.is_fulfilled = True
-    commitment.fulfilled_at = timezone.now()
-    commitment.save()
+    with transaction.atomic():
+        # Lock the commitment and its stock so concurrent fulfils issue once
+        commitment = CommittedStock.objects.select_for_update().get(id=pk)
+        stock = Stock.objects.select_for_update().get(pk=commitment.stock_id)
+        commitment.stock = stock
+        
+        if commitment.is_fulfilled:
+            messages.warning(request, 'This commitment is already fulfilled.')
+            return redirect('stock_detail', pk=stock.pk)
+        
+        # Check if there's enough stock to fulfill
+        if commitment.quantity > (stock.quantity or 0):
+            messages.error(request, f'Cannot fulfill commitment. Only {stock.quantity} items in stock, but {commitment.quantity} needed.')
+            return redirect('stock_detail', pk=stock.pk)
+        
+        # Issue the stock (reduce quantity); committed_quantity is left to the commitment's delta
+        stock.quantity -= commitment.quantity
+        stock.issue_quantity = commitment.quantity
+        stock.issued_by = request.user.username
+        stock.save(update_fields=['quantity', 'issue_quantity', 'issued_by', 'last_updated'])
+        
+        # Mark commitment as fulfilled
+        commitment.is_fulfilled = True
+        commitment.fulfilled_at = timezone.now()
+        commitment.save()
     
     # Create history record for the stock issue
     StockHistory.objects.create(
@@ -1130,20 +1133,20 @@ def fulfill_commitment(request, pk):
 @login_required
 def cancel_commitment(request, pk):
     """Cancel a stock commitment - release the committed stock back to available"""
-    commitment = CommittedStock.objects.get(id=pk)
-    
-    if commitment.is_fulfilled:
-        messages.warning(request, 'Cannot cancel a fulfilled commitment.')
-        return redirect('stock_detail', pk=commitment.stock.pk)
-    
-    # Mark commitment as fulfilled (to remove it from active commitments)
-    # but don't issue the stock - just release it back to available
-    commitment.is_fulfilled = True
-    commitment.fulfilled_at = timezone.now()
-    commitment.save()
+    with transaction.atomic():
+        commitment = CommittedStock.objects.select_for_update().get(id=pk)
+        
+        if commitment.is_fulfilled:
+            messages.warning(request, 'Cannot cancel a fulfilled commitment.')
+            return redirect('stock_detail', pk=commitment.stock.pk)
+        
+        # Mark commitment as fulfilled (to remove it from active commitments)
+        # but don't issue the stock - just release it back to available
+        commitment.is_fulfilled = True
+        commitment.fulfilled_at = timezone.now()
+        commitment.save()
     
     # Create history record for commitment cancellation
-    from django.utils import timezone
     StockHistory.objects.create(
         category=commitment.stock.category,
         item_name=commitment.stock.item_name,
@@ -1156,8 +1159,8 @@ def cancel_commitment(request, pk):
         last_updated=timezone.now()
     )
     
-    # Note: The stock's committed_quantity will be automatically updated 
-    # when the commitment is saved due to the save() method in CommittedStock model
+    # Note: The stock's committed_quantity is reduced by the commitment's
+    # quantity when the commitment is saved (see CommittedStock.save)
     
     messages.success(request, f'Commitment cancelled for {commitment.customer_name}. Stock is now available for sale. Remember to process deposit refund manually.')
     return redirect('stock_detail', pk=commitment.stock.pk)
@@ -1634,7 +1637,6 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
 from django.utils import timezone
 from django.db import transaction
 from .tasks import send_email_async
@@ -1794,6 +1796,7 @@ def purchase_order_detail(request, pk):
         'payment_status': purchase_order.get_payment_status(),
         'overall_status_display': purchase_order.get_overall_status_display(),
         'can_create_invoices': can_create_invoices,
+        'emails': purchase_order.emails.all()[:10],
     }
     return render(request, 'stock/purchase_order_detail.html', context)
 
@@ -1880,35 +1883,25 @@ def send_purchase_order_email(request, pk):
             messages.error(request, 'Purchase order must be submitted before sending.')
             return redirect('purchase_order_detail', pk=pk)
         try:
-            context = {
-                'purchase_order': purchase_order,
-                'items': purchase_order.items.all(),
-                'company_name': getattr(settings, 'COMPANY_NAME', 'Your Company'),
-            }
-            email_subject = f'Purchase Order {purchase_order.reference_number}'
-            email_body = render_to_string('stock/email/purchase_order_email.html', context)
-            recipient_emails = [purchase_order.manufacturer.company_email]
-            if purchase_order.manufacturer.additional_email:
-                recipient_emails.append(purchase_order.manufacturer.additional_email)
-            # Use Railway-friendly email service
-            email_status_message = send_purchase_order_email_safe(
-                purchase_order, 
-                recipient_emails, 
-                email_subject, 
-                email_body
-            )
-            
-            # Update purchase order status immediately (don't wait for email)
-            purchase_order.status = 'sent'
-            purchase_order.sent_at = timezone.now()
-            purchase_order.save()
-            PurchaseOrderHistory.objects.create(
-                purchase_order=purchase_order,
-                action='sent',
-                notes=f'Purchase order sent to {", ".join(recipient_emails)}',
-                created_by=request.user
+            with transaction.atomic():
+                # Email is written to the outbox and delivered by the worker after commit
+                _, recipient_emails = queue_purchase_order_email(purchase_order, request.user)
+
+                purchase_order.status = 'sent'
+                purchase_order.sent_at = timezone.now()
+                purchase_order.save()
+                PurchaseOrderHistory.objects.create(
+                    purchase_order=purchase_order,
+                    action='sent',
+                    notes=f'Purchase order sent to {", ".join(recipient_emails)}',
+                    created_by=request.user
+                )
+            messages.success(
+                request,
+                f'Purchase Order {purchase_order.reference_number} marked as sent. The email to '
+                f'{", ".join(recipient_emails)} is pending and is being delivered in the background; '
+                f'its status is shown under Emails on this page.'
             )
-            messages.success(request, email_status_message)
         except Exception as e:
             messages.error(request, f'Failed to send email: {str(e)}')
     return redirect('purchase_order_detail', pk=pk)
@@ -2747,7 +2740,20 @@ def reserve_stock(request, pk):
     if request.method == 'POST':
         form = StockReservationForm(stock=stock, data=request.POST)
         if form.is_valid():
-            reservation = form.save(reserved_by=request.user)
+            # Availability is re-checked under a lock on the stock row
+            from .utils.allocation import allocate, InsufficientStock
+            reservation = form.save(commit=False, reserved_by=request.user)
+            try:
+                allocate(reservation)
+            except InsufficientStock as e:
+                form.add_error('quantity', f'Only {e.available} units available for reservation.')
+                context = {
+                    'title': f'Reserve Stock: {stock.item_name}',
+                    'stock': stock,
+                    'form': form,
+                }
+                return render(request, 'stock/reserve_stock.html', context)
+            stock = reservation.stock
             
             # Create history record for reservation creation
             from django.utils import timezone
@@ -2788,6 +2794,10 @@ def reservation_list(request):
         messages.error(request, 'You do not have permission to access this page.')
         return redirect('/')
     
+    # Expiry normally runs on the worker's schedule
+    from .utils.reservations import expire_due_reservations_without_worker
+    expire_due_reservations_without_worker()
+    
     # Filter reservations based on status and stock
     status_filter = request.GET.get('status', 'active')
     stock_filter = request.GET.get('stock')
@@ -2799,12 +2809,6 @@ def reservation_list(request):
     if stock_filter:
         reservations = reservations.filter(stock_id=stock_filter)
     
-    # Handle expired reservations
-    from django.utils import timezone
-    expired_reservations = reservations.filter(status='active', expires_at__lt=timezone.now())
-    for reservation in expired_reservations:
-        reservation.expire()
-    
     context = {
         'title': 'Stock Reservations',
         'reservations': reservations[:50],  # Limit for performance
@@ -2993,18 +2997,9 @@ def expire_reservations(request):
         messages.error(request, 'You do not have permission to perform this action.')
         return redirect('/')
     
-    from django.utils import timezone
-    expired_count = 0
-    
-    # Find and expire overdue reservations
-    overdue_reservations = StockReservation.objects.filter(
-        status='active',
-        expires_at__lt=timezone.now()
-    )
-    
-    for reservation in overdue_reservations:
-        if reservation.expire():
-            expired_count += 1
+    # Runs the scheduled sweep now
+    from .utils.reservations import expire_due_reservations
+    expired_count = expire_due_reservations()
     
     if expired_count > 0:
         messages.success(request, f'Expired {expired_count} overdue reservations.')
@@ -3084,10 +3079,11 @@ def create_audit(request):
             audit.save()
             form.save_m2m()  # Save many-to-many relationships
             
-            # Create audit items based on selected criteria
-            create_audit_items(audit)
+            # Audit items are generated in the background from the selected criteria
+            from .utils.audits import queue_audit_item_generation
+            queue_audit_item_generation(audit)
             
-            messages.success(request, f'Stock audit "{audit.title}" created successfully.')
+            messages.success(request, f'Stock audit "{audit.title}" created successfully. Audit items are being generated.')
             return redirect('audit_detail', audit_id=audit.pk)
     else:
         form = StockAuditForm(user=request.user)
@@ -3099,37 +3095,6 @@ def create_audit(request):
     return render(request, 'stock/create_audit.html', context)
 
 
-def create_audit_items(audit):
-    """Create audit items based on audit criteria"""
-    stock_queryset = Stock.objects.filter(quantity__gt=0)
-    
-    # Filter by locations if specified
-    if audit.audit_locations.exists():
-        stock_queryset = stock_queryset.filter(location__in=audit.audit_locations.all())
-    
-    # Filter by categories if specified
-    if audit.audit_categories.exists():
-        stock_queryset = stock_queryset.filter(category__in=audit.audit_categories.all())
-    
-    audit_items = []
-    for stock in stock_queryset:
-        audit_item = StockAuditItem(
-            audit=audit,
-            stock=stock,
-            system_quantity=stock.quantity,
-            committed_quantity=stock.committed_quantity or 0,
-            reserved_quantity=stock.reserved_quantity or 0,
-        )
-        audit_items.append(audit_item)
-    
-    # Bulk create audit items
-    StockAuditItem.objects.bulk_create(audit_items)
-    
-    # Update audit totals
-    audit.total_items_planned = len(audit_items)
-    audit.save()
-
-
 @login_required
 def start_audit(request, audit_id):
     """Start an audit by changing its status to in_progress"""
@@ -3145,10 +3110,7 @@ def start_audit(request, audit_id):
         return redirect('audit_detail', audit_id=audit.pk)
     
     # Start the audit
-    from django.utils import timezone
-    audit.status = 'in_progress'
-    audit.actual_start_date = timezone.now()
-    audit.save()
+    audit.start_audit(request.user)
     
     messages.success(request, f'Audit "{audit.title}" has been started.')
     return redirect('audit_detail', audit_id=audit.pk)
@@ -3171,11 +3133,9 @@ def count_items(request, audit_id):
     if request.method == 'POST':
         form = AuditItemBulkCountForm(request.POST, audit=audit)
         if form.is_valid():
+            # Counts and audit statistics are written in bulk
             updated_items = form.save(audit, request.user)
             
-            # Update audit statistics
-            audit.update_statistics()
-            
             messages.success(request, f'Updated counts for {len(updated_items)} items.')
             return redirect('audit_detail', audit_id=audit.pk)
     else:
@@ -3206,17 +3166,27 @@ def count_single_item(request, audit_id, item_id):
         return redirect('audit_detail', audit_id=audit.pk)
     
     if request.method == 'POST':
-        form = StockAuditItemForm(request.POST, instance=audit_item)
+        from django.utils import timezone
+        from django.db import transaction
+        with transaction.atomic():
+            # Lock the item so a concurrent count cannot change it between
+            # reading its statistics contribution and saving over it
+            audit_item = StockAuditItem.objects.select_for_update().get(pk=audit_item.pk)
+            before = audit_item.statistics_contribution
+            form = StockAuditItemForm(request.POST, instance=audit_item)
+            if form.is_valid():
+                audit_item = form.save(commit=False)
+                audit_item.counted_by = request.user
+                audit_item.count_date = timezone.now()
+                audit_item.version = StockAudit.allocate_sync_versions(audit.pk)
+                audit_item.save()
+                
+                # Adjust audit statistics by this count only
+                StockAudit.apply_statistics_delta(
+                    audit.pk, **StockAuditItem.statistics_delta(before, audit_item.statistics_contribution)
+                )
+        
         if form.is_valid():
-            audit_item = form.save(commit=False)
-            audit_item.counted_by = request.user
-            from django.utils import timezone
-            audit_item.count_date = timezone.now()
-            audit_item.save()
-            
-            # Update audit statistics
-            audit.update_statistics()
-            
             messages.success(request, f'Updated count for {audit_item.stock.item_name}.')
             return redirect('audit_detail', audit_id=audit.pk)
     else:
@@ -3245,6 +3215,18 @@ def complete_audit(request, audit_id):
         messages.error(request, 'Only in-progress audits can be completed.')
         return redirect('audit_detail', audit_id=audit.pk)
     
+    if audit.item_generation_active:
+        messages.warning(
+            request,
+            f'Audit items are still being generated ({audit.total_items_planned}/{audit.item_generation_total}). '
+            f'Wait for generation to finish before completing the audit.'
+        )
+        return redirect('audit_detail', audit_id=audit.pk)
+    
+    if not audit.can_complete():
+        messages.error(request, 'Audit cannot be completed because it has no audit items.')
+        return redirect('audit_detail', audit_id=audit.pk)
+    
     # Check if all items have been counted
     uncounted_items = audit.audit_items.filter(physical_count__isnull=True).count()
     if uncounted_items > 0:
@@ -3267,49 +3249,15 @@ def complete_audit(request, audit_id):
         
         # Auto-apply adjustments if requested
         if auto_adjust:
-            variance_items = audit.audit_items.exclude(variance_quantity=0)
-            adjustments_applied = 0
-            
-            for item in variance_items:
-                if not item.adjustment_applied:
-                    # Apply the adjustment to actual stock
-                    stock = item.stock
-                    old_quantity = stock.quantity
-                    new_quantity = item.physical_count
-                    variance = item.variance_quantity
-                    
-                    # Update stock quantity
-                    stock.quantity = new_quantity
-                    stock.save()
-                    
-                    # Create comprehensive stock history record for audit adjustment
-                    StockHistory.objects.create(
-                        category=stock.category,
-                        item_name=stock.item_name,
-                        quantity=new_quantity,  # Final quantity after adjustment
-                        receive_quantity=max(0, variance) if variance > 0 else 0,  # If positive variance (found extra stock)
-                        issue_quantity=abs(variance) if variance < 0 else 0,  # If negative variance (missing stock)
-                        received_by=request.user.username if variance > 0 else '',
-                        issued_by=request.user.username if variance < 0 else '',
-                        note=f"Auto Stock Audit Adjustment: {audit.audit_reference} | "
-                             f"System Qty: {old_quantity} → Physical Count: {new_quantity} | "
-                             f"Variance: {variance:+d} | "
-                             f"Reason: {item.get_variance_reason_display() or 'Not specified'} | "
-                             f"Notes: {item.variance_notes or 'None'}"
-                             f"{' | Issued to: Audit Adjustment - ' + audit.audit_reference if variance < 0 else ''}",
-                        created_by=request.user.username,
-                        last_updated=timezone.now(),
-                        timestamp=timezone.now()
-                    )
-                    
-                    # Mark adjustment as applied
-                    item.adjustment_applied = True
-                    item.adjustment_date = timezone.now()
-                    item.save()
-                    
-                    adjustments_applied += 1
+            from .utils.audits import schedule_audit_adjustments
+            adjustments_applied = schedule_audit_adjustments(audit, request.user)
             
-            if adjustments_applied > 0:
+            if adjustments_applied is None:
+                messages.success(
+                    request,
+                    f'Audit "{audit.title}" completed. Stock adjustments are being applied in the background.'
+                )
+            elif adjustments_applied > 0:
                 messages.success(
                     request, 
                     f'Audit "{audit.title}" completed and {adjustments_applied} stock adjustments applied automatically.'
@@ -3347,92 +3295,17 @@ def approve_audit(request, audit_id):
         return redirect('audit_detail', audit_id=audit.pk)
     
     if request.method == 'POST':
-        print("=== DEBUG: Starting audit approval ===")
-        from django.utils import timezone
-        # Apply stock adjustments for items with variances
-        variance_items = audit.audit_items.exclude(variance_quantity=0)
-        adjustments_applied = 0
-        
-        for item in variance_items:
-            print(f"DEBUG: Processing {item.stock.item_name}")
-            if not item.adjustment_applied:
-                print("DEBUG: Item not yet applied, processing...")
-                # Apply the adjustment to actual stock
-                stock = item.stock
-                old_quantity = stock.quantity
-                new_quantity = item.physical_count
-                variance = item.variance_quantity
-                
-                print(f"DEBUG: Updating quantity {old_quantity} → {new_quantity}")
-                # Update stock quantity
-                try:
-                    stock.quantity = new_quantity
-                    stock.save()
-                    print("DEBUG: Stock saved successfully")
-                except Exception as e:
-                    print(f"DEBUG ERROR: Stock save failed: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    raise
-                
-                # Create comprehensive stock history record for audit adjustment
-                try:
-                    print("DEBUG: Creating StockHistory record...")
-                    StockHistory.objects.create(
-                        category=stock.category,
-                        item_name=stock.item_name,
-                        quantity=new_quantity,  # Final quantity after adjustment
-                        receive_quantity=max(0, variance) if variance > 0 else 0,  # If positive variance (found extra stock)
-                        issue_quantity=abs(variance) if variance < 0 else 0,  # If negative variance (missing stock)
-                        received_by=request.user.username if variance > 0 else '',
-                        issued_by=request.user.username if variance < 0 else '',
-                        note=f"Stock Audit Adjustment: {audit.audit_reference} | "
-                             f"System Qty: {old_quantity} → Physical Count: {new_quantity} | "
-                             f"Variance: {variance:+d} | "
-                             f"Reason: {item.get_variance_reason_display() or 'Not specified'} | "
-                             f"Notes: {item.variance_notes or 'None'}"
-                             f"{' | Issued to: Audit Adjustment - ' + audit.audit_reference if variance < 0 else ''}",
-                        created_by=request.user.username,
-                        last_updated=timezone.now(),
-                        timestamp=timezone.now()
-                    )
-                    print("DEBUG: StockHistory created successfully")
-                except Exception as e:
-                    print(f"DEBUG ERROR: StockHistory creation failed: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    raise
-                
-                # Mark adjustment as applied
-                try:
-                    print("DEBUG: Marking adjustment as applied...")
-                    item.adjustment_applied = True
-                    item.adjustment_date = timezone.now()
-                    item.save()
-                    print("DEBUG: Adjustment marked successfully")
-                except Exception as e:
-                    print(f"DEBUG ERROR: Marking adjustment failed: {e}")
-                    raise
-                
-                adjustments_applied += 1
-                print(f"DEBUG: Applied {adjustments_applied} adjustments so far")
+        # Approve the audit; adjustments are applied in bulk (by the worker for large audits)
+        pending = audit.audit_items.filter(adjustment_applied=False).exclude(variance_quantity=0).count()
+        audit.approve_audit(request.user)
         
-        # Approve the audit
-        try:
-            print("DEBUG: Approving audit...")
-            audit.status = 'approved'
-            audit.approved_by = request.user
-            audit.save()
-            print("DEBUG: Audit approved successfully")
-        except Exception as e:
-            print(f"DEBUG ERROR: Audit approval failed: {e}")
-            raise
-        
-        print(f"=== DEBUG: Completed successfully with {adjustments_applied} adjustments ===")
-        messages.success(
-            request, 
-            f'Audit approved. Applied {adjustments_applied} stock adjustments.'
-        )
+        if audit.audit_items.filter(adjustment_applied=False).exclude(variance_quantity=0).exists():
+            messages.success(request, f'Audit approved. {pending} stock adjustments are being applied in the background.')
+        else:
+            messages.success(
+                request, 
+                f'Audit approved. Applied {pending} stock adjustments.'
+            )
         return redirect('audit_detail', audit_id=audit.pk)
     
     # Show confirmation page
@@ -3488,20 +3361,20 @@ def invoice_list(request):
         if manufacturer:
             invoices = invoices.filter(purchase_order__manufacturer=manufacturer)
     
-    # Calculate summary statistics
-    total_invoices = invoices.count()
-    total_amount = sum(invoice.invoice_total for invoice in invoices)
-    total_paid = sum(invoice.total_paid for invoice in invoices)
-    total_outstanding = sum(invoice.outstanding_amount for invoice in invoices)
+    # Calculate summary statistics in one aggregate
+    from django.db.models import Count, Sum
+    totals = invoices.aggregate(
+        total_invoices=Count('id'),
+        total_amount=Sum('invoice_total', default=0),
+        total_paid=Sum('total_paid', default=0),
+        total_outstanding=Sum('outstanding_amount', default=0),
+    )
     
     context = {
         'title': 'Invoice Management',
         'invoices': invoices.order_by('-created_at'),
         'form': form,
-        'total_invoices': total_invoices,
-        'total_amount': total_amount,
-        'total_paid': total_paid,
-        'total_outstanding': total_outstanding,
+        **totals,
     }
     return render(request, 'stock/invoice_list.html', context)
 
@@ -3691,39 +3564,20 @@ def financial_dashboard(request):
         messages.error(request, 'You do not have permission to view financial reports.')
         return redirect('/')
     
-    from django.db.models import Sum, Count
-    from datetime import datetime, timedelta
-    
-    # Get date range (default to last 30 days)
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=30)
+    from .utils.payables import get_ap_aging
     
-    # Invoice statistics
-    total_invoices = Invoice.objects.count()
-    pending_invoices = Invoice.objects.filter(status='pending').count()
-    overdue_invoices = Invoice.objects.filter(status='overdue').count()
-    
-    # Amount statistics
-    total_invoice_amount = Invoice.objects.aggregate(
-        total=Sum('invoice_total')
-    )['total'] or 0
-    
-    total_paid_amount = Invoice.objects.aggregate(
-        total=Sum('total_paid')
-    )['total'] or 0
-    
-    total_outstanding = Invoice.objects.aggregate(
-        total=Sum('outstanding_amount')
-    )['total'] or 0
+    # Headline figures and aging buckets come from the cached AP aging report
+    aging = get_ap_aging(refresh=request.GET.get('refresh') == 'true')
+    summary = aging['summary']
     
     # Recent activity
-    recent_invoices = Invoice.objects.order_by('-created_at')[:5]
-    recent_payments = Payment.objects.order_by('-created_at')[:5]
+    recent_invoices = Invoice.objects.select_related('purchase_order').order_by('-created_at')[:5]
+    recent_payments = Payment.objects.select_related('invoice').order_by('-created_at')[:5]
     
     # Overdue invoices
     overdue_invoice_list = Invoice.objects.filter(
         status='overdue'
-    ).order_by('due_date')[:10]
+    ).select_related('purchase_order').order_by('due_date')[:10]
     
     # Purchase orders needing invoices
     pos_needing_invoices = PurchaseOrder.objects.filter(
@@ -3731,14 +3585,18 @@ def financial_dashboard(request):
         invoices__isnull=True
     ).order_by('-updated_at')[:10]
     
+    total_invoice_amount = summary['total_invoice_amount']
+    total_paid_amount = summary['total_paid_amount']
+    
     context = {
         'title': 'Financial Dashboard',
-        'total_invoices': total_invoices,
-        'pending_invoices': pending_invoices,
-        'overdue_invoices': overdue_invoices,
+        'total_invoices': summary['total_invoices'],
+        'pending_invoices': summary['pending_invoices'],
+        'overdue_invoices': summary['overdue_invoices'],
         'total_invoice_amount': total_invoice_amount,
         'total_paid_amount': total_paid_amount,
-        'total_outstanding': total_outstanding,
+        'total_outstanding': summary['total_outstanding'],
+        'aging': aging,
         'recent_invoices': recent_invoices,
         'recent_payments': recent_payments,
         'overdue_invoice_list': overdue_invoice_list,
@@ -3748,6 +3606,23 @@ def financial_dashboard(request):
     return render(request, 'stock/financial_dashboard.html', context)
 
 
+@login_required
+def ap_aging_export(request):
+    """Stream the invoice-level AP aging detail as CSV"""
+    from .utils.permissions import has_permission
+    if not has_permission(request.user, 'can_view_financial_reports'):
+        messages.error(request, 'You do not have permission to view financial reports.')
+        return redirect('/')
+    
+    from django.http import StreamingHttpResponse
+    from .utils.payables import stream_ap_aging_csv
+    
+    today = timezone.localdate()
+    response = StreamingHttpResponse(stream_ap_aging_csv(today), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="AP_Aging_{today.isoformat()}.csv"'
+    return response
+
+
 # ----------------------------
 # AJAX and Utility Views
 # ----------------------------
@@ -3815,10 +3690,12 @@ def get_notifications(request):
     from django.utils import timezone
     
     # Get unread notifications for the current user, latest first
-    notifications = Notification.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).order_by('-created_at')[:20]  # Limit to 20 most recent
+    notifications = Notification.resolve_action_urls(
+        Notification.objects.filter(
+            recipient=request.user,
+            is_read=False
+        ).order_by('-created_at')[:20]  # Limit to 20 most recent
+    )
     
     notifications_data = []
     for notification in notifications:
@@ -3844,7 +3721,8 @@ def get_notifications(request):
             'created_at': notification.created_at.isoformat(),
             'time_ago': time_ago,
             'action_url': notification.get_action_url(),
-            'icon_class': get_notification_icon_class(notification.notification_type)
+            'icon_class': get_notification_icon_class(notification.notification_type),
+            'occurrence_count': notification.occurrence_count
         })
     
     return JsonResponse({
@@ -3886,11 +3764,12 @@ def mark_all_notifications_read(request):
             is_read=False
         )
         
-        count = notifications.count()
-        notifications.update(
+        count = notifications.update(
             is_read=True,
             read_at=timezone.now()
         )
+        if count:
+            Notification.publish_changes({request.user.id: -count}, event='read')
         
         return JsonResponse({
             'success': True,
@@ -3903,14 +3782,90 @@ def mark_all_notifications_read(request):
 @login_required
 def get_unread_count(request):
     """AJAX endpoint to get count of unread notifications"""
-    from .models import Notification
+    from .utils.realtime import get_unread_count as get_cached_unread_count
     
-    count = Notification.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).count()
+    return JsonResponse({'count': get_cached_unread_count(request.user.id)})
+
+
+@login_required
+def poll_notifications(request):
+    """
+    Polling fallback for the notification stream.
+
+    The response ETag is the user's notification version held in Redis, so a
+    poll with a matching If-None-Match is answered 304 without a query.
+    """
+    from django.http import HttpResponseNotModified
+    from django.utils.cache import patch_cache_control
+    from .utils.realtime import get_notification_version, get_unread_count as get_cached_unread_count
+    
+    version = get_notification_version(request.user.id)
+    etag = f'"{request.user.id}-{version}"' if version is not None else None
+    if etag and request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({'count': get_cached_unread_count(request.user.id), 'version': version})
     
-    return JsonResponse({'count': count})
+    if etag:
+        response['ETag'] = etag
+    # Let the browser revalidate on every poll so fetch() gets the 304 for free
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+NOTIFICATION_STREAM_HEARTBEAT_SECONDS = 25
+
+
+async def notification_stream(request):
+    """
+    Server-Sent Events stream of notification changes for the current user.
+
+    Relays the user's Redis pub/sub channel. Only served under ASGI (the
+    events service); under WSGI it answers 204 so EventSource stops
+    reconnecting and the page falls back to polling.
+    """
+    import json
+    import redis.asyncio as aioredis
+    from asgiref.sync import sync_to_async
+    from django.core.handlers.asgi import ASGIRequest
+    from django.http import StreamingHttpResponse
+    from .utils.realtime import notification_channel, get_unread_count as get_cached_unread_count
+    
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    channel = notification_channel(user.id)
+    
+    async def events():
+        client = aioredis.from_url(settings.REDIS_URL)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            count = await sync_to_async(get_cached_unread_count)(user.id)
+            yield f"event: count\ndata: {json.dumps({'count': count})}\n\n"
+            
+            while True:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=NOTIFICATION_STREAM_HEARTBEAT_SECONDS
+                )
+                if message is None:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: notification\ndata: {message['data'].decode()}\n\n"
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+            await client.aclose()
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def get_notification_icon_class(notification_type):
@@ -3949,20 +3904,33 @@ def notifications_list(request):
     paginator = Paginator(notifications, 20)  # Show 20 notifications per page
     page_number = request.GET.get('page')
     notifications_page = paginator.get_page(page_number)
+    notifications_page.object_list = Notification.resolve_action_urls(notifications_page.object_list)
     
     # Mark viewed notifications as read (optional behavior)
     if request.method == 'POST' and 'mark_all_read' in request.POST:
         from django.utils import timezone
-        notifications.filter(is_read=False).update(
+        marked = notifications.filter(is_read=False).update(
             is_read=True,
             read_at=timezone.now()
         )
+        if marked:
+            Notification.publish_changes({request.user.id: -marked}, event='read')
         return redirect('notifications_list')
     
+    user_role = getattr(request.user, 'role', None)
+    if request.method == 'POST' and 'digest_mode' in request.POST and user_role:
+        user_role.notification_digest = request.POST.get('digest_mode') == 'on'
+        user_role.save(update_fields=['notification_digest'])
+        messages.success(request, 'Notification digest ' + ('enabled.' if user_role.notification_digest else 'disabled.'))
+        return redirect('notifications_list')
+    
+    from .utils.realtime import get_unread_count as get_cached_unread_count
+    
     context = {
         'notifications': notifications_page,
-        'unread_count': notifications.filter(is_read=False).count(),
-        'total_count': notifications.count(),
+        'unread_count': get_cached_unread_count(request.user.id),
+        'total_count': paginator.count,
+        'digest_mode': bool(user_role and user_role.notification_digest),
     }
     
     return render(request, 'stock/notifications_list.html', context)
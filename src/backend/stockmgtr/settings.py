@@ -152,10 +152,12 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # CACHING - Use Redis in production, local memory in development
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': os.getenv('REDIS_URL', 'redis://redis:6379/0'),
+        'LOCATION': REDIS_URL,
         'KEY_PREFIX': 'stockdc',
         'TIMEOUT': 300,  # 5 minutes default timeout
     }
@@ -228,6 +230,14 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 REGISTRATION_OPEN = True
 
+# Read notifications older than this are purged nightly
+NOTIFICATION_RETENTION_DAYS = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 30))
+
+# Nightly ABC cycle counts: items per audit and days between counts per class
+CYCLE_COUNT_DAILY_CAPACITY = int(os.getenv('CYCLE_COUNT_DAILY_CAPACITY', 300))
+CYCLE_COUNT_INTERVAL_DAYS = {'A': 30, 'B': 90, 'C': 180}
+CYCLE_COUNT_USER = os.getenv('CYCLE_COUNT_USER')  # Owner of scheduled audits; first superuser if unset
+
 # EMAIL SETTINGS - Production-friendly configuration
 # Always try SMTP first, handle failures gracefully in code
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -308,6 +318,48 @@ if is_redis_available():
     CELERY_TASK_ROUTES = {
         'stock.tasks.send_email_async': {'queue': 'email'},
         'stock.tasks.send_purchase_order_email': {'queue': 'email'},
+        'stock.tasks.drain_email_outbox': {'queue': 'email'},
+        'stock.tasks.process_notification_events': {'queue': 'notifications'},
+    }
+
+    # Periodic tasks (run by `celery -A stockmgtr beat`)
+    from celery.schedules import crontab
+    CELERY_BEAT_SCHEDULE = {
+        'generate-reorder-suggestions': {
+            'task': 'stock.tasks.generate_reorder_suggestions',
+            'schedule': crontab(hour=2, minute=0),
+        },
+        # Low-stock alerts are evaluated in batch rather than on each Stock save
+        'evaluate-low-stock': {
+            'task': 'stock.tasks.evaluate_low_stock',
+            'schedule': crontab(minute='*/10'),
+        },
+        # Reservations are expired here; without Celery the reservation lists run the sweep
+        'expire-reservations': {
+            'task': 'stock.tasks.expire_reservations',
+            'schedule': crontab(minute='*/5'),
+        },
+        'schedule-cycle-count': {
+            'task': 'stock.tasks.schedule_cycle_count',
+            'schedule': crontab(hour=1, minute=30),
+        },
+        'mark-overdue-invoices': {
+            'task': 'stock.tasks.mark_overdue_invoices',
+            'schedule': crontab(hour=0, minute=5),
+        },
+        'reconcile-unread-notification-counts': {
+            'task': 'stock.tasks.reconcile_unread_notification_counts',
+            'schedule': crontab(minute='*/15'),
+        },
+        'purge-read-notifications': {
+            'task': 'stock.tasks.purge_read_notifications',
+            'schedule': crontab(hour=3, minute=30),
+        },
+        # Picks up outbox retries whose backoff has elapsed
+        'drain-email-outbox': {
+            'task': 'stock.tasks.drain_email_outbox',
+            'schedule': 60.0,
+        },
     }
 
     # Celery worker configuration